@@ -1,5 +1,7 @@
 from django.contrib import admin
-from apps.listings.models import Listing, ListingImage, Facility, ForWhom
+from django.utils import timezone
+from apps.listings.models import Listing, ListingImage, Facility, ForWhom, ImageVerdict, UploadSession
+from apps.listings.documents import schedule_document_refresh
 
 # Register your models here.
 
@@ -10,19 +12,33 @@ class ForWhomAdmin(admin.ModelAdmin):
 
 @admin.register(ListingImage)
 class ListingImageAdmin(admin.ModelAdmin):
-    list_display = ('id', 'listing', 'image')
-    search_fields = ('listing__title',)
+    list_display = ('id', 'listing', 'image', 'sha256')
+    search_fields = ('listing__title', 'sha256')
     # model = Listing
     # extra = 1
 
 
+@admin.register(ImageVerdict)
+class ImageVerdictAdmin(admin.ModelAdmin):
+    list_display = ('sha256', 'label', 'confidence', 'created_at')
+    search_fields = ('sha256', 'phash')
+    list_filter = ('label',)
+
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'filename', 'offset', 'size', 'state', 'expires_at')
+    search_fields = ('id', 'user__email', 'filename')
+    list_filter = ('state',)
+
+
 @admin.register(Listing)
 class ListingAdmin(admin.ModelAdmin):
-    list_display = ('id', 'title', 'host', 'price', 'location', 'state', 'is_active', 'created_at')
+    list_display = ('id', 'title', 'host', 'price', 'location', 'state', 'is_active', 'images_checked_at', 'created_at')
     search_fields = ('title', 'description', 'location', 'host__username', 'host__email')
-    list_filter = ('state', 'is_active', 'created_at', 'region', 'district')
+    list_filter = ('state', 'is_active', ('images_checked_at', admin.EmptyFieldListFilter), 'created_at', 'region', 'district')
     list_editable = ('state', 'is_active')  # Allow quick editing from list view
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('images_checked_at', 'created_at', 'updated_at')
     # inlines = [ListingImage]
     ordering = ('-created_at',)
     
@@ -37,8 +53,9 @@ class ListingAdmin(admin.ModelAdmin):
             'fields': ('rooms', 'floor_of_this_apartment', 'total_floor_of_building', 'phone_number', 'type')
         }),
         ('Status', {
-            'fields': ('state', 'is_active'),
-            'description': 'Change state to ACCEPTED to show on homepage'
+            'fields': ('state', 'is_active', 'images_checked_at'),
+            'description': 'Change state to ACCEPTED to show on homepage. '
+                           'Photos that pass the automatic check still need approval here.'
         }),
         ('For Whom', {
             'fields': ('for_whom',)
@@ -52,17 +69,23 @@ class ListingAdmin(admin.ModelAdmin):
     actions = ['approve_listings', 'reject_listings', 'set_to_checking']
     
     def approve_listings(self, request, queryset):
-        updated = queryset.update(state='ACCEPTED')
+        listing_ids = list(queryset.values_list('id', flat=True))
+        updated = queryset.update(state='ACCEPTED', updated_at=timezone.now())
+        schedule_document_refresh(*listing_ids)
         self.message_user(request, f'{updated} listing(s) approved successfully.')
     approve_listings.short_description = "Approve selected listings"
     
     def reject_listings(self, request, queryset):
-        updated = queryset.update(state='REJECTED')
+        listing_ids = list(queryset.values_list('id', flat=True))
+        updated = queryset.update(state='REJECTED', updated_at=timezone.now())
+        schedule_document_refresh(*listing_ids)
         self.message_user(request, f'{updated} listing(s) rejected.')
     reject_listings.short_description = "Reject selected listings"
     
     def set_to_checking(self, request, queryset):
-        updated = queryset.update(state='CHECKING')
+        listing_ids = list(queryset.values_list('id', flat=True))
+        updated = queryset.update(state='CHECKING', updated_at=timezone.now())
+        schedule_document_refresh(*listing_ids)
         self.message_user(request, f'{updated} listing(s) set to checking.')
     set_to_checking.short_description = "Set to checking status"
 
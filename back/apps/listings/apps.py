@@ -5,3 +5,6 @@ class ListingsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.listings'
     label = 'listings'
+
+    def ready(self):
+        from apps.listings import signals  # noqa: F401
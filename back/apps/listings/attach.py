@@ -0,0 +1,126 @@
+"""
+Attaching uploaded photos to a listing in one go.
+
+`attach_images` normalizes, hashes and writes every upload to storage from a
+thread pool, then inserts all ListingImage rows with a single bulk_create.
+bulk_create sends no model signals, so the work of the ListingImage signal
+handlers (content addressing, search document refresh, variants, Nyckel
+validation) is done here explicitly.
+
+Files written for a transaction that does not commit are removed again,
+unless a concurrent upload of the same bytes took them meanwhile (see
+apps.listings.images.reuse_file). Wrap the transaction in
+`atomic_with_files()` to cover failures after the attach as well; otherwise
+only a failing insert cleans up, and anything left behind is collected by
+`collect_orphan_media`.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+
+from apps.listings.conditional import touch_listings
+from apps.listings.documents import schedule_document_refresh
+from apps.listings.images import content_address, discard_file, normalize_upload, stored_version
+from apps.listings.models import ListingImage
+from apps.listings.tasks import queue_image_variants
+from apps.listings.validation import schedule_image_validation
+from apps.shared.utils import get_logger
+
+logger = get_logger()
+
+_written = threading.local()
+
+
+@contextmanager
+def atomic_with_files():
+    """transaction.atomic() that also removes the photos stored inside it when it rolls back"""
+    outer = getattr(_written, 'files', None)
+    files = _written.files = []
+    try:
+        with transaction.atomic():
+            yield
+    except BaseException:
+        discard(files)
+        raise
+    else:
+        if outer is not None:
+            # an enclosing block may still roll back
+            outer.extend(files)
+    finally:
+        _written.files = outer
+
+
+def discard(written):
+    for name, version in written:
+        try:
+            discard_file(name, version)
+        except Exception as e:
+            logger.error(f"Could not remove listing image file {name}: {str(e)}")
+
+
+def prepare(listing, upload):
+    """Unsaved row for an upload, normalized and content-addressed"""
+    image = ListingImage(listing=listing, image=normalize_upload(upload))
+    content_address(image)
+    return image
+
+
+def store(image):
+    """Write the row's file, returns its storage name and `stored_version`"""
+    file = image.image
+    file.save(os.path.basename(file.name), file.file, save=False)
+    return file.name, stored_version(file.name)
+
+
+def attach_images(listing, uploads):
+    """Store `uploads` and attach them to `listing`, returns the new ListingImage rows"""
+    uploads = list(uploads)
+    if not uploads:
+        return []
+    workers = min(settings.LISTING_IMAGE_ATTACH_WORKERS, len(uploads))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        images = list(pool.map(lambda upload: prepare(listing, upload), uploads))
+
+        # the same photo twice in one upload is written once
+        writers = {}
+        for image in images:
+            if not image.image._committed:
+                writers.setdefault(image.sha256 or id(image), image)
+        futures = [pool.submit(store, image) for image in writers.values()]
+        written, errors = [], []
+        for future in futures:
+            try:
+                written.append(future.result())
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            discard(written)
+            raise errors[0]
+
+    for image in images:
+        writer = writers.get(image.sha256 or id(image))
+        if writer is not None and writer is not image:
+            image.image.name = writer.image.name
+            image.image._committed = True
+
+    tracked = getattr(_written, 'files', None)
+    if tracked is not None:
+        tracked.extend(written)
+    try:
+        with transaction.atomic():
+            images = ListingImage.objects.bulk_create(images)
+            touch_listings(listing.pk)
+            schedule_document_refresh(listing.pk)
+    except Exception:
+        if tracked is None:
+            discard(written)
+        raise
+
+    for image in images:
+        queue_image_variants(image.pk)
+        schedule_image_validation(listing.pk, image.pk)
+    return images
@@ -0,0 +1,112 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from apps.shared.utils import get_logger
+
+logger = get_logger()
+
+CATALOGUE_VERSION_KEY = 'listings:catalogue-version'
+
+# Query parameters that change the feed response; anything else is ignored
+# so that tracking parameters do not fragment the cache.
+FEED_CACHE_PARAMS = (
+    'price__gte',
+    'price__lte',
+    'region',
+    'district',
+    'floor_of_this_apartment',
+    'rooms',
+    'for_whom__name',
+    'type',
+    'search',
+    'ordering',
+    'cursor',
+    'page_size',
+    'with_count',
+)
+
+# Facet counts only depend on the filter state, not on the page.
+FACET_CACHE_PARAMS = tuple(
+    name for name in FEED_CACHE_PARAMS
+    if name not in ('ordering', 'cursor', 'page_size', 'with_count')
+)
+
+
+def get_catalogue_version():
+    """Current catalogue version; every cached feed page is keyed on it"""
+    version = cache.get(CATALOGUE_VERSION_KEY)
+    if version is None:
+        # Seed from the clock so an evicted counter never reuses an old version.
+        cache.add(CATALOGUE_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(CATALOGUE_VERSION_KEY)
+    return version
+
+
+def bump_catalogue_version():
+    try:
+        cache.incr(CATALOGUE_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOGUE_VERSION_KEY, time.time_ns(), timeout=None)
+    except Exception as e:
+        logger.error(f"Failed to bump listings catalogue version: {str(e)}")
+
+
+def invalidate_catalogue():
+    """Bump the version once the current transaction commits"""
+    transaction.on_commit(bump_catalogue_version)
+
+
+def normalize_feed_query(query_params, params=FEED_CACHE_PARAMS):
+    items = []
+    for name in params:
+        values = sorted(v.strip() for v in query_params.getlist(name) if v.strip())
+        items.extend((name, value) for value in values)
+    return urlencode(items)
+
+
+def current_catalogue_version():
+    """The catalogue version, or None when the cache cannot keep one"""
+    try:
+        return get_catalogue_version()
+    except Exception as e:
+        logger.error(f"Listings cache is unavailable: {str(e)}")
+        return None
+
+
+def feed_fingerprint(request, params=FEED_CACHE_PARAMS):
+    return f'{request.get_host()}?{normalize_feed_query(request.query_params, params)}'
+
+
+def feed_cache_key(request, prefix='feed', params=FEED_CACHE_PARAMS):
+    """Cache key for a feed request, or None when the cache is off or unavailable"""
+    if not settings.LISTINGS_FEED_CACHE:
+        return None
+    version = current_catalogue_version()
+    if version is None:
+        return None
+    digest = hashlib.sha1(feed_fingerprint(request, params).encode()).hexdigest()
+    return f'listings:{prefix}:{version}:{digest}'
+
+
+def get_cached(key):
+    if key is None:
+        return None
+    try:
+        return cache.get(key)
+    except Exception as e:
+        logger.error(f"Listings cache read failed: {str(e)}")
+        return None
+
+
+def set_cached(key, value, timeout=None):
+    if key is None:
+        return
+    try:
+        cache.set(key, value, timeout or settings.LISTINGS_FEED_CACHE_TIMEOUT)
+    except Exception as e:
+        logger.error(f"Listings cache write failed: {str(e)}")
@@ -0,0 +1,52 @@
+"""
+Validators for conditional GETs on listings.
+
+Tokens are built from version information only (updated_at, the catalogue
+version, the gazetteer version), so a matching If-None-Match is answered
+with 304 before anything is serialized.
+"""
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from apps.listings.cache import FEED_CACHE_PARAMS, current_catalogue_version, feed_fingerprint
+from apps.listings.models import Listing
+from apps.shared.conditional import version_etag
+from apps.shared.gazetteer import get_gazetteer
+
+
+def touch_listings(*listing_ids):
+    """Bump updated_at for changes stored outside the listing row (images, for_whom)"""
+    ids = {listing_id for listing_id in listing_ids if listing_id is not None}
+    if ids:
+        Listing.objects.filter(pk__in=ids).update(updated_at=timezone.now())
+
+
+def listing_validators(listing_id):
+    """(etag, last_modified) for the listing detail, (None, None) when there is nothing to compare"""
+    updated_at = Listing.objects.filter(pk=listing_id).values_list('updated_at', flat=True).first()
+    if updated_at is None:
+        return None, None
+    # Region / district names are rendered from the gazetteer
+    return version_etag('listing', listing_id, updated_at.isoformat(), get_gazetteer().version), updated_at
+
+
+def host_listings_validators(user):
+    """(etag, last_modified) for the listings of one host"""
+    stats = Listing.objects.filter(host=user).aggregate(last_modified=Max('updated_at'), total=Count('id'))
+    last_modified = stats['last_modified']
+    etag = version_etag(
+        'host-listings', user.pk, stats['total'],
+        last_modified.isoformat() if last_modified else '', get_gazetteer().version,
+    )
+    return etag, last_modified
+
+
+def feed_etag(request, prefix='feed', params=FEED_CACHE_PARAMS):
+    """
+    Feed and facet responses only change with the catalogue version and the
+    normalized query, cached or not. None when no version is kept.
+    """
+    version = current_catalogue_version()
+    if version is None:
+        return None
+    return version_etag(prefix, version, feed_fingerprint(request, params))
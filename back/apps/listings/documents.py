@@ -0,0 +1,194 @@
+import threading
+from collections import defaultdict
+from datetime import date
+
+from django.db import connection, transaction
+from django.db.models import Count, Min
+
+from apps.listings.cache import bump_catalogue_version, invalidate_catalogue
+from apps.listings.models import ForWhom, Listing, ListingImage, ListingSearchDocument
+from apps.listings.search import normalize_search_text, update_search_vectors
+
+
+FOR_WHOM_BITS = {name: 1 << i for i, (name, _) in enumerate(ForWhom.FOR_WHOM_CHOICES)}
+
+DOCUMENT_FIELDS = [
+    f.name for f in ListingSearchDocument._meta.concrete_fields
+    if f.name not in ('id', 'search_vector')
+]
+
+_pending = threading.local()
+
+
+def for_whom_mask(names):
+    mask = 0
+    for name in names:
+        mask |= FOR_WHOM_BITS.get(name, 0)
+    return mask
+
+
+def for_whom_names(mask):
+    return [name for name, bit in FOR_WHOM_BITS.items() if mask & bit]
+
+
+def masks_including(name):
+    """Every for_whom_mask value that has `name` set, for an index-friendly IN filter"""
+    bit = FOR_WHOM_BITS[name]
+    return [mask for mask in range(1 << len(FOR_WHOM_BITS)) if mask & bit]
+
+
+def schedule_document_refresh(*listing_ids):
+    """
+    Queue listings for a document refresh when the current transaction
+    commits. Several signals fire for a single listing write (the row,
+    every image, every for_whom), they collapse into one refresh.
+    """
+    pending = getattr(_pending, 'ids', None)
+    if pending is None:
+        pending = _pending.ids = set()
+    pending.update(listing_ids)
+    transaction.on_commit(_flush_pending_refreshes)
+
+
+def _flush_pending_refreshes():
+    listing_ids = getattr(_pending, 'ids', None)
+    _pending.ids = None
+    if listing_ids:
+        refresh_listing_documents(listing_ids)
+        bump_catalogue_version()
+
+
+def refresh_listing_documents(listing_ids):
+    """Rebuild the documents of `listing_ids` with a fixed number of queries"""
+    listing_ids = set(listing_ids)
+    listings = list(
+        Listing.objects
+        .filter(id__in=listing_ids)
+        .select_related('region', 'district')
+    )
+    found = {listing.id for listing in listings}
+    if listing_ids - found:
+        ListingSearchDocument.objects.filter(id__in=listing_ids - found).delete()
+    if not listings:
+        return
+
+    image_stats = {
+        row['listing_id']: row
+        for row in (
+            ListingImage.objects
+            .filter(listing_id__in=found)
+            .values('listing_id')
+            .annotate(image_count=Count('id'), cover_image_id=Min('id'))
+        )
+    }
+    covers = {
+        image_id: (name, variants)
+        for image_id, name, variants in (
+            ListingImage.objects
+            .filter(id__in=[row['cover_image_id'] for row in image_stats.values()])
+            .values_list('id', 'image', 'variants')
+        )
+    }
+    for_whom = defaultdict(list)
+    for listing_id, name in (
+        Listing.for_whom.through.objects
+        .filter(listing_id__in=found)
+        .values_list('listing_id', 'forwhom__name')
+    ):
+        for_whom[listing_id].append(name)
+
+    documents = [
+        build_document(
+            listing,
+            image_stats.get(listing.id, {}),
+            covers,
+            for_whom[listing.id],
+        )
+        for listing in listings
+    ]
+    ListingSearchDocument.objects.bulk_create(
+        documents,
+        update_conflicts=True,
+        unique_fields=['id'],
+        update_fields=DOCUMENT_FIELDS,
+    )
+
+    if connection.vendor == 'postgresql':
+        update_search_vectors(listings)
+
+
+def build_document(listing, image_stats, covers, for_whom):
+    region, district = listing.region, listing.district
+    cover_image_id = image_stats.get('cover_image_id')
+    cover_image, cover_variants = covers.get(cover_image_id) or ('', {})
+    return ListingSearchDocument(
+        id=listing.id,
+        title=listing.title,
+        price=listing.price,
+        location=listing.location,
+        location_link=listing.location_link,
+        rooms=listing.rooms,
+        total_floor_of_building=listing.total_floor_of_building,
+        floor_of_this_apartment=listing.floor_of_this_apartment,
+        state=listing.state,
+        type=listing.type,
+        is_active=listing.is_active,
+        created_at=listing.created_at or date.min,
+        for_whom_mask=for_whom_mask(for_whom),
+        region_id=region.id if region else None,
+        region_soato_id=region.soato_id if region else None,
+        region_name_uz=region.name_uz if region else None,
+        region_name_ru=region.name_ru if region else None,
+        region_name_en=region.name_en if region else None,
+        district_id=district.id if district else None,
+        district_soato_id=district.soato_id if district else None,
+        district_name_uz=district.name_uz if district else None,
+        district_name_ru=district.name_ru if district else None,
+        district_name_en=district.name_en if district else None,
+        cover_image_id=cover_image_id,
+        cover_image=str(cover_image or ''),
+        cover_variants=cover_variants or {},
+        image_count=image_stats.get('image_count', 0),
+        search_text=' '.join(filter(None, (
+            normalize_search_text(listing.title),
+            normalize_search_text(listing.location),
+            normalize_search_text(listing.description),
+        ))),
+    )
+
+
+def sync_region_names(region):
+    ListingSearchDocument.objects.filter(region_id=region.id).update(
+        region_soato_id=region.soato_id,
+        region_name_uz=region.name_uz,
+        region_name_ru=region.name_ru,
+        region_name_en=region.name_en,
+    )
+    invalidate_catalogue()
+
+
+def sync_district_names(district):
+    ListingSearchDocument.objects.filter(district_id=district.id).update(
+        district_soato_id=district.soato_id,
+        district_name_uz=district.name_uz,
+        district_name_ru=district.name_ru,
+        district_name_en=district.name_en,
+    )
+    invalidate_catalogue()
+
+
+def clear_region(region_id):
+    # Listing.region is SET_NULL, which Django applies with a bulk UPDATE
+    ListingSearchDocument.objects.filter(region_id=region_id).update(
+        region_id=None, region_soato_id=None,
+        region_name_uz=None, region_name_ru=None, region_name_en=None,
+    )
+    invalidate_catalogue()
+
+
+def clear_district(district_id):
+    ListingSearchDocument.objects.filter(district_id=district_id).update(
+        district_id=None, district_soato_id=None,
+        district_name_uz=None, district_name_ru=None, district_name_en=None,
+    )
+    invalidate_catalogue()
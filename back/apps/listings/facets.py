@@ -0,0 +1,79 @@
+from collections import Counter
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Case, Count, IntegerField, Value, When
+
+from apps.listings.documents import FOR_WHOM_BITS
+
+
+def price_buckets():
+    """[(min, max), ...] from the LISTING_PRICE_BUCKETS upper bounds; last max is None"""
+    bounds = [Decimal(str(b)) for b in settings.LISTING_PRICE_BUCKETS]
+    lowers = [Decimal('0')] + bounds
+    uppers = bounds + [None]
+    return list(zip(lowers, uppers))
+
+
+def price_bucket_expression(buckets):
+    whens = [
+        When(price__lt=upper, then=Value(index))
+        for index, (_, upper) in enumerate(buckets)
+        if upper is not None
+    ]
+    return Case(*whens, default=Value(len(buckets) - 1), output_field=IntegerField())
+
+
+def compute_facets(queryset):
+    """
+    Counts per region, district, rooms, type, for_whom and price bucket.
+
+    A single GROUP BY over every facet dimension; the per-facet counts are
+    folded from those groups in Python. Because for_whom is a bitmask a
+    listing is counted once under each audience it is open to.
+    """
+    buckets = price_buckets()
+    groups = (
+        queryset
+        .order_by()
+        .annotate(price_bucket=price_bucket_expression(buckets))
+        .values('region_id', 'district_id', 'rooms', 'type', 'for_whom_mask', 'price_bucket')
+        .annotate(count=Count('id'))
+    )
+
+    total = 0
+    counters = {name: Counter() for name in ('region', 'district', 'rooms', 'type', 'for_whom', 'price')}
+    for group in groups:
+        count = group['count']
+        total += count
+        if group['region_id'] is not None:
+            counters['region'][group['region_id']] += count
+        if group['district_id'] is not None:
+            counters['district'][group['district_id']] += count
+        counters['rooms'][group['rooms']] += count
+        if group['type']:
+            counters['type'][group['type']] += count
+        for name, bit in FOR_WHOM_BITS.items():
+            if group['for_whom_mask'] & bit:
+                counters['for_whom'][name] += count
+        counters['price'][group['price_bucket']] += count
+
+    facets = {
+        name: [{'value': value, 'count': count} for value, count in sorted(counter.items(), key=_sort_key)]
+        for name, counter in counters.items()
+        if name != 'price'
+    }
+    facets['price'] = [
+        {
+            'min': str(lower),
+            'max': str(upper) if upper is not None else None,
+            'count': counters['price'].get(index, 0),
+        }
+        for index, (lower, upper) in enumerate(buckets)
+    ]
+    return {'total': total, 'facets': facets}
+
+
+def _sort_key(item):
+    value, _ = item
+    return (value is None, value)
@@ -0,0 +1,23 @@
+import django_filters
+
+from apps.listings.documents import masks_including
+from apps.listings.models import ForWhom, Listing, ListingSearchDocument
+
+
+class ListingDocumentFilter(django_filters.FilterSet):
+    """Feed filters, same query parameters as the old filterset_fields on Listing"""
+    price__gte = django_filters.NumberFilter(field_name='price', lookup_expr='gte')
+    price__lte = django_filters.NumberFilter(field_name='price', lookup_expr='lte')
+    region = django_filters.NumberFilter(field_name='region_id')
+    district = django_filters.NumberFilter(field_name='district_id')
+    floor_of_this_apartment = django_filters.NumberFilter()
+    rooms = django_filters.NumberFilter()
+    for_whom__name = django_filters.ChoiceFilter(choices=ForWhom.FOR_WHOM_CHOICES, method='filter_for_whom')
+    type = django_filters.ChoiceFilter(choices=Listing.listing_type)
+
+    class Meta:
+        model = ListingSearchDocument
+        fields = []
+
+    def filter_for_whom(self, queryset, name, value):
+        return queryset.filter(for_whom_mask__in=masks_including(value))
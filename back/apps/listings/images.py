@@ -0,0 +1,305 @@
+"""
+Listing photo files: content addressing and derived sizes.
+
+Uploads are normalized before they are stored (`normalize_upload`): rotated
+upright, stripped of metadata, capped in size and re-encoded. Photos are then
+stored once per SHA-256 under hash-prefix directories
+(`listing/images/ab/cd/<sha256>.<ext>`, see `shard_path`); rows that upload
+the same bytes share the file. Deleting a row leaves the file (and its
+variants) in place: a concurrent upload of the same bytes may be reusing it
+at that moment, so unreferenced files are only reclaimed by the
+collect_orphan_media command, after its grace period. Reusing a file
+touches it (`reuse_file`), which restarts that grace period.
+
+Every ListingImage gets a fixed-size card thumbnail and width-limited
+variants in WebP (and AVIF when Pillow can encode it), generated in the
+background by apps.listings.tasks. `ListingImage.variants` maps
+variant name -> format -> storage name, e.g.
+
+    {"thumb": {"webp": "listing/images/variants/ab/12/ab12-thumb.webp", ...},
+     "640w": {...}, "1280w": {...}}
+"""
+import hashlib
+import os
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, features
+
+from apps.listings.models import ListingImage, listing_image_path, shard_path
+
+
+VARIANTS_DIR = 'listing/images/variants'
+
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 6},
+    'avif': {'format': 'AVIF', 'quality': 60},
+}
+
+
+def _avif_supported():
+    if features.check('avif'):
+        return True
+    try:
+        import pillow_avif  # noqa: F401  registers the AVIF codec on older Pillow builds
+    except ImportError:
+        return False
+    return True
+
+
+def output_formats():
+    return [name for name in settings.LISTING_IMAGE_VARIANT_FORMATS if name != 'avif' or _avif_supported()]
+
+
+def render_variants(original):
+    """Yield (variant name, PIL image) for an opened original"""
+    original = ImageOps.exif_transpose(original)
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA' if 'transparency' in original.info else 'RGB')
+
+    yield 'thumb', ImageOps.fit(original, settings.LISTING_IMAGE_THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+    for width in settings.LISTING_IMAGE_VARIANT_WIDTHS:
+        if original.width <= width:
+            continue
+        height = round(original.height * width / original.width)
+        yield f'{width}w', original.resize((width, height), Image.Resampling.LANCZOS)
+
+
+class UndecodableImage(Exception):
+    """The stored file is not an image Pillow can decode, retrying will not help"""
+
+
+# what Pillow raises for corrupt, truncated or oversized images
+DECODE_ERRORS = (OSError, ValueError, SyntaxError, Image.DecompressionBombError)
+
+
+def generate_variants(name):
+    """
+    Write every variant of the stored original `name`, returns the
+    variants map. Raises UndecodableImage when the original cannot be
+    decoded; storage errors propagate as they are.
+    """
+    stem = os.path.splitext(os.path.basename(name))[0]
+    formats = output_formats()
+    # read first, so OSErrors of the storage are not taken for decode errors
+    with default_storage.open(name, 'rb') as fh:
+        data = fh.read()
+    try:
+        rendered = []
+        with Image.open(BytesIO(data)) as original:
+            for variant, image in render_variants(original):
+                for fmt in formats:
+                    buffer = BytesIO()
+                    image.save(buffer, **FORMATS[fmt])
+                    rendered.append((variant, fmt, buffer.getvalue()))
+    except DECODE_ERRORS as e:
+        raise UndecodableImage(str(e)) from e
+
+    variants = {}
+    for variant, fmt, content in rendered:
+        path = default_storage.save(shard_path(VARIANTS_DIR, f'{stem}-{variant}.{fmt}', key=stem), ContentFile(content))
+        variants.setdefault(variant, {})[fmt] = path
+    return variants
+
+
+def delete_variants(variants):
+    for formats in (variants or {}).values():
+        for path in formats.values():
+            default_storage.delete(path)
+
+
+def image_url(name, request=None):
+    """Same URL an ImageField serializer would render for `name`"""
+    url = default_storage.url(name)
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+def srcset(variants, request=None):
+    """Variants map with storage names turned into URLs"""
+    return {
+        variant: {fmt: image_url(path, request) for fmt, path in formats.items()}
+        for variant, formats in (variants or {}).items()
+    }
+
+
+def thumbnail_name(variants, original):
+    """Storage name of the card thumbnail, the original until it is generated"""
+    thumb = (variants or {}).get('thumb') or {}
+    return thumb.get('webp') or next(iter(thumb.values()), None) or original
+
+
+# Pillow's names for metadata blocks that are dropped on normalization
+METADATA_KEYS = ('exif', 'xmp', 'XML:com.adobe.xmp', 'comment', 'photoshop', 'dpi')
+
+
+def needs_normalizing(image):
+    """Whether an opened original is not already in the shape normalize_image writes"""
+    if getattr(image, 'is_animated', False):
+        return False
+    if image.format not in ('JPEG', 'PNG'):
+        return True
+    if any(key in image.info for key in METADATA_KEYS) or image.getexif():
+        return True
+    return max(image.size) > settings.LISTING_IMAGE_MAX_EDGE
+
+
+def normalize_image(file):
+    """
+    Re-encode an uploaded photo as stored: EXIF orientation applied, metadata
+    dropped, longest edge capped at LISTING_IMAGE_MAX_EDGE; JPEG, or PNG when
+    it has transparency. Returns (bytes, extension), or None when the file is
+    already normalized or cannot be decoded.
+    """
+    max_edge = settings.LISTING_IMAGE_MAX_EDGE
+    try:
+        file.seek(0)
+        with Image.open(file) as image:
+            if not needs_normalizing(image):
+                return None
+            icc_profile = image.info.get('icc_profile')
+            image.draft('RGB', (max_edge, max_edge))  # JPEG decodes at a fraction of the size
+            image = ImageOps.exif_transpose(image)
+            transparent = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+            image = image.convert('RGBA' if transparent else 'RGB')
+            image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+            buffer = BytesIO()
+            if transparent:
+                image.save(buffer, 'PNG', optimize=True, icc_profile=icc_profile)
+            else:
+                image.save(
+                    buffer, 'JPEG', quality=settings.LISTING_IMAGE_JPEG_QUALITY,
+                    optimize=True, progressive=True, icc_profile=icc_profile,
+                )
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    finally:
+        file.seek(0)
+    return buffer.getvalue(), 'png' if transparent else 'jpg'
+
+
+def normalize_upload(upload):
+    """Normalized replacement of an uploaded file, or the upload itself"""
+    normalized = normalize_image(upload)
+    if normalized is None:
+        return upload
+    content, ext = normalized
+    stem = os.path.splitext(os.path.basename(upload.name))[0]
+    replacement = ContentFile(content, name=f'{stem}.{ext}')
+    replacement.sha256 = hashlib.sha256(content).hexdigest()
+    return replacement
+
+
+def normalize_stored(name, dry_run=False):
+    """
+    Normalize a stored original into its content-addressed name, for the
+    backfill of photos uploaded before normalization. Returns (new name,
+    sha256, phash), or None when the file is already normalized; with
+    `dry_run` nothing is written and the new name is None.
+    """
+    with default_storage.open(name, 'rb') as fh:
+        if dry_run:
+            with Image.open(fh) as image:
+                return (None, '', '') if needs_normalizing(image) else None
+        normalized = normalize_image(fh)
+    if normalized is None:
+        return None
+    content, ext = normalized
+    file = ContentFile(content)
+    sha256 = hashlib.sha256(content).hexdigest()
+    phash = perceptual_hash(file) if settings.LISTING_IMAGE_PERCEPTUAL_HASH else ''
+    target = default_storage.generate_filename(listing_image_path(ListingImage(sha256=sha256), f'{sha256}.{ext}'))
+    if not reuse_file(target):
+        target = default_storage.save(target, file)
+    return target, sha256, phash
+
+
+def sha256_of(file):
+    """Hex SHA-256 of a file object, read in chunks and rewound"""
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks() if hasattr(file, 'chunks') else iter(lambda: file.read(1024 * 1024), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def perceptual_hash(file):
+    """64-bit difference hash as 16 hex chars, '' when the file is not a readable image"""
+    try:
+        file.seek(0)
+        with Image.open(file) as image:
+            image.draft('L', (64, 64))  # JPEG decodes at a fraction of the size
+            pixels = list(image.convert('L').resize((9, 8), Image.Resampling.LANCZOS).getdata())
+    except (OSError, ValueError):
+        return ''
+    finally:
+        file.seek(0)
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    if bits in (0, (1 << 64) - 1):
+        # flat images all hash alike, the hash says nothing about them
+        return ''
+    return f'{bits:016x}'
+
+
+def content_address(image):
+    """
+    Hash a new upload of a ListingImage before it is written. When the same
+    bytes are already stored the row is pointed at that file and the upload
+    is not written again.
+    """
+    file = image.image
+    if not file or file._committed:
+        return
+    # uploads parsed by apps.listings.uploads were hashed while streaming in,
+    # normalized ones by normalize_upload
+    image.sha256 = getattr(file.file, 'sha256', None) or sha256_of(file)
+    if settings.LISTING_IMAGE_PERCEPTUAL_HASH:
+        image.phash = perceptual_hash(file)
+    name = file.field.generate_filename(image, os.path.basename(file.name))
+    if reuse_file(name):
+        file.name = name
+        file._committed = True
+
+
+def reuse_file(name):
+    """
+    Take the stored file `name` for a new row, False when there is none.
+    The file is touched with a fine-grained timestamp, so the orphan
+    collector's grace period starts over and `discard_file` sees that
+    another row took it.
+    """
+    now = time.time_ns()
+    try:
+        os.utime(default_storage.path(name), ns=(now, now))
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def stored_version(name):
+    """Modification time of a stored file in ns, changed by `reuse_file`"""
+    return os.stat(default_storage.path(name)).st_mtime_ns
+
+
+def discard_file(name, version):
+    """
+    Delete a file written for a transaction that did not commit, unless a
+    row references it or it was reused since it was written (`version`
+    being its `stored_version` right after the write).
+    """
+    if ListingImage.objects.filter(image=name).exists():
+        return
+    try:
+        if stored_version(name) != version:
+            return
+    except FileNotFoundError:
+        return
+    default_storage.delete(name)
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from apps.listings.models import ListingImage
+from apps.listings.tasks import generate_image_variants
+
+
+class Command(BaseCommand):
+    help = 'Generate thumbnails and WebP/AVIF variants for listing images that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sync',
+            action='store_true',
+            help='Generate in this process instead of queueing Celery tasks',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Regenerate variants for every image, not only the missing ones',
+        )
+
+    def handle(self, *args, **options):
+        images = ListingImage.objects.exclude(image='').order_by('id')
+        if not options['force']:
+            images = images.filter(variants={})
+        image_ids = list(images.values_list('id', flat=True))
+
+        for count, image_id in enumerate(image_ids, start=1):
+            if options['sync']:
+                generate_image_variants.apply(args=(image_id,), kwargs={'force': options['force']})
+            else:
+                generate_image_variants.delay(image_id, force=options['force'])
+            if count % 100 == 0:
+                self.stdout.write(f'{"Generated" if options["sync"] else "Queued"} {count}/{len(image_ids)}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully {"generated" if options["sync"] else "queued"} variants for {len(image_ids)} images'
+        ))
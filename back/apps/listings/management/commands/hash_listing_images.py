@@ -0,0 +1,74 @@
+import os
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.listings.conditional import touch_listings
+from apps.listings.documents import schedule_document_refresh
+from apps.listings.images import perceptual_hash, reuse_file, sha256_of
+from apps.listings.models import ListingImage, listing_image_path
+
+
+class Command(BaseCommand):
+    help = 'Hash listing images stored before content addressing and merge duplicate files'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report what would be merged without changing anything',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        names = (
+            ListingImage.objects
+            .filter(sha256='')
+            .exclude(image='')
+            .order_by('image')
+            .values_list('image', flat=True)
+            .distinct()
+        )
+
+        hashed = merged = missing = 0
+        for name in names.iterator():
+            if not default_storage.exists(name):
+                missing += 1
+                self.stdout.write(self.style.WARNING(f'Missing file: {name}'))
+                continue
+
+            with default_storage.open(name, 'rb') as fh:
+                sha256 = sha256_of(fh)
+                phash = perceptual_hash(fh) if settings.LISTING_IMAGE_PERCEPTUAL_HASH else ''
+
+            image = ListingImage(sha256=sha256)
+            target = default_storage.generate_filename(listing_image_path(image, os.path.basename(name)))
+            # a real run takes the existing file, restarting its orphan grace period
+            duplicate = default_storage.exists(target) if dry_run else reuse_file(target)
+            if dry_run:
+                self.stdout.write(f'{name} -> {target}{" (duplicate)" if duplicate else ""}')
+                continue
+
+            if not duplicate:
+                with default_storage.open(name, 'rb') as fh:
+                    target = default_storage.save(target, fh)
+            with transaction.atomic():
+                rows = ListingImage.objects.filter(image=name)
+                listing_ids = list(rows.values_list('listing_id', flat=True).distinct())
+                rows.update(image=target, sha256=sha256, phash=phash)
+                # search documents and cached pages keep the cover file name
+                touch_listings(*listing_ids)
+                schedule_document_refresh(*listing_ids)
+                # only once nothing points at the original any more
+                transaction.on_commit(lambda name=name: default_storage.delete(name))
+
+            hashed += 1
+            merged += duplicate
+            if hashed % 100 == 0:
+                self.stdout.write(f'Hashed {hashed} files')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully hashed {hashed} files, merged {merged} duplicates, {missing} missing'
+        ))
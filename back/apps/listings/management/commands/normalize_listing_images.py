@@ -0,0 +1,104 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from apps.listings.conditional import touch_listings
+from apps.listings.documents import schedule_document_refresh
+from apps.listings.images import normalize_stored
+from apps.listings.models import ImageVerdict, ListingImage
+
+
+class Command(BaseCommand):
+    help = 'Normalize listing images stored before ingest normalization (orientation, metadata, size, re-encode)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Worker processes decoding and re-encoding images (default: CPU count)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Number of files handed to the workers at a time (default: 200)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report which files would be normalized without changing anything',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        batch_size = options['batch_size']
+        names = (
+            ListingImage.objects
+            .exclude(image='')
+            .order_by('image')
+            .values_list('image', flat=True)
+            .distinct()
+        )
+
+        self.normalized = self.skipped = self.failed = 0
+        # Forked workers must not share the parent's database connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as pool:
+            batch = []
+            for name in names.iterator(chunk_size=batch_size):
+                batch.append(name)
+                if len(batch) == batch_size:
+                    self.process(pool, batch, dry_run)
+                    batch = []
+            if batch:
+                self.process(pool, batch, dry_run)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully {"found" if dry_run else "normalized"} {self.normalized} files, '
+            f'{self.skipped} already normalized, {self.failed} failed'
+        ))
+
+    def process(self, pool, names, dry_run):
+        futures = {pool.submit(normalize_stored, name, dry_run): name for name in names}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                self.failed += 1
+                self.stdout.write(self.style.WARNING(f'Could not normalize {name}: {str(e)}'))
+                continue
+            if result is None:
+                self.skipped += 1
+                continue
+            self.normalized += 1
+            if dry_run:
+                self.stdout.write(name)
+                continue
+            self.replace(name, *result)
+        self.stdout.write(f'Normalized {self.normalized}, skipped {self.skipped}, failed {self.failed}')
+
+    def replace(self, name, target, sha256, phash):
+        """Point the rows at the normalized file and drop the original"""
+        rows = ListingImage.objects.filter(image=name)
+        old_hashes = list(rows.exclude(sha256='').values_list('sha256', flat=True).distinct())
+        with transaction.atomic():
+            listing_ids = list(rows.values_list('listing_id', flat=True).distinct())
+            rows.update(image=target, sha256=sha256, phash=phash)
+            # the photo is the same, keep its Nyckel verdict
+            verdict = ImageVerdict.objects.filter(sha256__in=old_hashes).first()
+            if verdict is not None:
+                ImageVerdict.objects.get_or_create(
+                    sha256=sha256, defaults={'phash': phash, 'label': verdict.label, 'confidence': verdict.confidence},
+                )
+            # search documents and cached pages keep the cover file name
+            touch_listings(*listing_ids)
+            schedule_document_refresh(*listing_ids)
+            if target != name:
+                # only once nothing points at the original any more
+                transaction.on_commit(lambda: default_storage.delete(name))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from apps.listings.cache import bump_catalogue_version
+from apps.listings.documents import refresh_listing_documents
+from apps.listings.models import Listing, ListingSearchDocument
+
+
+class Command(BaseCommand):
+    help = 'Rebuild ListingSearchDocument rows (feed, search and facets read model)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of listings refreshed per batch (default: 500)',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        listing_ids = Listing.objects.order_by('id').values_list('id', flat=True)
+
+        refreshed = 0
+        batch = []
+        for listing_id in listing_ids.iterator(chunk_size=batch_size):
+            batch.append(listing_id)
+            if len(batch) == batch_size:
+                refresh_listing_documents(batch)
+                refreshed += len(batch)
+                batch = []
+                self.stdout.write(f'Refreshed {refreshed} documents')
+        if batch:
+            refresh_listing_documents(batch)
+            refreshed += len(batch)
+
+        stale = ListingSearchDocument.objects.exclude(id__in=Listing.objects.values('id')).delete()[0]
+        bump_catalogue_version()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully rebuilt {refreshed} listing documents, removed {stale} stale documents'
+        ))
@@ -0,0 +1,138 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from django.db.models import Case, Value, When
+
+from apps.listings.conditional import touch_listings
+from apps.listings.documents import schedule_document_refresh
+from apps.listings.images import VARIANTS_DIR
+from apps.listings.models import LISTING_IMAGES_DIR, ListingImage, shard_path
+
+SHARDED = r'^listing/images/[0-9a-f]{2}/[0-9a-f]{2}/[^/]+$'
+
+
+def sharded_name(name, directory, key=None):
+    return shard_path(directory, os.path.basename(name), key=key)
+
+
+def move_file(old, new):
+    """Rename a stored file; True when it is at `new` afterwards"""
+    old_path, new_path = default_storage.path(old), default_storage.path(new)
+    if os.path.exists(old_path):
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        os.replace(old_path, new_path)
+        return True
+    # moved by an interrupted run that did not get to update the rows
+    return os.path.exists(new_path)
+
+
+class Command(BaseCommand):
+    help = 'Move listing images and their variants from the flat listing/images/ directory into hash-prefix shards'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of files moved and updated per batch (default: 500)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=8,
+            help='Threads renaming files (default: 8)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report what would be moved without changing anything',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        # Moved rows drop out of this queryset, so an interrupted run resumes where it stopped
+        names = (
+            ListingImage.objects
+            .filter(image__startswith=f'{LISTING_IMAGES_DIR}/')
+            .exclude(image__regex=SHARDED)
+            .order_by('image')
+            .values_list('image', flat=True)
+            .distinct()
+        )
+
+        moved_count = missing_count = 0
+        last = ''
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            while True:
+                batch = list(names.filter(image__gt=last)[:batch_size])
+                if not batch:
+                    break
+                last = batch[-1]
+
+                if dry_run:
+                    for name in batch:
+                        self.stdout.write(f'{name} -> {sharded_name(name, LISTING_IMAGES_DIR)}')
+                    moved_count += len(batch)
+                    continue
+
+                variants = dict(
+                    ListingImage.objects
+                    .filter(image__in=batch)
+                    .exclude(variants={})
+                    .values_list('image', 'variants')
+                )
+                results = list(pool.map(lambda name: self.move(name, variants.get(name)), batch))
+                moved = {name: result for name, result in zip(batch, results) if result is not None}
+                for name in batch:
+                    if name not in moved:
+                        self.stdout.write(self.style.WARNING(f'Missing file: {name}'))
+                missing_count += len(batch) - len(moved)
+                if moved:
+                    self.update_rows(moved)
+                moved_count += len(moved)
+                self.stdout.write(f'Moved {moved_count} files')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully {"would move" if dry_run else "moved"} {moved_count} files, {missing_count} missing'
+        ))
+
+    def move(self, name, variants):
+        """Move one original and its variants, returns (new name, new variants) or None"""
+        new_name = sharded_name(name, LISTING_IMAGES_DIR)
+        if not move_file(name, new_name):
+            return None
+        new_variants = None
+        stem = os.path.splitext(os.path.basename(name))[0]
+        if variants:
+            new_variants = {}
+            for variant, formats in variants.items():
+                for fmt, path in formats.items():
+                    new_path = sharded_name(path, VARIANTS_DIR, key=stem)
+                    # a missing variant is regenerated by generate_image_variants --force
+                    move_file(path, new_path)
+                    new_variants.setdefault(variant, {})[fmt] = new_path
+        return new_name, new_variants
+
+    def update_rows(self, moved):
+        """Point every row of the batch at its new name in one UPDATE per column"""
+        with transaction.atomic():
+            rows = ListingImage.objects.filter(image__in=list(moved))
+            listing_ids = list(rows.values_list('listing_id', flat=True).distinct())
+            with_variants = {name: variants for name, (_, variants) in moved.items() if variants}
+            if with_variants:
+                ListingImage.objects.filter(image__in=list(with_variants)).update(variants=Case(
+                    *[When(image=name, then=Value(variants, output_field=models.JSONField()))
+                      for name, variants in with_variants.items()],
+                    output_field=models.JSONField(),
+                ))
+            rows.update(image=Case(
+                *[When(image=name, then=Value(new_name)) for name, (new_name, _) in moved.items()],
+                output_field=models.CharField(),
+            ))
+            # search documents keep the cover file name
+            touch_listings(*listing_ids)
+            schedule_document_refresh(*listing_ids)
@@ -1,17 +1,42 @@
 from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from apps.users.models import BaseModel
 # Create your models here.
+import hashlib
 import os
+import string
 import uuid
+from datetime import date
 from django.utils.text import slugify
 
+LISTING_IMAGES_DIR = 'listing/images'
+
+
+def shard_path(directory, filename, key=None):
+    """
+    Spread files over two levels of hash-prefix directories,
+    `<directory>/ab/cd/<filename>`, so no single directory grows huge.
+    Hex names (content hashes, uuids) shard on their own first characters;
+    `key` (default: the file's stem) keeps related files together.
+    """
+    key = key or os.path.splitext(filename)[0]
+    if len(key) < 4 or any(c not in string.hexdigits for c in key[:4]):
+        key = hashlib.md5(key.encode()).hexdigest()
+    key = key.lower()
+    return os.path.join(directory, key[:2], key[2:4], filename)
+
+
 def listing_image_path(instance, filename):
     """Generate safe filename for listing images"""
     # Get file extension
-    ext = filename.split('.')[-1]
+    ext = filename.split('.')[-1].lower()
+    # Content-addressed when the hash is known, one file per distinct photo
+    if getattr(instance, 'sha256', ''):
+        return shard_path(LISTING_IMAGES_DIR, f"{instance.sha256}.{ext}")
     # Generate unique filename with UUID
     filename = f"{uuid.uuid4().hex[:12]}.{ext}"
-    return os.path.join('listing/images/', filename)
+    return shard_path(LISTING_IMAGES_DIR, filename)
 
 # class ListingImage(models.Model):
     
@@ -67,7 +92,18 @@ class Listing(BaseModel):
     district = models.ForeignKey('shared.District', on_delete=models.SET_NULL, null=True, blank=True)
 
     is_active = models.BooleanField(default=True)
+    # the photo check never accepts a listing, moderators do; this tells them it ran
+    images_checked_at = models.DateTimeField(
+        null=True, blank=True, help_text="When the Nyckel photo check last finished, empty while one is pending",
+    )
 
+    class Meta:
+        indexes = [
+            # my-listings, billing and card (de)activation read a host's active listings
+            models.Index(fields=['host', 'is_active'], name='listing_host_active_idx'),
+            # moderation queue in the admin
+            models.Index(fields=['state', '-created_at'], name='listing_state_created_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -76,10 +112,124 @@ class ListingImage(models.Model):
     listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='images')
     # image = models.ImageField(upload_to='listing/images')
     image = models.ImageField(upload_to=listing_image_path)
+    # content hashes, several rows share a file when the photo is the same
+    sha256 = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    phash = models.CharField(max_length=16, blank=True, default='')
+    # thumbnail / width variants per format, see apps.listings.images
+    variants = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        indexes = [
+            # cover image = lowest id per listing
+            models.Index(fields=['listing', 'id'], name='listing_image_listing_id_idx'),
+            # reference counting on delete
+            models.Index(fields=['image'], name='listing_image_name_idx'),
+        ]
 
     def __str__(self):
         return f"Image for {self.listing.title}"
     
+class ImageVerdict(models.Model):
+    """Photo validation result per content hash, known photos skip the external check"""
+    sha256 = models.CharField(max_length=64, unique=True)
+    phash = models.CharField(max_length=16, blank=True, default='', db_index=True)
+    label = models.CharField(max_length=100)
+    confidence = models.FloatField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256[:12]} - {self.label} ({self.confidence:.2f})"
+
+
+class UploadSession(BaseModel):
+    """Resumable upload of one listing photo, staged on local disk, see apps.listings.resumable"""
+    STATES = (
+        ('OPEN', 'OPEN'),  # receiving chunks
+        ('COMPLETE', 'COMPLETE'),  # finalized, can be attached to a listing
+    )
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey('users.User', on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    state = models.CharField(max_length=10, choices=STATES, default='OPEN')
+    content_type = models.CharField(max_length=50, blank=True, default='')
+    sha256 = models.CharField(max_length=64, blank=True, default='')
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size})"
+
+
+PUBLIC_DOCUMENTS = models.Q(is_active=True, state='ACCEPTED')
+
+
+class ListingSearchDocument(models.Model):
+    """
+    Flat read model of a listing used by the public feed, search and facets.
+
+    One row per listing with everything a listing card shows, so the hot
+    read path never joins. Kept in sync by apps.listings.documents.
+    """
+    id = models.BigIntegerField(primary_key=True)  # same as Listing.id
+    title = models.CharField(max_length=255)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    location = models.CharField(max_length=255)
+    location_link = models.URLField(max_length=500, null=True, blank=True)
+    rooms = models.IntegerField(default=1)
+    total_floor_of_building = models.IntegerField(null=True, blank=True)
+    floor_of_this_apartment = models.IntegerField(null=True, blank=True)
+    state = models.CharField(max_length=10)
+    type = models.CharField(max_length=15, null=True, blank=True)
+    is_active = models.BooleanField(default=True)
+    # never NULL, a keyset cursor cannot point past a NULL; listings stored
+    # without a creation date sort as the oldest
+    created_at = models.DateField(default=date.min)
+
+    # bit i is set when ForWhom.FOR_WHOM_CHOICES[i] applies
+    for_whom_mask = models.PositiveSmallIntegerField(default=0)
+
+    region_id = models.BigIntegerField(null=True, blank=True)
+    region_soato_id = models.IntegerField(null=True, blank=True)
+    region_name_uz = models.CharField(max_length=30, null=True, blank=True)
+    region_name_ru = models.CharField(max_length=30, null=True, blank=True)
+    region_name_en = models.CharField(max_length=30, null=True, blank=True)
+    district_id = models.BigIntegerField(null=True, blank=True)
+    district_soato_id = models.IntegerField(null=True, blank=True)
+    district_name_uz = models.CharField(max_length=30, null=True, blank=True)
+    district_name_ru = models.CharField(max_length=30, null=True, blank=True)
+    district_name_en = models.CharField(max_length=30, null=True, blank=True)
+
+    cover_image_id = models.BigIntegerField(null=True, blank=True)
+    cover_image = models.CharField(max_length=255, blank=True, default='')
+    cover_variants = models.JSONField(default=dict, blank=True)
+    image_count = models.PositiveSmallIntegerField(default=0)
+
+    # normalized title, location and description, see apps.listings.search
+    search_text = models.TextField(blank=True, default='')
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        # The feed only ever reads public documents, so the access-path
+        # indexes are partial and each one ends in the keyset ordering.
+        indexes = [
+            GinIndex(fields=['search_vector'], name='listing_doc_search_gin'),
+            GinIndex(fields=['title'], opclasses=['gin_trgm_ops'], name='listing_doc_title_trgm_gin'),
+            models.Index(fields=['-created_at', '-id'], condition=PUBLIC_DOCUMENTS, name='listing_doc_newest_idx'),
+            models.Index(fields=['price', 'id'], condition=PUBLIC_DOCUMENTS, name='listing_doc_price_idx'),
+            models.Index(fields=['region_id', '-created_at', '-id'], condition=PUBLIC_DOCUMENTS, name='listing_doc_region_idx'),
+            models.Index(fields=['region_id', 'price', 'id'], condition=PUBLIC_DOCUMENTS, name='listing_doc_region_price_idx'),
+            models.Index(fields=['district_id', '-created_at', '-id'], condition=PUBLIC_DOCUMENTS, name='listing_doc_district_idx'),
+            models.Index(fields=['rooms', '-created_at', '-id'], condition=PUBLIC_DOCUMENTS, name='listing_doc_rooms_idx'),
+            models.Index(fields=['type', '-created_at', '-id'], condition=PUBLIC_DOCUMENTS, name='listing_doc_type_idx'),
+            models.Index(fields=['for_whom_mask', '-created_at', '-id'], condition=PUBLIC_DOCUMENTS, name='listing_doc_for_whom_idx'),
+            models.Index(fields=['floor_of_this_apartment', '-created_at', '-id'], condition=PUBLIC_DOCUMENTS, name='listing_doc_floor_idx'),
+        ]
+
+    def __str__(self):
+        return self.title
+
+
 class Facility(models.Model):
     icon = models.ImageField(upload_to='facility/icons', null=True, blank=True)
     name = models.CharField(max_length=100)
@@ -0,0 +1,24 @@
+from apps.shared.pagination import KeysetPagination
+
+
+class ListingCursorPagination(KeysetPagination):
+    """Keyset pagination for the public listings feed"""
+    page_size = 20
+    max_page_size = 100
+    orderings = {
+        'newest': ('-created_at', '-id'),
+        'price': ('price', 'id'),
+        '-price': ('-price', '-id'),
+        'relevance': ('-rank', '-id'),
+    }
+    default_ordering = 'newest'
+
+    def get_ordering_name(self, request, view=None):
+        """Search results default to relevance; `rank` only exists when searching"""
+        searching = bool(request.query_params.get('search', '').strip())
+        name = request.query_params.get(self.ordering_query_param)
+        if name == 'relevance' and not searching:
+            return self.default_ordering
+        if name in self.orderings:
+            return name
+        return 'relevance' if searching else self.default_ordering
@@ -0,0 +1,76 @@
+from collections import defaultdict
+
+from apps.listings.images import image_url, srcset, thumbnail_name
+from apps.listings.models import Listing, ListingImage
+from apps.shared.gazetteer import get_gazetteer
+
+
+class ListingProjection:
+    """
+    Bulk loader for the relations rendered next to a listing.
+
+    Images and for_whom names are each fetched with a single query for the
+    whole batch and kept in in-memory lookup tables; regions and districts
+    come from the in-process gazetteer. Serializing a page costs the same
+    number of queries whatever its size.
+    """
+
+    def __init__(self, listings, request=None):
+        self.request = request
+        self.listing_ids = {listing.id for listing in listings}
+        self._images = self._load_images()
+        self._for_whom = self._load_for_whom()
+        self._gazetteer = get_gazetteer()
+
+    def covers(self, listing):
+        return listing.id in self.listing_ids
+
+    def images(self, listing, originals=True):
+        """Images of `listing`; cards pass originals=False to get the thumbnail as `image`"""
+        return [
+            {
+                'id': image_id,
+                'image': image_url(name if originals else thumbnail_name(variants, name), self.request) if name else None,
+                'srcset': srcset(variants, self.request),
+            }
+            for image_id, name, variants in self._images.get(listing.id, [])
+        ]
+
+    def for_whom(self, listing):
+        return self._for_whom.get(listing.id, [])
+
+    def region(self, listing):
+        region = self._gazetteer.region(listing.region_id)
+        return region.as_dict() if region else None
+
+    def district(self, listing):
+        district = self._gazetteer.district(listing.district_id)
+        return district.as_dict() if district else None
+
+    def _load_images(self):
+        images = defaultdict(list)
+        if not self.listing_ids:
+            return images
+        rows = (
+            ListingImage.objects
+            .filter(listing_id__in=self.listing_ids)
+            .order_by('id')
+            .values_list('id', 'listing_id', 'image', 'variants')
+        )
+        for image_id, listing_id, name, variants in rows:
+            images[listing_id].append((image_id, name, variants))
+        return images
+
+    def _load_for_whom(self):
+        for_whom = defaultdict(list)
+        if not self.listing_ids:
+            return for_whom
+        rows = (
+            Listing.for_whom.through.objects
+            .filter(listing_id__in=self.listing_ids)
+            .order_by('id')
+            .values_list('listing_id', 'forwhom__name')
+        )
+        for listing_id, name in rows:
+            for_whom[listing_id].append(name)
+        return for_whom
@@ -0,0 +1,226 @@
+"""
+Resumable uploads of listing photos.
+
+Large photos can be sent in pieces instead of one multipart request, so a
+dropped connection only costs the current piece and no worker is busy for
+the whole transfer:
+
+    POST   /api/listings/uploads/                 {"filename", "size"} -> {"id", "offset": 0, ...}
+    PATCH  /api/listings/uploads/<id>/            raw bytes, `Upload-Offset: <offset>` header
+    GET    /api/listings/uploads/<id>/            current offset, to resume after a failure
+    POST   /api/listings/uploads/<id>/finalize/   {"sha256": optional checksum} -> COMPLETE
+    DELETE /api/listings/uploads/<id>/            cancel
+
+A chunk is appended only at the session's current offset, with the session
+row locked until the chunk is written, so a concurrent chunk for the same
+offset waits and is then refused instead of writing over it (chunks are
+capped at LISTING_UPLOAD_CHUNK_MAX_BYTES, which bounds how long the lock is
+held). Whatever part of a chunk arrives before the connection drops is kept. Finalized uploads are
+attached by passing their ids as `upload_ids` when creating or updating a
+listing. Chunks are staged under UPLOAD_STAGING_ROOT on local disk, and
+sessions expire after LISTING_UPLOAD_SESSION_TTL.
+"""
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from apps.listings.models import UploadSession
+from apps.listings.uploads import sniff_content_type
+
+READ_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    def __init__(self, message):
+        super().__init__(message['en'])
+        self.message = message
+
+
+class UploadOffsetMismatch(UploadError):
+    def __init__(self, offset):
+        super().__init__({
+            "en": f"The upload continues at offset {offset}.",
+            "ru": f"Загрузка продолжается со смещения {offset}.",
+            "uz": f"Yuklash {offset} siljishidan davom etadi.",
+        })
+        self.offset = offset
+
+
+def staging_path(session):
+    return os.path.join(settings.UPLOAD_STAGING_ROOT, f'{session.pk}.part')
+
+
+def create_session(user, filename, size):
+    session = UploadSession.objects.create(
+        user=user,
+        filename=os.path.basename(filename),
+        size=size,
+        expires_at=timezone.now() + settings.LISTING_UPLOAD_SESSION_TTL,
+    )
+    os.makedirs(settings.UPLOAD_STAGING_ROOT, exist_ok=True)
+    open(staging_path(session), 'wb').close()
+    return session
+
+
+def lock_session(session):
+    """Lock the session row for the current transaction and refresh `session` from it"""
+    current = UploadSession.objects.select_for_update().filter(pk=session.pk).values('state', 'offset').first()
+    if current is None:
+        raise UploadError({
+            "en": "The upload was cancelled.",
+            "ru": "Загрузка отменена.",
+            "uz": "Yuklash bekor qilingan.",
+        })
+    session.state, session.offset = current['state'], current['offset']
+
+
+def write_chunk(session, offset, stream, length):
+    """
+    Append up to `length` bytes of `stream` at `offset`, returns the new
+    offset. Bytes received before the stream breaks off are kept.
+    """
+    with transaction.atomic():
+        lock_session(session)
+        if session.state != 'OPEN':
+            raise UploadError({
+                "en": "The upload is already finalized.",
+                "ru": "Загрузка уже завершена.",
+                "uz": "Yuklash allaqachon yakunlangan.",
+            })
+        if offset != session.offset:
+            raise UploadOffsetMismatch(session.offset)
+        if offset + length > session.size:
+            raise UploadError({
+                "en": "The chunk goes past the declared upload size.",
+                "ru": "Фрагмент выходит за объявленный размер загрузки.",
+                "uz": "Bo'lak e'lon qilingan yuklash hajmidan oshib ketadi.",
+            })
+
+        received = 0
+        with open(staging_path(session), 'r+b') as fh:
+            fh.seek(offset)
+            while received < length:
+                try:
+                    data = stream.read(min(READ_SIZE, length - received))
+                except OSError:
+                    # client went away, keep what arrived
+                    break
+                if not data:
+                    break
+                fh.write(data)
+                received += len(data)
+
+        UploadSession.objects.filter(pk=session.pk).update(offset=offset + received, updated_at=timezone.now())
+    session.offset = offset + received
+    return session.offset
+
+
+def finalize(session, sha256=''):
+    """Check the staged file is a complete, acceptable photo and mark the session COMPLETE"""
+    if session.state == 'COMPLETE':
+        return session
+    if session.offset != session.size:
+        raise UploadError({
+            "en": f"The upload is incomplete, {session.offset} of {session.size} bytes received.",
+            "ru": f"Загрузка не завершена, получено {session.offset} из {session.size} байт.",
+            "uz": f"Yuklash tugallanmagan, {session.size} baytdan {session.offset} bayt qabul qilindi.",
+        })
+    path = staging_path(session)
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        head = fh.read(READ_SIZE)
+        digest.update(head)
+        for chunk in iter(lambda: fh.read(1024 * 1024), b''):
+            digest.update(chunk)
+    if sha256 and sha256.lower() != digest.hexdigest():
+        raise UploadError({
+            "en": "The uploaded file does not match its checksum.",
+            "ru": "Загруженный файл не совпадает с контрольной суммой.",
+            "uz": "Yuklangan fayl nazorat summasiga mos kelmaydi.",
+        })
+
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+            image.verify()
+    except Exception:
+        raise UploadError({
+            "en": "The uploaded file is not a valid image.",
+            "ru": "Загруженный файл не является изображением.",
+            "uz": "Yuklangan fayl rasm emas.",
+        })
+    if width * height > settings.LISTING_UPLOAD_MAX_PIXELS:
+        raise UploadError({
+            "en": f"The photo {session.filename} is too large.",
+            "ru": f"Фотография {session.filename} слишком большая.",
+            "uz": f"{session.filename} rasmi juda katta.",
+        })
+
+    session.sha256 = digest.hexdigest()
+    session.content_type = sniff_content_type(head) or ''
+    session.state = 'COMPLETE'
+    session.save(update_fields=['sha256', 'content_type', 'state', 'updated_at'])
+    return session
+
+
+def claim_sessions(sessions):
+    """
+    Lock finalized sessions for attaching, inside the caller's transaction,
+    which then consumes them (`discard_sessions`). Raises UploadError when
+    a concurrent request attached or cancelled one of them first.
+    """
+    ids = [session.pk for session in sessions]
+    claimed = set(
+        UploadSession.objects.select_for_update()
+        .filter(pk__in=ids, state='COMPLETE')
+        .values_list('pk', flat=True)
+    )
+    if len(claimed) != len(set(ids)):
+        raise UploadError({
+            "en": "Some uploads were already attached or cancelled.",
+            "ru": "Некоторые загрузки уже прикреплены или отменены.",
+            "uz": "Ba'zi yuklashlar allaqachon biriktirilgan yoki bekor qilingan.",
+        })
+
+
+def open_upload(session):
+    """Staged file of a finalized session, ready for attach_images"""
+    upload = File(open(staging_path(session), 'rb'), name=session.filename)
+    upload.sha256 = session.sha256
+    upload.content_type = session.content_type
+    return upload
+
+
+def discard_sessions(sessions):
+    """Delete sessions, their staged files once the transaction commits"""
+    paths = [staging_path(session) for session in sessions]
+    UploadSession.objects.filter(pk__in=[session.pk for session in sessions]).delete()
+
+    def remove():
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    transaction.on_commit(remove)
+
+
+def purge_expired_sessions():
+    """
+    Drop sessions past their expiry, returns how many. Sessions locked by a
+    chunk being written or a listing attaching them (`claim_sessions`) are
+    left for the next run.
+    """
+    with transaction.atomic():
+        expired = list(
+            UploadSession.objects.select_for_update(skip_locked=True).filter(expires_at__lt=timezone.now())
+        )
+        if expired:
+            discard_sessions(expired)
+    return len(expired)
@@ -0,0 +1,137 @@
+import re
+from decimal import Decimal
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db import connection
+from django.db.models import DecimalField, F, Q, Value
+from django.db.models.functions import Cast, Round
+from rest_framework.filters import SearchFilter
+
+from apps.listings.models import ListingSearchDocument
+
+
+# Uzbek Cyrillic (a superset of Russian letters) -> official Uzbek Latin
+CYRILLIC_TO_LATIN = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo',
+    'ж': 'j', 'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'x', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sh', 'ъ': '',
+    'ы': 'i', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya', 'ў': 'o', 'қ': 'q',
+    'ғ': 'g', 'ҳ': 'h',
+}
+TRANSLITERATION = str.maketrans(CYRILLIC_TO_LATIN)
+
+# o‘, gʻ etc. are typed with a zoo of apostrophes; drop them all so that
+# "o'zbekiston", "oʻzbekiston" and "ozbekiston" produce the same token.
+APOSTROPHES = re.compile(r"['`´‘’ʻʼ]")
+NON_WORD = re.compile(r'[^\w]+')
+
+
+def normalize_search_text(text):
+    """Lowercase, transliterate Cyrillic to Uzbek Latin and strip apostrophes"""
+    if not text:
+        return ''
+    text = APOSTROPHES.sub('', text.lower()).translate(TRANSLITERATION)
+    return NON_WORD.sub(' ', text).strip()
+
+
+def search_tokens(text):
+    return normalize_search_text(text).split()
+
+
+# tsvector stored on ListingSearchDocument.search_vector, for a batch of
+# listings in one statement (arrays of ids and texts, unnested).
+#
+# Postgres ships no Uzbek dictionary, so every field is indexed twice:
+# transliterated with the `simple` config (covers Uzbek Latin/Cyrillic and
+# gives cross-script matches) and verbatim with the `russian` config
+# (stemming for Russian text).
+UPDATE_SEARCH_VECTORS = """
+UPDATE {table} AS document SET search_vector =
+    setweight(to_tsvector('simple', listing.title_normalized), 'A')
+    || setweight(to_tsvector('russian', listing.title), 'A')
+    || setweight(to_tsvector('simple', listing.location_normalized), 'B')
+    || setweight(to_tsvector('simple', listing.description_normalized), 'C')
+    || setweight(to_tsvector('russian', listing.description), 'C')
+FROM unnest(%s::bigint[], %s::text[], %s::text[], %s::text[], %s::text[], %s::text[])
+    AS listing (id, title_normalized, title, location_normalized, description_normalized, description)
+WHERE document.id = listing.id
+"""
+
+
+def update_search_vectors(listings):
+    """Rebuild search_vector of the documents of `listings` (PostgreSQL only)"""
+    columns = [[], [], [], [], [], []]
+    for listing in listings:
+        row = (
+            listing.id,
+            normalize_search_text(listing.title),
+            listing.title or '',
+            normalize_search_text(listing.location),
+            normalize_search_text(listing.description),
+            listing.description or '',
+        )
+        for column, value in zip(columns, row):
+            column.append(value)
+    if not columns[0]:
+        return
+    sql = UPDATE_SEARCH_VECTORS.format(table=connection.ops.quote_name(ListingSearchDocument._meta.db_table))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, columns)
+
+
+# `rank` is keyed on by the relevance cursor. A float4 rank does not survive
+# the round trip through the JSON cursor (it comes back as a float8 that
+# compares unequal at the page edge), so it is rounded to a fixed-point value.
+RANK_FIELD = DecimalField(max_digits=12, decimal_places=6)
+
+
+def relevance_rank(rank):
+    return Round(Cast(rank, RANK_FIELD), 6, output_field=RANK_FIELD)
+
+
+def build_search_query(text):
+    """Prefix match on normalized tokens OR a stemmed Russian match"""
+    tokens = search_tokens(text)
+    if not tokens:
+        return None
+    prefix_query = SearchQuery(' & '.join(f'{token}:*' for token in tokens), config='simple', search_type='raw')
+    return prefix_query | SearchQuery(text, config='russian', search_type='plain')
+
+
+class ListingSearchFilter(SearchFilter):
+    """
+    Full-text search over ListingSearchDocument.search_vector with relevance
+    ranking and a trigram word-similarity fallback on `title` for typos.
+
+    Always annotates `rank` (a fixed-point number, see RANK_FIELD), so the
+    feed can be ordered and paged by relevance. On
+    databases other than PostgreSQL it falls back to ILIKE matching of the
+    normalized tokens against `search_text`.
+    """
+    vector_field = 'search_vector'
+    trigram_field = 'title'
+    text_field = 'search_text'
+
+    def filter_queryset(self, request, queryset, view):
+        terms = ' '.join(self.get_search_terms(request))
+        if not terms:
+            return queryset
+
+        if connection.vendor != 'postgresql':
+            for token in search_tokens(terms):
+                queryset = queryset.filter(**{f'{self.text_field}__icontains': token})
+            return queryset.annotate(rank=Value(Decimal('0'), output_field=RANK_FIELD))
+
+        query = build_search_query(terms)
+        if query is None:
+            return queryset
+        similarity = TrigramWordSimilarity(terms, self.trigram_field)
+        return (
+            queryset
+            .filter(
+                Q(**{self.vector_field: query})
+                | Q(**{f'{self.trigram_field}__trigram_word_similar': terms})
+            )
+            .annotate(rank=relevance_rank(SearchRank(F(self.vector_field), query) + similarity))
+        )
@@ -1,7 +1,14 @@
 from apps.shared.models import District, Region
 from apps.users.models import User
 from rest_framework import serializers
-from apps.listings.models import Listing, ListingImage, Facility, ForWhom
+from django.conf import settings
+from django.utils import timezone
+from apps.listings.models import Listing, ListingImage, Facility, ForWhom, ListingSearchDocument, UploadSession
+from apps.listings.projections import ListingProjection
+from apps.listings.images import image_url, srcset, thumbnail_name
+from apps.listings.attach import attach_images
+from apps.listings.resumable import UploadError, claim_sessions, discard_sessions, open_upload
+from apps.listings.documents import for_whom_names
 
 class ListingImageSerializer(serializers.ModelSerializer):
     class Meta:
@@ -21,7 +28,27 @@ class DistrictSerializer(serializers.ModelSerializer):
         model = District
         fields = '__all__'
 
-class BaseListingSerializer(serializers.ModelSerializer):
+class ListingProjectionListSerializer(serializers.ListSerializer):
+    """Loads the relations of the whole page in bulk before rendering rows"""
+
+    def to_representation(self, data):
+        listings = list(data.all() if hasattr(data, 'all') else data)
+        self.context['projection'] = ListingProjection(listings, request=self.context.get('request'))
+        return super().to_representation(listings)
+
+
+class ListingProjectionMixin:
+    """Reads images, for_whom, region and district from a ListingProjection"""
+
+    def get_projection(self, obj):
+        projection = self.context.get('projection')
+        if projection is None or not projection.covers(obj):
+            projection = ListingProjection([obj], request=self.context.get('request'))
+            self.context['projection'] = projection
+        return projection
+
+
+class BaseListingSerializer(ListingProjectionMixin, serializers.ModelSerializer):
     images = serializers.SerializerMethodField(read_only=True)
     for_whom = serializers.SerializerMethodField(read_only=True)
 
@@ -48,26 +75,92 @@ class BaseListingSerializer(serializers.ModelSerializer):
             'images',
         ]
         read_only_fields = ['id', 'is_active', 'region', 'district']
+        list_serializer_class = ListingProjectionListSerializer
         
     def get_images(self, obj):
-        """Return serialized images for the listing"""
-        images = ListingImage.objects.filter(listing=obj)
-        return ListingImageSerializer(images, many=True, context=self.context).data
+        """Return serialized images for the listing, thumbnails as `image`"""
+        return self.get_projection(obj).images(obj, originals=False)
     
     
     def get_for_whom(self, obj):
         """Return list of for_whom values"""
-
-        return [fw.name for fw in obj.for_whom.all()] if obj.for_whom else None
+        return self.get_projection(obj).for_whom(obj)
 
     def get_region(self, obj):
         """Return region object"""
-        return RegionSerializer(obj.region, context=self.context).data if obj.region else None
+        return self.get_projection(obj).region(obj)
 
     def get_district(self, obj):
         """Return district object"""
-        return DistrictSerializer(obj.district, context=self.context).data if obj.district else None
+        return self.get_projection(obj).district(obj)
     
+class ListingDocumentSerializer(serializers.ModelSerializer):
+    """Listing card rendered straight from ListingSearchDocument, no extra queries"""
+    images = serializers.SerializerMethodField(read_only=True)
+    for_whom = serializers.SerializerMethodField(read_only=True)
+    region = serializers.SerializerMethodField(read_only=True)
+    district = serializers.SerializerMethodField(read_only=True)
+
+    class Meta:
+        model = ListingSearchDocument
+        fields = [
+            'id',
+            'title',
+            'price',
+            'location',
+            'location_link',
+            'rooms',
+            'total_floor_of_building',
+            'floor_of_this_apartment',
+            'region',
+            'for_whom',
+            'district',
+            'state',
+            'type',
+            'is_active',
+            'images',
+            'image_count',
+        ]
+        read_only_fields = fields
+
+    def get_images(self, obj):
+        """Only the cover thumbnail, `image_count` tells how many there are"""
+        if not obj.cover_image:
+            return []
+        request = self.context.get('request')
+        return [{
+            'id': obj.cover_image_id,
+            'image': image_url(thumbnail_name(obj.cover_variants, obj.cover_image), request),
+            'srcset': srcset(obj.cover_variants, request),
+        }]
+
+    def get_for_whom(self, obj):
+        return for_whom_names(obj.for_whom_mask)
+
+    def get_region(self, obj):
+        if obj.region_id is None:
+            return None
+        return {
+            'id': obj.region_id,
+            'soato_id': obj.region_soato_id,
+            'name_uz': obj.region_name_uz,
+            'name_ru': obj.region_name_ru,
+            'name_en': obj.region_name_en,
+        }
+
+    def get_district(self, obj):
+        if obj.district_id is None:
+            return None
+        return {
+            'id': obj.district_id,
+            'soato_id': obj.district_soato_id,
+            'name_uz': obj.district_name_uz,
+            'name_ru': obj.district_name_ru,
+            'name_en': obj.district_name_en,
+            'region': obj.region_id,
+        }
+
+
 class FacilitySerializer(serializers.ModelSerializer):
     class Meta:
         model = Facility
@@ -78,7 +171,7 @@ class FacilitySerializer(serializers.ModelSerializer):
         ]
 
         
-class ListingSerializer(serializers.ModelSerializer):
+class ListingSerializer(ListingProjectionMixin, serializers.ModelSerializer):
     images = serializers.SerializerMethodField(read_only=True)
     images_upload = serializers.ListField(
         child=serializers.ImageField(max_length=None, allow_empty_file=False),
@@ -86,6 +179,12 @@ class ListingSerializer(serializers.ModelSerializer):
         required=False,
         help_text='Upload multiple images for the listing'
     )
+    upload_ids = serializers.ListField(
+        child=serializers.UUIDField(),
+        write_only=True,
+        required=False,
+        help_text='Ids of finalized resumable uploads to attach as images'
+    )
     facilities = serializers.StringRelatedField(many=True, read_only=True)
     host = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), required=False)
     for_whom = serializers.ListField(
@@ -118,6 +217,7 @@ class ListingSerializer(serializers.ModelSerializer):
             'type',
             'images',
             'images_upload',
+            'upload_ids',
             'facilities',
         ]
         read_only_fields = [
@@ -126,15 +226,15 @@ class ListingSerializer(serializers.ModelSerializer):
             'images',
             'facilities'
         ]
+        list_serializer_class = ListingProjectionListSerializer
 
     def get_images(self, obj):
         """Return serialized images for the listing"""
-        images = ListingImage.objects.filter(listing=obj)
-        return ListingImageSerializer(images, many=True, context=self.context).data
+        return self.get_projection(obj).images(obj)
     
     def get_for_whom_display(self, obj):
         """Return list of for_whom values"""
-        return [fw.name for fw in obj.for_whom.all()]
+        return self.get_projection(obj).for_whom(obj)
     
     # def to_internal_value(self, data):
     #     """Handle for_whom array from multipart/form-data (QueryDict)"""
@@ -162,6 +262,7 @@ class ListingSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         """Handle image upload and for_whom during creation"""
         images_data = validated_data.pop('images_upload', [])
+        sessions = validated_data.pop('upload_ids', [])
         for_whom_data = validated_data.pop('for_whom', [])
         listing = Listing.objects.create(**validated_data)
         
@@ -170,14 +271,14 @@ class ListingSerializer(serializers.ModelSerializer):
             fw_obj, _ = ForWhom.objects.get_or_create(name=fw_name)
             listing.for_whom.add(fw_obj)
         
-        for image in images_data:
-            ListingImage.objects.create(listing=listing, image=image)
+        self.attach_uploads(listing, images_data, sessions)
         
         return listing
 
     def update(self, instance, validated_data):
         """Handle image upload and for_whom during update"""
         images_data = validated_data.pop('images_upload', [])
+        sessions = validated_data.pop('upload_ids', [])
         for_whom_data = validated_data.pop('for_whom', None)
         
         # Update listing fields
@@ -193,10 +294,40 @@ class ListingSerializer(serializers.ModelSerializer):
                 instance.for_whom.add(fw_obj)
         
         # Add new images (without deleting old ones)
-        for image in images_data:
-            ListingImage.objects.create(listing=instance, image=image)
+        self.attach_uploads(instance, images_data, sessions)
         
         return instance
+
+    def attach_uploads(self, listing, images_data, sessions):
+        """Store multipart uploads and finalized resumable uploads in one bulk attach"""
+        if sessions:
+            # validated outside the transaction, a concurrent request may have used them since
+            try:
+                claim_sessions(sessions)
+            except UploadError as e:
+                raise serializers.ValidationError({'upload_ids': e.message['en']})
+        staged = [open_upload(session) for session in sessions]
+        try:
+            attach_images(listing, list(images_data) + staged)
+        finally:
+            for upload in staged:
+                upload.close()
+        if sessions:
+            discard_sessions(sessions)
+
+    def validate_upload_ids(self, value):
+        """Finalized, unexpired uploads of the requesting user"""
+        request = self.context.get('request')
+        if request is None or not request.user.is_authenticated:
+            raise serializers.ValidationError("Authentication is required to attach uploads.")
+        ids = list(dict.fromkeys(value))
+        sessions = UploadSession.objects.filter(
+            pk__in=ids, user=request.user, state='COMPLETE', expires_at__gt=timezone.now(),
+        ).in_bulk()
+        missing = [str(pk) for pk in ids if pk not in sessions]
+        if missing:
+            raise serializers.ValidationError(f"Uploads not found or not finalized: {', '.join(missing)}")
+        return [sessions[pk] for pk in ids]
     
     def validate_rooms(self, value):
         """Validate rooms count"""
@@ -219,6 +350,12 @@ class ListingSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError({
                 'floor_of_this_apartment': "Kvartira qavati binoning umumiy qavatidan oshmasligi kerak."
             })
+
+        images_count = len(data.get('images_upload', [])) + len(data.get('upload_ids', []))
+        if images_count > settings.LISTING_UPLOAD_MAX_FILES:
+            raise serializers.ValidationError({
+                'images_upload': f"Rasmlar soni {settings.LISTING_UPLOAD_MAX_FILES} tadan oshmasligi kerak."
+            })
         
         return data
     
@@ -287,23 +424,52 @@ class ListingDetailSerializer(ListingSerializer):
             'images',
             'facilities'
         ]
+        list_serializer_class = ListingProjectionListSerializer
     
     def get_for_whom_display(self, obj):
         """Return list of for_whom values"""
-        return [fw.name for fw in obj.for_whom.all()]
+        return self.get_projection(obj).for_whom(obj)
     
     def get_region(self, obj):
         """Return region object"""
-        return RegionSerializer(obj.region, context=self.context).data if obj.region else None
+        return self.get_projection(obj).region(obj)
         
     def get_district(self, obj):
         """Return district object"""
-        return DistrictSerializer(obj.district, context=self.context).data if obj.district else None
+        return self.get_projection(obj).district(obj)
     
     def get_for_whom(self, obj):
         """Return list of for_whom values"""
-        return [fw.name for fw in obj.for_whom.all()]
+        return self.get_projection(obj).for_whom(obj)
     
     def get_images(self, obj):
-        images = ListingImage.objects.filter(listing=obj)
-        return ListingImageSerializer(images, many=True, context=self.context).data
+        return self.get_projection(obj).images(obj)
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = [
+            'id',
+            'filename',
+            'size',
+            'offset',
+            'state',
+            'sha256',
+            'expires_at',
+        ]
+        read_only_fields = [
+            'id',
+            'offset',
+            'state',
+            'sha256',
+            'expires_at',
+        ]
+
+    def validate_size(self, value):
+        """Validate the declared file size"""
+        if value <= 0 or value > settings.LISTING_UPLOAD_MAX_BYTES:
+            raise serializers.ValidationError(
+                f"Fayl hajmi 1 baytdan {settings.LISTING_UPLOAD_MAX_BYTES} baytgacha bo'lishi kerak."
+            )
+        return value
@@ -0,0 +1,90 @@
+from django.db import connections
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_migrate, pre_save
+from django.dispatch import receiver
+
+from apps.listings import documents
+from apps.listings.conditional import touch_listings
+from apps.listings.images import content_address
+from apps.listings.tasks import queue_image_variants
+from apps.listings.validation import schedule_image_validation
+from apps.listings.models import Listing, ListingImage
+from apps.shared.models import District, Region
+
+
+@receiver(pre_migrate)
+def create_search_extensions(sender, using, **kwargs):
+    """pg_trgm must exist before the trigram GIN index is created"""
+    connection = connections[using]
+    if sender.label != 'listings' or connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+
+# Every change that shows up on a listing card refreshes its search document;
+# the refresh bumps the feed cache version once it is written.
+
+@receiver(post_save, sender=Listing)
+@receiver(post_delete, sender=Listing)
+def refresh_document_on_listing_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    documents.schedule_document_refresh(instance.pk)
+
+
+@receiver(post_save, sender=ListingImage)
+@receiver(post_delete, sender=ListingImage)
+def refresh_document_on_image_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    touch_listings(instance.listing_id)
+    documents.schedule_document_refresh(instance.listing_id)
+
+
+@receiver(pre_save, sender=ListingImage)
+def hash_new_image(sender, instance, raw=False, **kwargs):
+    if not raw:
+        content_address(instance)
+
+
+@receiver(post_save, sender=ListingImage)
+def process_new_image(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and instance.image:
+        queue_image_variants(instance.pk)
+        schedule_image_validation(instance.listing_id, instance.pk)
+
+
+@receiver(m2m_changed, sender=Listing.for_whom.through)
+def refresh_document_on_for_whom_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        listing_ids = [instance.pk] if action in ('post_add', 'post_remove', 'post_clear') else []
+    elif action == 'pre_clear':
+        # ForWhom.listings.clear() does not report which listings it touches
+        listing_ids = list(instance.listings.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove') and pk_set:
+        listing_ids = list(pk_set)
+    else:
+        listing_ids = []
+    if listing_ids:
+        touch_listings(*listing_ids)
+        documents.schedule_document_refresh(*listing_ids)
+
+
+@receiver(post_save, sender=Region)
+def sync_document_region(sender, instance, raw=False, **kwargs):
+    documents.sync_region_names(instance)
+
+
+@receiver(post_delete, sender=Region)
+def clear_document_region(sender, instance, **kwargs):
+    documents.clear_region(instance.pk)
+
+
+@receiver(post_save, sender=District)
+def sync_document_district(sender, instance, raw=False, **kwargs):
+    documents.sync_district_names(instance)
+
+
+@receiver(post_delete, sender=District)
+def clear_document_district(sender, instance, **kwargs):
+    documents.clear_district(instance.pk)
@@ -0,0 +1,114 @@
+from celery import shared_task
+from django.db import transaction
+from django.utils import timezone
+
+from apps.listings.conditional import touch_listings
+from apps.listings.documents import schedule_document_refresh
+from apps.listings.images import UndecodableImage, delete_variants, generate_variants
+from apps.listings.models import Listing, ListingImage
+from apps.listings.resumable import purge_expired_sessions
+from apps.listings.validation import check_images
+from apps.shared.utils import get_logger
+
+logger = get_logger()
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=30)
+def generate_image_variants(self, image_id, force=False):
+    """Thumbnail and WebP/AVIF variants of one ListingImage's file"""
+    image = ListingImage.objects.filter(pk=image_id).only('id', 'listing_id', 'image', 'variants').first()
+    if image is None or not image.image:
+        return
+    if image.variants and not force:
+        return
+    name = image.image.name
+    # Rows sharing the file share its variants
+    sharing = ListingImage.objects.filter(image=name)
+    existing = sharing.exclude(variants={}).values_list('variants', flat=True).first()
+
+    if existing and not force:
+        variants = existing
+    else:
+        try:
+            variants = generate_variants(name)
+        except FileNotFoundError:
+            logger.error(f"Original of listing image {image_id} is missing, no variants generated")
+            return
+        except UndecodableImage as e:
+            logger.error(f"Listing image {image_id} cannot be decoded, no variants generated: {str(e)}")
+            return
+        except OSError as e:
+            # storage I/O, worth another try
+            logger.error(f"Could not generate variants for listing image {image_id}: {str(e)}")
+            raise self.retry(exc=e)
+
+    with transaction.atomic():
+        listing_ids = list(sharing.values_list('listing_id', flat=True))
+        updated = sharing.update(variants=variants)
+        if updated:
+            touch_listings(*listing_ids)
+            schedule_document_refresh(*listing_ids)
+    if variants is existing:
+        return
+    if not updated:
+        # deleted while we were rendering
+        delete_variants(variants)
+        return
+    if force and existing:
+        delete_variants(existing)
+    logger.info(f"Generated {sum(len(f) for f in variants.values())} variants for listing image {image_id}")
+
+
+def queue_image_variants(image_id):
+    """Queue variant generation once the current transaction commits"""
+    def enqueue():
+        try:
+            generate_image_variants.delay(image_id)
+        except Exception as e:
+            logger.error(f"Could not queue variants for listing image {image_id}: {str(e)}")
+    transaction.on_commit(enqueue)
+
+
+@shared_task(bind=True, max_retries=5, default_retry_delay=60)
+def validate_listing_images(self, listing_id, image_ids):
+    """
+    Nyckel verdicts for new images of a listing; one clear miss rejects it.
+    Passing photos do not accept the listing, a moderator still does: the
+    listing stays CHECKING and `images_checked_at` tells it was checked.
+    """
+    images = list(
+        ListingImage.objects
+        .filter(listing_id=listing_id, id__in=image_ids)
+        .values_list('id', 'image', 'sha256', 'phash')
+    )
+    verdicts = check_images(images)
+    rejected = [v for v in verdicts if v.rejected]
+    if rejected:
+        now = timezone.now()
+        Listing.objects.filter(pk=listing_id).update(images_checked_at=now)
+        updated = Listing.objects.filter(pk=listing_id).exclude(state='REJECTED').update(
+            state='REJECTED', updated_at=now
+        )
+        if updated:
+            schedule_document_refresh(listing_id)
+        logger.info(
+            f"Listing {listing_id} rejected, no property on image(s) "
+            f"{', '.join(f'{v.image_id} ({v.confidence:.2%})' for v in rejected)}"
+        )
+        return
+    failed = [v.image_id for v in verdicts if v.error]
+    if failed:
+        # try the whole batch again later, the listing stays CHECKING meanwhile
+        raise self.retry(exc=RuntimeError(f"Nyckel check failed for images {failed}"))
+    # not shown on the listing itself, updated_at and the document stay as they are
+    Listing.objects.filter(pk=listing_id).update(images_checked_at=timezone.now())
+    cached = sum(1 for v in verdicts if v.cached)
+    logger.info(f"Nyckel validation passed for listing {listing_id} ({len(verdicts)} images, {cached} known)")
+
+
+@shared_task
+def purge_upload_sessions():
+    """Drop expired resumable uploads and their staged chunks"""
+    purged = purge_expired_sessions()
+    if purged:
+        logger.info(f"Purged {purged} expired upload sessions")
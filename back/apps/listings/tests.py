@@ -1,3 +1,1144 @@
-from django.test import TestCase
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import Executor, Future
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apps.listings.attach import atomic_with_files, attach_images
+from apps.listings import resumable
+from apps.listings.documents import FOR_WHOM_BITS, refresh_listing_documents
+from apps.listings.images import discard_file, reuse_file, stored_version
+from apps.listings.management.commands import shard_listing_images
+from apps.listings.models import ForWhom, ImageVerdict, Listing, ListingImage, ListingSearchDocument, UploadSession
+from apps.listings.search import normalize_search_text
+from apps.listings.tasks import generate_image_variants, validate_listing_images
+from apps.listings.validation import HOUSE_NOT_PRESENT, Verdict, check_images, schedule_image_validation
+from apps.payment import ledger
+from apps.payment.models import Card
+from apps.shared.enum import ResultCodes
+from apps.shared.models import District, Region
+from apps.users.models import User
+
+
+DUMMY_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+LOCAL_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'listings-tests'}}
+
+# Every filter combination the public feed supports, with each ordering.
+FEED_QUERIES = [
+    '',
+    'ordering=price',
+    'ordering=-price',
+    'price__gte=1500000',
+    'price__gte=1500000&price__lte=2500000',
+    'price__gte=1500000&price__lte=2500000&ordering=price',
+    'region=3',
+    'region=3&ordering=price',
+    'region=3&price__lte=2000000&ordering=price',
+    'region=3&district=12',
+    'district=12',
+    'rooms=2',
+    'rooms=2&ordering=-price',
+    'type=PARTNERSHIP',
+    'for_whom__name=GIRLS',
+    'for_whom__name=FAMILY&rooms=3',
+    'floor_of_this_apartment=4',
+    'region=3&rooms=2&type=EMPTY&for_whom__name=BOYS',
+]
+
+# Only PostgreSQL has the GIN indexes; the SQLite fallback is a LIKE scan.
+SEARCH_QUERIES = [
+    'search=yunusobod',
+    'search=kvartira&region=3',
+]
+
+
+class ListingQueryPlanTests(TestCase):
+    """
+    Seeds a realistic catalogue and fails when a hot-path query is planned
+    as a sequential scan of the listings tables.
+    """
+    DOCUMENTS = 20000
+    HOSTS = 500
+    LISTINGS_PER_HOST = 8
+
+    @classmethod
+    def setUpTestData(cls):
+        rnd = random.Random(42)
+        regions = Region.objects.bulk_create(
+            Region(name_uz=f'Region {i}', soato_id=1700 + i) for i in range(1, 15)
+        )
+        districts = District.objects.bulk_create(
+            District(region=regions[i % len(regions)], name_uz=f'District {i}') for i in range(200)
+        )
+        masks = [sum(bits) for bits in (
+            (FOR_WHOM_BITS['BOYS'],),
+            (FOR_WHOM_BITS['GIRLS'],),
+            (FOR_WHOM_BITS['FAMILY'],),
+            (FOR_WHOM_BITS['BOYS'], FOR_WHOM_BITS['GIRLS']),
+            (FOR_WHOM_BITS['FAMILY'], FOR_WHOM_BITS['FOREIGNERS']),
+        )]
+        today = date.today()
+        documents = []
+        for i in range(1, cls.DOCUMENTS + 1):
+            district = rnd.choice(districts)
+            documents.append(ListingSearchDocument(
+                id=i,
+                title=f'{rnd.randint(1, 5)} xonali kvartira {i}',
+                price=Decimal(rnd.randrange(500000, 9000000, 50000)),
+                location='Toshkent',
+                rooms=rnd.randint(1, 6),
+                total_floor_of_building=9,
+                floor_of_this_apartment=rnd.randint(1, 9),
+                state=rnd.choices(['ACCEPTED', 'CHECKING', 'REJECTED'], [85, 10, 5])[0],
+                type=rnd.choice(['EMPTY', 'PARTNERSHIP']),
+                is_active=rnd.random() < 0.9,
+                created_at=today - timedelta(days=rnd.randint(0, 365)),
+                for_whom_mask=rnd.choice(masks),
+                region_id=district.region_id,
+                district_id=district.id,
+                search_text=f'{i} xonali kvartira toshkent',
+            ))
+        ListingSearchDocument.objects.bulk_create(documents, batch_size=2000)
+
+        hosts = User.objects.bulk_create(
+            User(email=f'host{i}@example.com', username=f'host{i}') for i in range(cls.HOSTS)
+        )
+        cls.host = hosts[0]
+        Listing.objects.bulk_create((
+            Listing(
+                title='Listing', description='', price=Decimal('1000000'), host=host,
+                location='Toshkent', state='ACCEPTED', is_active=rnd.random() < 0.7,
+            )
+            for host in hosts for _ in range(cls.LISTINGS_PER_HOST)
+        ), batch_size=2000)
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def explain(self, sql):
+        prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql)
+            rows = cursor.fetchall()
+        if connection.vendor == 'sqlite':
+            return '\n'.join(row[-1] for row in rows)
+        return '\n'.join(row[0] for row in rows)
+
+    def sequential_scans(self, plan, tables):
+        if connection.vendor == 'sqlite':
+            # "SCAN t" reads the table, "SCAN t USING INDEX i" walks an index
+            pattern = r'^\s*SCAN (%s)\s*$'
+        else:
+            pattern = r'Seq Scan on (%s)\b'
+        return re.findall(pattern % '|'.join(tables), plan, re.MULTILINE)
+
+    def assertIndexedQueries(self, queries, tables):
+        for query in queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith('SELECT') or not any(t in sql for t in tables):
+                continue
+            plan = self.explain(sql)
+            with self.subTest(sql=sql):
+                self.assertEqual(self.sequential_scans(plan, tables), [], plan)
+
+    @override_settings(CACHES=DUMMY_CACHE)
+    def test_feed_plans(self):
+        queries = FEED_QUERIES + (SEARCH_QUERIES if connection.vendor == 'postgresql' else [])
+        for query in queries:
+            with self.subTest(query=query):
+                with CaptureQueriesContext(connection) as captured:
+                    response = self.client.get(f'/api/listings/listings/?{query}')
+                self.assertEqual(response.status_code, 200)
+                self.assertIndexedQueries(captured.captured_queries, [ListingSearchDocument._meta.db_table])
+
+    def test_host_listing_plans(self):
+        table = Listing._meta.db_table
+        querysets = [
+            Listing.objects.filter(host=self.host),
+            Listing.objects.filter(host=self.host, is_active=True),
+            self.host.listings.filter(is_active=True),
+        ]
+        for queryset in querysets:
+            with self.subTest(sql=str(queryset.query)):
+                with CaptureQueriesContext(connection) as captured:
+                    list(queryset)
+                self.assertIndexedQueries(captured.captured_queries, [table])
+
+
+class ListingSearchPaginationTests(TestCase):
+    """Walking a search by relevance returns every match exactly once"""
+
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(name_uz='Toshkent', soato_id=1726)
+        district = District.objects.create(region=region, name_uz='Yunusobod')
+        ListingSearchDocument.objects.bulk_create(
+            ListingSearchDocument(
+                id=i,
+                # a few repeated titles, so many matches tie on rank
+                title=f'{i % 3 + 1} xonali kvartira' if i <= 45 else f'Hovli {i}',
+                price=Decimal('1000000'),
+                location='Toshkent',
+                rooms=i % 3 + 1,
+                state='ACCEPTED',
+                is_active=True,
+                created_at=date.today(),
+                region_id=region.id,
+                district_id=district.id,
+                search_text=f'{i % 3 + 1} xonali kvartira yunusobod' if i <= 45 else f'hovli {i}',
+            )
+            for i in range(1, 61)
+        )
+        if connection.vendor == 'postgresql':
+            from django.contrib.postgres.search import SearchVector
+            ListingSearchDocument.objects.update(search_vector=SearchVector('search_text', config='simple'))
+
+    @override_settings(CACHES=DUMMY_CACHE)
+    def test_walks_every_page_of_a_search(self):
+        url = '/api/listings/listings/?search=kvartira&page_size=7'
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            result = response.json()['result']
+            seen += [listing['id'] for listing in result['results']]
+            url = result['next']
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(set(seen), set(range(1, 46)))
+
+
+@override_settings(CACHES=DUMMY_CACHE)
+class ListingSearchTests(TestCase):
+    """Searches match across scripts and apostrophe spellings, on PostgreSQL and on the LIKE fallback"""
+
+    @classmethod
+    def setUpTestData(cls):
+        host = User.objects.create(email='host@example.com', username='host')
+        titles = ['Юнусобод, 2 хонали квартира', "O‘zbekiston ko'chasi, hovli", 'Chilonzor kvartira']
+        listings = Listing.objects.bulk_create(
+            Listing(
+                title=title, description='', price=Decimal('1000000'), host=host, location='Toshkent',
+                state='ACCEPTED', is_active=True,
+            )
+            for title in titles
+        )
+        refresh_listing_documents([listing.pk for listing in listings])
+        cls.yunusobod, cls.ozbekiston, cls.chilonzor = (listing.pk for listing in listings)
+
+    def search(self, text):
+        response = self.client.get('/api/listings/listings/', {'search': text})
+        self.assertEqual(response.status_code, 200)
+        return sorted(listing['id'] for listing in response.json()['result']['results'])
+
+    def test_normalize_search_text(self):
+        self.assertEqual(normalize_search_text('Юнусобод, 2 хонали'), 'yunusobod 2 xonali')
+        for spelling in ("O'zbekiston", 'Oʻzbekiston', 'O‘zbekiston', 'Ozbekiston'):
+            self.assertEqual(normalize_search_text(spelling), 'ozbekiston')
+
+    def test_matches_across_scripts(self):
+        self.assertEqual(self.search('yunusobod'), [self.yunusobod])
+        self.assertEqual(self.search('ЧИЛОНЗОР'), [self.chilonzor])
+        self.assertEqual(self.search("o'zbekiston"), [self.ozbekiston])
+        self.assertEqual(self.search('kvartira'), sorted([self.yunusobod, self.chilonzor]))
+        # every token has to match
+        self.assertEqual(self.search('kvartira yunusobod'), [self.yunusobod])
+        self.assertEqual(self.search('hovli yunusobod'), [])
+
+    @skipUnless(connection.vendor == 'postgresql', 'trigram similarity needs PostgreSQL')
+    def test_trigram_fallback_forgives_typos(self):
+        self.assertEqual(self.search('Chilanzor'), [self.chilonzor])
+
+
+@override_settings(CACHES=DUMMY_CACHE, LISTING_PRICE_BUCKETS=[1000000, 2000000])
+class ListingFacetTests(TestCase):
+    """Facet counts agree with counting the visible documents one by one"""
+
+    @classmethod
+    def setUpTestData(cls):
+        region = Region.objects.create(name_uz='Toshkent', soato_id=1726)
+        other = Region.objects.create(name_uz='Samarqand', soato_id=1718)
+        cls.region_ids = (region.id, other.id)
+        masks = [0, FOR_WHOM_BITS['BOYS'], FOR_WHOM_BITS['GIRLS'] | FOR_WHOM_BITS['FAMILY']]
+        ListingSearchDocument.objects.bulk_create(
+            ListingSearchDocument(
+                id=i, title=f'Listing {i}', price=Decimal(500000 * (i % 6 + 1)), location='Toshkent',
+                rooms=i % 3 + 1, type=('EMPTY', 'PARTNERSHIP', None)[i % 3 if i % 4 else 0],
+                for_whom_mask=masks[i % 3], region_id=(region.id, other.id, None)[i % 3],
+                # every fifth listing is hidden from the feed
+                state='CHECKING' if i % 5 == 0 else 'ACCEPTED', is_active=True, created_at=date.today(),
+            )
+            for i in range(1, 41)
+        )
+
+    def facets(self, query=''):
+        response = self.client.get(f'/api/listings/facets/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['result']
+
+    def expected(self, documents):
+        def counts(values):
+            counter = Counter(value for value in values if value is not None)
+            return [{'value': value, 'count': count} for value, count in sorted(counter.items())]
+        return {
+            'total': len(documents),
+            'facets': {
+                'region': counts(d.region_id for d in documents),
+                'district': [],
+                'rooms': counts(d.rooms for d in documents),
+                'type': counts(d.type for d in documents),
+                'for_whom': counts(
+                    name for d in documents for name, bit in FOR_WHOM_BITS.items() if d.for_whom_mask & bit
+                ),
+                'price': [
+                    {'min': '0', 'max': '1000000', 'count': sum(d.price < 1000000 for d in documents)},
+                    {'min': '1000000', 'max': '2000000', 'count': sum(1000000 <= d.price < 2000000 for d in documents)},
+                    {'min': '2000000', 'max': None, 'count': sum(d.price >= 2000000 for d in documents)},
+                ],
+            },
+        }
+
+    def test_counts(self):
+        visible = list(ListingSearchDocument.objects.filter(state='ACCEPTED', is_active=True))
+        self.assertEqual(self.facets(), self.expected(visible))
+
+    def test_counts_follow_the_filters(self):
+        region_id = self.region_ids[0]
+        visible = ListingSearchDocument.objects.filter(state='ACCEPTED', is_active=True)
+        self.assertEqual(self.facets(f'region={region_id}'), self.expected(list(visible.filter(region_id=region_id))))
+        girls = [d for d in visible if d.for_whom_mask & FOR_WHOM_BITS['GIRLS']]
+        self.assertEqual(self.facets('for_whom__name=GIRLS'), self.expected(girls))
+
+
+@override_settings(CACHES=DUMMY_CACHE)
+class FeedPaginationTests(TestCase):
+    """Walking the feed in every ordering returns each listing once, in order, both ways"""
+
+    @classmethod
+    def setUpTestData(cls):
+        today = date.today()
+        # few distinct dates and prices, so most rows tie on the first key
+        ListingSearchDocument.objects.bulk_create(
+            ListingSearchDocument(
+                id=i, title=f'Listing {i}', price=Decimal(1000000 * (i % 3 + 1)), location='Toshkent',
+                state='ACCEPTED', is_active=True, created_at=today - timedelta(days=i % 4),
+            )
+            for i in range(1, 31)
+        )
+        ListingSearchDocument.objects.filter(id=30).update(is_active=False)
+
+    def walk(self, ordering):
+        url = f'/api/listings/listings/?ordering={ordering}&page_size=4'
+        pages = []
+        while url:
+            result = self.client.get(url).json()['result']
+            pages.append([listing['id'] for listing in result['results']])
+            url, previous = result['next'], result['previous']
+        # and back from the last page
+        back = [pages[-1]]
+        while previous:
+            result = self.client.get(previous).json()['result']
+            back.insert(0, [listing['id'] for listing in result['results']])
+            previous = result['previous']
+        self.assertEqual(back, pages)
+        return [listing_id for page in pages for listing_id in page]
+
+    def test_orderings(self):
+        documents = ListingSearchDocument.objects.filter(is_active=True)
+        expected = {
+            'newest': documents.order_by('-created_at', '-id'),
+            'price': documents.order_by('price', 'id'),
+            '-price': documents.order_by('-price', '-id'),
+        }
+        for ordering, queryset in expected.items():
+            with self.subTest(ordering=ordering):
+                self.assertEqual(self.walk(ordering), list(queryset.values_list('id', flat=True)))
+
+    def test_listing_without_a_creation_date_comes_last(self):
+        host = User.objects.create(email='host@example.com', username='host')
+        listing = Listing.objects.create(
+            title='Old', description='', price=Decimal('1000000'), host=host, location='Toshkent',
+            state='ACCEPTED', is_active=True,
+        )
+        Listing.objects.filter(pk=listing.pk).update(created_at=None)
+        refresh_listing_documents([listing.pk])
+        self.assertEqual(ListingSearchDocument.objects.get(pk=listing.pk).created_at, date.min)
+        self.assertEqual(self.walk('newest')[-1], listing.pk)
+
+
+def photo(name='photo.jpg', size=(64, 48), color='white', format='JPEG'):
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, format)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+class ListingMediaTestCase(TestCase):
+    """Listing writes of an authenticated host, with media and staged uploads in temporary directories"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp(prefix='kvarthub-media-')
+        cls.staging_root = tempfile.mkdtemp(prefix='kvarthub-staging-')
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root, UPLOAD_STAGING_ROOT=cls.staging_root)
+        cls.media_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        shutil.rmtree(cls.staging_root, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.region = Region.objects.create(name_uz='Toshkent', soato_id=1726)
+        cls.host = User.objects.create(email='host@example.com', username='host', is_active=True)
+
+    def setUp(self):
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {AccessToken.for_user(self.host)}'
+
+    def create_listing(self, **data):
+        return self.client.post('/api/listings/create/', {
+            'title': '2 xonali kvartira', 'description': 'Test', 'price': '1500000',
+            'location': 'Toshkent', 'rooms': 2, 'region': self.region.pk, **data,
+        })
+
+    def assertRefused(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['error']['code'], ResultCodes.VALIDATION_ERROR.value)
+        self.assertFalse(Listing.objects.exists())
+        self.assertFalse(ListingImage.objects.exists())
+
+
+class ListingUploadLimitTests(ListingMediaTestCase):
+    def test_accepts_photos_within_limits(self):
+        response = self.create_listing(images_upload=[photo('a.jpg'), photo('b.png', format='PNG')])
+        self.assertTrue(response.json()['success'], response.json())
+        self.assertEqual(ListingImage.objects.filter(listing__host=self.host).count(), 2)
+
+    @override_settings(LISTING_UPLOAD_MAX_FILES=2)
+    def test_too_many_files(self):
+        self.assertRefused(self.create_listing(images_upload=[photo(color=c) for c in ('red', 'green', 'blue')]))
+
+    @override_settings(LISTING_UPLOAD_MAX_BYTES=4 * 1024)
+    def test_too_many_bytes(self):
+        self.assertRefused(self.create_listing(images_upload=[photo(size=(1600, 1200), color=c) for c in ('red', 'blue')]))
+
+    @override_settings(LISTING_UPLOAD_MAX_PIXELS=100 * 100)
+    def test_too_many_pixels(self):
+        self.assertRefused(self.create_listing(images_upload=[photo(size=(200, 200))]))
+
+    def test_not_an_image(self):
+        response = self.create_listing(images_upload=[SimpleUploadedFile('photo.jpg', b'not a photo' * 100)])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('images_upload', response.json())
+        self.assertFalse(ListingImage.objects.exists())
+
+
+class DocumentSyncTests(ListingMediaTestCase):
+    """Every write that shows on a listing card reaches its search document once the transaction commits"""
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.listing = Listing.objects.create(
+                title='Listing', description='', price=Decimal('1000000'), host=self.host, location='Toshkent',
+                region=self.region, state='ACCEPTED', is_active=True,
+            )
+
+    def document(self):
+        return ListingSearchDocument.objects.get(pk=self.listing.pk)
+
+    def test_listing_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.listing.title = 'Hovli'
+            self.listing.price = Decimal('2500000')
+            self.listing.save()
+            # not before the commit
+            self.assertEqual(self.document().title, 'Listing')
+        document = self.document()
+        self.assertEqual((document.title, document.price, document.region_name_uz), ('Hovli', Decimal('2500000'), 'Toshkent'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.listing.delete()
+        self.assertFalse(ListingSearchDocument.objects.exists())
+
+    def test_image_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first, second = (ListingImage.objects.create(listing=self.listing, image=photo(color=c)) for c in ('red', 'blue'))
+        document = self.document()
+        self.assertEqual((document.image_count, document.cover_image_id), (2, first.pk))
+        self.assertEqual(document.cover_image, first.image.name)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual((self.document().image_count, self.document().cover_image_id), (1, second.pk))
+
+    def test_for_whom_change(self):
+        family, girls = (ForWhom.objects.create(name=name) for name in ('FAMILY', 'GIRLS'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.listing.for_whom.add(family, girls)
+        self.assertEqual(self.document().for_whom_mask, FOR_WHOM_BITS['FAMILY'] | FOR_WHOM_BITS['GIRLS'])
+
+        # from the other side of the relation too
+        with self.captureOnCommitCallbacks(execute=True):
+            family.listings.remove(self.listing)
+        self.assertEqual(self.document().for_whom_mask, FOR_WHOM_BITS['GIRLS'])
+        with self.captureOnCommitCallbacks(execute=True):
+            girls.listings.clear()
+        self.assertEqual(self.document().for_whom_mask, 0)
+
+    def test_region_change(self):
+        self.region.name_uz = 'Toshkent shahri'
+        self.region.save()
+        self.assertEqual(self.document().region_name_uz, 'Toshkent shahri')
+
+        self.region.delete()
+        document = self.document()
+        self.assertEqual((document.region_id, document.region_name_uz), (None, None))
+
+    def test_writes_collapse_into_one_refresh(self):
+        family = ForWhom.objects.create(name='FAMILY')
+        # the variant task refreshes again after its own write, not part of this transaction
+        with mock.patch('apps.listings.signals.queue_image_variants'):
+            with mock.patch('apps.listings.documents.refresh_listing_documents') as refresh:
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.listing.title = 'Hovli'
+                    self.listing.save()
+                    ListingImage.objects.create(listing=self.listing, image=photo())
+                    self.listing.for_whom.add(family)
+        refresh.assert_called_once_with({self.listing.pk})
+
+
+class ListingProjectionTests(ListingMediaTestCase):
+    """Cards rendered from a bulk-loaded projection match their own relations, at a fixed query cost"""
+
+    def add_listings(self, count):
+        family, girls = (ForWhom.objects.get_or_create(name=name)[0] for name in ('FAMILY', 'GIRLS'))
+        district = District.objects.create(region=self.region, name_uz='Yunusobod')
+        for i in range(count):
+            listing = Listing.objects.create(
+                title=f'Listing {i}', description='', price=Decimal('1000000'), host=self.host,
+                location='Toshkent', region=self.region if i % 2 else None, district=district if i % 3 else None,
+            )
+            for color in ('red', 'blue')[:i % 3]:
+                ListingImage.objects.create(listing=listing, image=photo(color=color))
+            listing.for_whom.set([family, girls][:i % 3])
+
+    def my_listings(self):
+        response = self.client.get('/api/listings/my-listings/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['result']
+
+    def test_cards_carry_their_own_relations(self):
+        self.add_listings(6)
+        cards = self.my_listings()
+        self.assertEqual(len(cards), 6)
+        for card in cards:
+            listing = Listing.objects.get(pk=card['id'])
+            with self.subTest(listing=listing.title):
+                self.assertEqual(
+                    [image['id'] for image in card['images']],
+                    list(listing.images.order_by('id').values_list('id', flat=True)),
+                )
+                self.assertEqual(sorted(card['for_whom']), sorted(listing.for_whom.values_list('name', flat=True)))
+                self.assertEqual(card['region'] and card['region']['id'], listing.region_id)
+                self.assertEqual(card['district'] and card['district']['id'], listing.district_id)
+
+    def test_query_count_does_not_grow_with_the_page(self):
+        self.add_listings(2)
+        self.my_listings()
+        with CaptureQueriesContext(connection) as few:
+            self.my_listings()
+        self.add_listings(10)
+        self.my_listings()
+        with CaptureQueriesContext(connection) as many:
+            self.assertEqual(len(self.my_listings()), 12)
+        self.assertEqual(len(many), len(few))
+
+
+class ImageVerdictReuseTests(TestCase):
+    """Photos seen before, by exact or perceptual hash, are not sent to Nyckel again"""
+
+    @classmethod
+    def setUpTestData(cls):
+        ImageVerdict.objects.create(sha256='a' * 64, phash='f0f0f0f0f0f0f0f0', label=HOUSE_NOT_PRESENT, confidence=0.99)
+
+    def test_known_hashes_reuse_the_stored_verdict(self):
+        fresh = [Verdict(3, label='House Present', confidence=0.9)]
+        with mock.patch('apps.listings.validation.classify_images', return_value=fresh) as classify:
+            verdicts = check_images([
+                (1, 'same-bytes.jpg', 'a' * 64, ''),
+                (2, 'recompressed.jpg', 'b' * 64, 'f0f0f0f0f0f0f0f0'),
+                (3, 'new.jpg', 'c' * 64, '0123456789abcdef'),
+            ])
+        self.assertEqual([image_id for image_id, _ in classify.call_args.args[0]], [3])
+        by_id = {verdict.image_id: verdict for verdict in verdicts}
+        self.assertTrue(by_id[1].cached and by_id[1].rejected)
+        self.assertTrue(by_id[2].cached and by_id[2].rejected)
+        self.assertFalse(by_id[3].cached or by_id[3].rejected)
+
+        # the new photo's verdict is stored for next time
+        with mock.patch('apps.listings.validation.classify_images', return_value=[]) as classify:
+            verdicts = check_images([(4, 'new-again.jpg', 'c' * 64, '')])
+        self.assertEqual(list(classify.call_args.args[0]), [])
+        self.assertEqual(verdicts, [Verdict(4, label='House Present', confidence=0.9, cached=True)])
+
+    def test_failed_checks_are_not_stored(self):
+        failed = [Verdict(1, error='timeout')]
+        with mock.patch('apps.listings.validation.classify_images', return_value=failed):
+            self.assertEqual(check_images([(1, 'new.jpg', 'd' * 64, '')]), failed)
+        self.assertFalse(ImageVerdict.objects.filter(sha256='d' * 64).exists())
+
+
+class ImageValidationTaskTests(TestCase):
+    """Nyckel verdicts reach the listing; passing photos still wait for a moderator"""
+
+    @classmethod
+    def setUpTestData(cls):
+        host = User.objects.create(email='host@example.com', username='host')
+        cls.listing = Listing.objects.create(
+            title='Listing', description='', price=Decimal('1000000'), host=host, location='Toshkent',
+        )
+
+    def validate(self, *verdicts):
+        with mock.patch('apps.listings.tasks.check_images', return_value=list(verdicts)):
+            validate_listing_images(self.listing.pk, [verdict.image_id for verdict in verdicts])
+        return Listing.objects.get(pk=self.listing.pk)
+
+    def test_passing_photos_are_marked_checked(self):
+        listing = self.validate(Verdict(1, label='House Present', confidence=0.97))
+        self.assertEqual(listing.state, 'CHECKING')
+        self.assertIsNotNone(listing.images_checked_at)
+
+    def test_a_clear_miss_rejects_the_listing(self):
+        listing = self.validate(
+            Verdict(1, label='House Present', confidence=0.97), Verdict(2, label=HOUSE_NOT_PRESENT, confidence=0.99),
+        )
+        self.assertEqual(listing.state, 'REJECTED')
+        self.assertIsNotNone(listing.images_checked_at)
+
+    def test_failed_check_stays_pending(self):
+        with self.assertRaises(RuntimeError):
+            self.validate(Verdict(1, label='House Present', confidence=0.97), Verdict(2, error='timeout'))
+        listing = Listing.objects.get(pk=self.listing.pk)
+        self.assertEqual(listing.state, 'CHECKING')
+        self.assertIsNone(listing.images_checked_at)
+
+    @override_settings(CLIENT_ID='client', CLIENT_SECRET='secret')
+    def test_new_photos_queue_a_check(self):
+        Listing.objects.filter(pk=self.listing.pk).update(images_checked_at=timezone.now())
+        with mock.patch('apps.listings.tasks.validate_listing_images.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                schedule_image_validation(self.listing.pk, 2)
+                schedule_image_validation(self.listing.pk, 1)
+        delay.assert_called_once_with(self.listing.pk, [1, 2])
+        self.assertIsNone(Listing.objects.get(pk=self.listing.pk).images_checked_at)
+
+
+class BulkAttachTests(ListingMediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.listing = Listing.objects.create(
+            title='Listing', description='', price=Decimal('1000000'), host=self.host, location='Toshkent',
+        )
+
+    def stored_files(self):
+        root = os.path.join(self.media_root, 'listing', 'images')
+        return sorted(
+            os.path.relpath(os.path.join(directory, name), self.media_root)
+            for directory, _, names in os.walk(root) if 'variants' not in directory
+            for name in names
+        )
+
+    def test_same_photo_is_written_once(self):
+        with atomic_with_files():
+            images = attach_images(self.listing, [photo(color='red'), photo(color='red'), photo(color='blue')])
+        self.assertEqual(len(images), 3)
+        self.assertEqual(ListingImage.objects.filter(listing=self.listing).count(), 3)
+        self.assertEqual(images[0].image.name, images[1].image.name)
+        self.assertEqual(self.stored_files(), sorted({image.image.name for image in images}))
+        self.assertEqual(len(self.stored_files()), 2)
+
+    def test_rollback_removes_the_written_files(self):
+        with atomic_with_files():
+            kept = attach_images(self.listing, [photo(color='red')])[0].image.name
+
+        with self.assertRaises(RuntimeError):
+            with atomic_with_files():
+                attach_images(self.listing, [photo(color='red'), photo(color='green')])
+                raise RuntimeError('the request failed after the attach')
+        self.assertEqual(ListingImage.objects.filter(listing=self.listing).count(), 1)
+        # the photo another row still references stays
+        self.assertEqual(self.stored_files(), [kept])
+
+    def test_failed_insert_removes_the_written_files(self):
+        with mock.patch.object(ListingImage.objects, 'bulk_create', side_effect=RuntimeError('insert failed')):
+            with self.assertRaises(RuntimeError):
+                attach_images(self.listing, [photo(color='red'), photo(color='green')])
+        self.assertEqual(self.stored_files(), [])
+
+    def test_failing_listing_create_keeps_no_files(self):
+        # a second listing is charged after the photos are attached
+        Card.objects.create(
+            user=self.host, card_number_last4='4242', card_holder_name='Host',
+            expiry_month=1, expiry_year=2030, balance=Decimal('1000000.00'),
+        )
+        drained = ledger.InsufficientFunds(Decimal('0'))
+        with mock.patch('apps.payment.ledger.charge', side_effect=drained) as charge:
+            response = self.create_listing(images_upload=[photo(color='red'), photo(color='blue')])
+        charge.assert_called_once()
+        self.assertFalse(response.json()['success'])
+        self.assertEqual(list(Listing.objects.values_list('pk', flat=True)), [self.listing.pk])
+        self.assertFalse(ListingImage.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+
+class ContentAddressTests(ListingMediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.listing = Listing.objects.create(
+            title='Listing', description='', price=Decimal('1000000'), host=self.host, location='Toshkent',
+        )
+
+    def path(self, name):
+        return os.path.join(self.media_root, name)
+
+    def age(self, name, days=2):
+        moment = time.time() - days * 86400
+        os.utime(self.path(name), (moment, moment))
+
+    def test_same_bytes_share_one_file(self):
+        first = ListingImage.objects.create(listing=self.listing, image=photo(color='red'))
+        self.age(first.image.name)
+        second = ListingImage.objects.create(listing=self.listing, image=photo('other.jpg', color='red'))
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertEqual(second.sha256, first.sha256)
+        self.assertIn(first.sha256, first.image.name)
+        self.assertEqual(len(os.listdir(os.path.dirname(self.path(first.image.name)))), 1)
+        # reusing the file restarts its orphan grace period
+        self.assertGreater(os.path.getmtime(self.path(first.image.name)), time.time() - 3600)
+
+    def test_files_are_only_reclaimed_by_the_collector(self):
+        shared, alone = (
+            ListingImage.objects.create(listing=self.listing, image=photo(color=color)) for color in ('red', 'red')
+        )
+        other = ListingImage.objects.create(listing=self.listing, image=photo(color='blue'))
+        name = shared.image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            shared.delete()
+            alone.delete()
+        # a concurrent upload may be taking the file, deleting rows never removes it
+        self.assertTrue(os.path.exists(self.path(name)))
+
+        self.age(name)
+        self.age(other.image.name)
+        call_command('collect_orphan_media', grace_hours=24, stdout=StringIO())
+        self.assertFalse(os.path.exists(self.path(name)))
+        self.assertTrue(os.path.exists(self.path(other.image.name)))
+
+    def test_collector_spares_a_file_reused_during_the_sweep(self):
+        image = ListingImage.objects.create(listing=self.listing, image=photo(color='red'))
+        name = image.image.name
+        ListingImage.objects.filter(pk=image.pk).delete()
+        self.age(name)
+
+        from apps.shared.management.commands import collect_orphan_media
+        still_referenced = collect_orphan_media.still_referenced
+
+        def reused(names):
+            # an upload of the same bytes takes the file between the walk and the removal
+            reuse_file(name)
+            return still_referenced(names)
+
+        with mock.patch.object(collect_orphan_media, 'still_referenced', side_effect=reused):
+            call_command('collect_orphan_media', grace_hours=24, stdout=StringIO())
+        self.assertTrue(os.path.exists(self.path(name)))
+
+    def test_rolled_back_write_spares_a_file_reused_meanwhile(self):
+        image = ListingImage.objects.create(listing=self.listing, image=photo(color='red'))
+        name = image.image.name
+        version = stored_version(name)
+        ListingImage.objects.filter(pk=image.pk).delete()
+
+        self.assertTrue(reuse_file(name))
+        discard_file(name, version)
+        self.assertTrue(os.path.exists(self.path(name)))
+        discard_file(name, stored_version(name))
+        self.assertFalse(os.path.exists(self.path(name)))
+        self.assertFalse(reuse_file(name))
+
+
+@override_settings(LISTING_IMAGE_VARIANT_FORMATS=['webp'], LISTING_IMAGE_VARIANT_WIDTHS=[640, 1280])
+class ImageVariantTests(ListingMediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.listing = Listing.objects.create(
+            title='Listing', description='', price=Decimal('1000000'), host=self.host, location='Toshkent',
+        )
+
+    def add_image(self, upload):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ListingImage.objects.create(listing=self.listing, image=upload)
+        image.refresh_from_db()
+        return image
+
+    def test_variants_of_a_new_photo(self):
+        image = self.add_image(photo(size=(1000, 750)))
+        # no upscaled 1280w from a 1000px original
+        self.assertEqual(sorted(image.variants), ['640w', 'thumb'])
+        with Image.open(os.path.join(self.media_root, image.variants['thumb']['webp'])) as thumb:
+            self.assertEqual((thumb.format, thumb.size), ('WEBP', (480, 360)))
+        with Image.open(os.path.join(self.media_root, image.variants['640w']['webp'])) as resized:
+            self.assertEqual(resized.size, (640, 480))
+
+        # the card shows the thumbnail, the detail view the original
+        card = self.client.get('/api/listings/my-listings/').json()['result'][0]
+        self.assertTrue(card['images'][0]['image'].endswith(image.variants['thumb']['webp']))
+        self.assertTrue(card['images'][0]['srcset']['640w']['webp'].endswith(image.variants['640w']['webp']))
+
+    def test_rows_sharing_a_file_share_its_variants(self):
+        first = self.add_image(photo(size=(1000, 750)))
+        with mock.patch('apps.listings.tasks.generate_variants') as generate:
+            second = self.add_image(photo(size=(1000, 750)))
+        generate.assert_not_called()
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertEqual(second.variants, first.variants)
+
+    def test_undecodable_original_is_not_retried(self):
+        with mock.patch('apps.listings.signals.queue_image_variants'):
+            image = self.add_image(photo())
+        with open(os.path.join(self.media_root, image.image.name), 'wb') as fh:
+            fh.write(b'not a photo any more')
+        with mock.patch.object(generate_image_variants, 'retry') as retry:
+            result = generate_image_variants.apply(args=(image.pk,))
+        self.assertTrue(result.successful())
+        retry.assert_not_called()
+        image.refresh_from_db()
+        self.assertEqual(image.variants, {})
+
+
+class InlineExecutor(Executor):
+    """Runs submitted calls in this process, in place of a worker pool"""
+
+    def __init__(self, max_workers=None, initializer=None):
+        pass
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+@override_settings(LISTING_IMAGE_MAX_EDGE=100)
+class NormalizeImagesCommandTests(ListingMediaTestCase):
+    def setUp(self):
+        super().setUp()
+        listings = [
+            Listing.objects.create(
+                title=f'Listing {i}', description='', price=Decimal('1000000'), host=self.host, location='Toshkent',
+            )
+            for i in range(2)
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            # stored before ingest normalization: too large, and shared by both listings
+            self.legacy = [ListingImage.objects.create(listing=listing, image=photo(size=(400, 300))) for listing in listings]
+            self.small = ListingImage.objects.create(listing=listings[0], image=photo('small.png', format='PNG'))
+        ImageVerdict.objects.create(sha256=self.legacy[0].sha256, label='House Present', confidence=0.9)
+
+    def normalize(self, *args):
+        out = StringIO()
+        with mock.patch('apps.listings.management.commands.normalize_listing_images.ProcessPoolExecutor', InlineExecutor):
+            with mock.patch('django.db.connections.close_all'):
+                with self.captureOnCommitCallbacks(execute=True):
+                    call_command('normalize_listing_images', *args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_changes_nothing(self):
+        original = self.legacy[0].image.name
+        out = self.normalize('--dry-run')
+        self.assertIn(original, out)
+        self.assertIn('found 1 files, 1 already normalized', out)
+        self.assertEqual(set(ListingImage.objects.values_list('image', flat=True)), {original, self.small.image.name})
+
+    def test_rows_move_to_the_normalized_file(self):
+        original = self.legacy[0].image.name
+        self.assertIn('normalized 1 files, 1 already normalized, 0 failed', self.normalize())
+
+        rows = ListingImage.objects.filter(pk__in=[image.pk for image in self.legacy])
+        target, sha256 = rows.values_list('image', 'sha256').distinct().get()
+        self.assertNotEqual(target, original)
+        with Image.open(os.path.join(self.media_root, target)) as image:
+            self.assertEqual(image.size, (100, 75))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, original)))
+        # the verdict follows the photo, the documents the cover file
+        self.assertEqual(ImageVerdict.objects.get(sha256=sha256).label, 'House Present')
+        self.assertEqual(
+            set(ListingSearchDocument.objects.values_list('cover_image', flat=True)), {target},
+        )
+
+        # a second run has nothing left to do
+        self.assertIn('normalized 0 files, 2 already normalized', self.normalize())
+
+
+class ShardImagesCommandTests(ListingMediaTestCase):
+    FLAT = ['listing/images/0f0f0f0f0f0f.png', 'listing/images/a1b2c3d4e5f6.jpg', 'listing/images/уй-фото.jpg']
+    VARIANT = 'listing/images/variants/a1b2c3d4e5f6-thumb.webp'
+
+    def setUp(self):
+        super().setUp()
+        self.listing = Listing.objects.create(
+            title='Listing', description='', price=Decimal('1000000'), host=self.host, location='Toshkent',
+        )
+        for name in self.FLAT + [self.VARIANT]:
+            self.write(name)
+        # stored before sharding; bulk_create skips the upload signals
+        ListingImage.objects.bulk_create(
+            ListingImage(listing=self.listing, image=name, variants={'thumb': {'webp': self.VARIANT}} if 'a1b2' in name else {})
+            for name in self.FLAT
+        )
+
+    def write(self, name):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as fh:
+            fh.write(name.encode())
+
+    def exists(self, name):
+        return os.path.exists(os.path.join(self.media_root, name))
+
+    def shard(self, *args):
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('shard_listing_images', *args, stdout=out)
+        return out.getvalue()
+
+    def assertSharded(self):
+        rows = list(ListingImage.objects.order_by('image').values_list('image', 'variants'))
+        self.assertEqual(len(rows), 3)
+        for name, variants in rows:
+            with self.subTest(name=name):
+                self.assertRegex(name, r'^listing/images/[0-9a-f]{2}/[0-9a-f]{2}/[^/]+$')
+                self.assertTrue(self.exists(name))
+        self.assertIn('listing/images/a1/b2/a1b2c3d4e5f6.jpg', [name for name, _ in rows])
+        # the variant moves into the shard of its original's stem
+        variant = next(variants for _, variants in rows if variants)['thumb']['webp']
+        self.assertEqual(variant, 'listing/images/variants/a1/b2/a1b2c3d4e5f6-thumb.webp')
+        self.assertTrue(self.exists(variant))
+        for name in self.FLAT + [self.VARIANT]:
+            self.assertFalse(self.exists(name), name)
+
+    def test_dry_run_moves_nothing(self):
+        out = self.shard('--dry-run')
+        self.assertIn('listing/images/a1b2c3d4e5f6.jpg -> listing/images/a1/b2/a1b2c3d4e5f6.jpg', out)
+        self.assertEqual(sorted(ListingImage.objects.values_list('image', flat=True)), self.FLAT)
+        self.assertTrue(all(self.exists(name) for name in self.FLAT))
+
+    def test_moves_files_rows_and_documents(self):
+        self.assertIn('moved 3 files, 0 missing', self.shard())
+        self.assertSharded()
+        cover = ListingImage.objects.order_by('id').values_list('image', flat=True).first()
+        self.assertEqual(ListingSearchDocument.objects.get(pk=self.listing.pk).cover_image, cover)
+        self.assertIn('moved 0 files, 0 missing', self.shard())
+
+    def test_interrupted_run_resumes(self):
+        update_rows = shard_listing_images.Command.update_rows
+        calls = []
+
+        def crash_on_second_batch(command, moved):
+            calls.append(moved)
+            if len(calls) == 2:
+                raise RuntimeError('killed')
+            update_rows(command, moved)
+
+        with mock.patch.object(shard_listing_images.Command, 'update_rows', crash_on_second_batch):
+            with self.assertRaises(RuntimeError):
+                self.shard('--batch-size', '1')
+        # the second file is already in its shard while its row still has the flat name
+        self.assertEqual(ListingImage.objects.exclude(image__in=self.FLAT).count(), 1)
+        self.assertFalse(self.exists(self.FLAT[1]))
+
+        self.assertIn('moved 2 files, 0 missing', self.shard('--batch-size', '1'))
+        self.assertSharded()
+
+
+class ResumableUploadTests(ListingMediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = photo(size=(320, 240), color='purple').read()
+        response = self.client.post('/api/listings/uploads/', {'filename': 'photo.jpg', 'size': len(self.data)})
+        self.upload_id = response.json()['result']['id']
+        self.url = f'/api/listings/uploads/{self.upload_id}/'
+
+    def send(self, offset, chunk, **headers):
+        return self.client.patch(
+            self.url, chunk, content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET=str(offset), **headers,
+        )
+
+    def finalize(self):
+        return self.client.post(f'{self.url}finalize/', {}, content_type='application/json')
+
+    def test_chunks_resume_at_the_server_offset(self):
+        half = len(self.data) // 2
+        response = self.send(0, self.data[:half])
+        self.assertEqual(response.json()['result']['offset'], half)
+        self.assertEqual(response['Upload-Offset'], str(half))
+
+        # a retried chunk of an offset that is already stored conflicts
+        response = self.send(0, self.data[:half])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Upload-Offset'], str(half))
+        response = self.send(half + 1, self.data[half + 1:])
+        self.assertEqual(response.status_code, 409)
+
+        self.assertFalse(self.finalize().json()['success'])
+        self.assertEqual(self.client.get(self.url)['Upload-Offset'], str(half))
+        self.send(half, self.data[half:])
+        response = self.finalize()
+        self.assertEqual(response.json()['result']['state'], 'COMPLETE')
+
+        # finalized uploads take no more chunks
+        self.assertFalse(self.send(len(self.data), b'x').json()['success'])
+
+    def test_chunk_headers(self):
+        self.assertEqual(self.send(0, self.data, CONTENT_LENGTH='').status_code, 411)
+        self.assertFalse(self.send(-1, self.data).json()['success'])
+        self.assertFalse(self.send(0, self.data + b'past the end').json()['success'])
+        self.assertEqual(UploadSession.objects.get(pk=self.upload_id).offset, 0)
+
+    def test_upload_is_attached_once(self):
+        self.send(0, self.data)
+        self.finalize()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.create_listing(upload_ids=[self.upload_id])
+        self.assertTrue(response.json()['success'], response.json())
+        self.assertEqual(ListingImage.objects.count(), 1)
+        self.assertFalse(UploadSession.objects.filter(pk=self.upload_id).exists())
+        self.assertFalse(os.path.exists(os.path.join(self.staging_root, f'{self.upload_id}.part')))
+
+        # a second listing is charged, so it has to get past the card check
+        Card.objects.create(
+            user=self.host, card_number_last4='4242', card_holder_name='Host',
+            expiry_month=1, expiry_year=2030, balance=Decimal('1000000.00'),
+        )
+        response = self.create_listing(upload_ids=[self.upload_id])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('upload_ids', response.json())
+
+    def test_cancelled_upload_takes_no_chunks(self):
+        session = UploadSession.objects.get(pk=self.upload_id)
+        self.assertEqual(self.client.delete(self.url).status_code, 200)
+        with self.assertRaises(resumable.UploadError) as raised:
+            resumable.write_chunk(session, 0, BytesIO(self.data), len(self.data))
+        self.assertNotIsInstance(raised.exception, resumable.UploadOffsetMismatch)
+
+    def test_purge_drops_expired_sessions_only(self):
+        fresh = self.client.post('/api/listings/uploads/', {'filename': 'other.jpg', 'size': 10}).json()['result']['id']
+        UploadSession.objects.filter(pk=self.upload_id).update(expires_at=timezone.now() - timedelta(minutes=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(resumable.purge_expired_sessions(), 1)
+        self.assertEqual([str(pk) for pk in UploadSession.objects.values_list('pk', flat=True)], [fresh])
+        self.assertFalse(os.path.exists(os.path.join(self.staging_root, f'{self.upload_id}.part')))
+        self.assertTrue(os.path.exists(os.path.join(self.staging_root, f'{fresh}.part')))
+
+    def test_claim_fails_when_a_concurrent_request_consumed_the_upload(self):
+        self.send(0, self.data)
+        self.finalize()
+        # validated by both requests, then attached by the other one
+        session = UploadSession.objects.get(pk=self.upload_id)
+        UploadSession.objects.filter(pk=session.pk).delete()
+        with self.assertRaises(resumable.UploadError):
+            resumable.claim_sessions([session])
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class FeedCacheTests(ListingMediaTestCase):
+    """Every change that shows on a listing card evicts the cached feed pages"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.client.defaults.pop('HTTP_AUTHORIZATION')
+        self.listing = Listing.objects.create(
+            title='Listing', description='', price=Decimal('1000000'), host=self.host, location='Toshkent',
+            region=self.region, state='ACCEPTED', is_active=True,
+        )
+        refresh_listing_documents([self.listing.pk])
+
+    def feed(self):
+        response = self.client.get('/api/listings/listings/?rooms=&utm_source=tests')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['result']['results']
+
+    def assertEvicted(self, change):
+        cached = self.feed()
+        # served from the cache: the version and the page, no queries
+        with self.assertNumQueries(0):
+            self.assertEqual(self.feed(), cached)
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        fresh = self.feed()
+        self.assertNotEqual(fresh, cached)
+        return fresh[0]
+
+    def test_listing_change_evicts_the_feed(self):
+        def rename():
+            self.listing.title = 'Renamed'
+            self.listing.save()
+        self.assertEqual(self.assertEvicted(rename)['title'], 'Renamed')
+
+    def test_image_change_evicts_the_feed(self):
+        card = self.assertEvicted(lambda: ListingImage.objects.create(listing=self.listing, image=photo()))
+        self.assertEqual(card['image_count'], 1)
+        self.assertEqual(len(card['images']), 1)
+
+    def test_for_whom_change_evicts_the_feed(self):
+        family = ForWhom.objects.create(name='FAMILY')
+        card = self.assertEvicted(lambda: self.listing.for_whom.add(family))
+        self.assertEqual(card['for_whom'], ['FAMILY'])
+
+    @override_settings(LISTINGS_FEED_CACHE=False)
+    def test_unchanged_feed_is_not_modified(self):
+        url = '/api/listings/listings/?region=&utm_source=tests'
+        etag = self.client.get(url)['ETag']
+        self.assertTrue(etag)
+        # the query is normalized, tracking parameters do not matter
+        response = self.client.get('/api/listings/listings/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.client.get('/api/listings/listings/?rooms=2', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.listing.title = 'Renamed'
+            self.listing.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_facets_follow_the_catalogue_version(self):
+        url = '/api/listings/facets/'
+        cached = self.client.get(url).json()['result']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.listing.rooms = 3
+            self.listing.save()
+        self.assertNotEqual(self.client.get(url).json()['result'], cached)
@@ -0,0 +1,154 @@
+"""
+Streaming upload handling for listing photos.
+
+`ListingImageUploadHandler` writes each uploaded part straight to a
+temporary file and, in the same pass over the chunks, computes its SHA-256,
+sniffs the real image type from the leading bytes and reads the pixel size
+from the image header. Nothing is held in memory beyond the header bytes,
+and later steps (the serializer's ImageField, content addressing, perceptual
+hashing) read from the temporary file:
+
+    upload.sha256        hex digest, reused by apps.listings.images.content_address
+    upload.content_type  sniffed type when recognised, else what the client sent
+    upload.dimensions    (width, height), or None when the header was not readable
+
+Requests are bounded by LISTING_UPLOAD_MAX_BYTES in total,
+LISTING_UPLOAD_MAX_FILES files and LISTING_UPLOAD_MAX_PIXELS per image.
+"""
+import hashlib
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http.multipartparser import MultiPartParserError
+from PIL import Image
+from rest_framework.exceptions import ParseError
+
+from apps.shared.enum import ResultCodes
+from apps.shared.utils import ErrorResponse
+
+# Image headers (JPEG APP segments with EXIF thumbnails included) fit in this
+PROBE_LIMIT = 256 * 1024
+
+
+def sniff_content_type(head):
+    """MIME type from the magic bytes of an image, None when not recognised"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[4:8] == b'ftyp':
+        brand = head[8:12]
+        if brand in (b'avif', b'avis'):
+            return 'image/avif'
+        if brand in (b'heic', b'heix', b'mif1', b'msf1'):
+            return 'image/heic'
+    return None
+
+
+class UploadLimitExceeded(MultiPartParserError):
+    """Raised while parsing; DRF turns it into a ParseError, see ListingUploadMixin"""
+
+    def __init__(self, message):
+        super().__init__(message['en'])
+        self.message = message
+
+
+def too_many_bytes():
+    limit = f'{settings.LISTING_UPLOAD_MAX_BYTES / (1024 * 1024):g}'
+    return UploadLimitExceeded({
+        "en": f"Uploaded photos may not exceed {limit} MB in total.",
+        "ru": f"Общий размер загружаемых фотографий не должен превышать {limit} МБ.",
+        "uz": f"Yuklanayotgan rasmlarning umumiy hajmi {limit} MB dan oshmasligi kerak.",
+    })
+
+
+def too_many_files():
+    limit = settings.LISTING_UPLOAD_MAX_FILES
+    return UploadLimitExceeded({
+        "en": f"At most {limit} photos can be uploaded at once.",
+        "ru": f"За один раз можно загрузить не более {limit} фотографий.",
+        "uz": f"Bir vaqtning o'zida ko'pi bilan {limit} ta rasm yuklash mumkin.",
+    })
+
+
+def too_many_pixels(name):
+    return UploadLimitExceeded({
+        "en": f"The photo {name} is too large.",
+        "ru": f"Фотография {name} слишком большая.",
+        "uz": f"{name} rasmi juda katta.",
+    })
+
+
+class ListingImageUploadHandler(TemporaryFileUploadHandler):
+    """Streams files to disk, hashing and probing them on the way"""
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # refuse oversized requests before reading the body
+        if content_length and content_length > settings.LISTING_UPLOAD_MAX_BYTES:
+            raise too_many_bytes()
+        self.files = 0
+        self.total_bytes = 0
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.files += 1
+        if self.files > settings.LISTING_UPLOAD_MAX_FILES:
+            raise too_many_files()
+        self.digest = hashlib.sha256()
+        self.head = b''
+        self.dimensions = None
+        self.probing = True
+
+    def receive_data_chunk(self, raw_data, start):
+        self.total_bytes += len(raw_data)
+        if self.total_bytes > settings.LISTING_UPLOAD_MAX_BYTES:
+            raise too_many_bytes()
+        self.digest.update(raw_data)
+        if self.probing:
+            self.probe(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def probe(self, raw_data):
+        """Read the image size once enough of the header has arrived"""
+        self.head += raw_data
+        try:
+            with Image.open(BytesIO(self.head)) as image:
+                self.dimensions = image.size
+        except Image.DecompressionBombError:
+            raise too_many_pixels(self.file_name)
+        except Exception:
+            # header incomplete, or not an image the ImageField will accept
+            if len(self.head) < PROBE_LIMIT:
+                return
+        self.probing = False
+        if self.dimensions and self.dimensions[0] * self.dimensions[1] > settings.LISTING_UPLOAD_MAX_PIXELS:
+            raise too_many_pixels(self.file_name)
+
+    def file_complete(self, file_size):
+        upload = super().file_complete(file_size)
+        upload.sha256 = self.digest.hexdigest()
+        upload.content_type = sniff_content_type(self.head) or upload.content_type
+        upload.dimensions = self.dimensions
+        self.head = b''
+        return upload
+
+
+class ListingUploadMixin:
+    """
+    Parse multipart bodies of the view with ListingImageUploadHandler and
+    answer requests over the upload limits with a VALIDATION_ERROR.
+    """
+
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers = [ListingImageUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, ParseError) and isinstance(exc.__context__, UploadLimitExceeded):
+            return ErrorResponse(result=ResultCodes.VALIDATION_ERROR, message=exc.__context__.message)
+        return super().handle_exception(exc)
@@ -9,11 +9,18 @@ from apps.listings.views import (
     MyListingsListView,
     ProductImageDeleteView,
     ListingStatusUpdateView,
+    ListingFacetsView,
+    UploadSessionCreateView,
+    UploadSessionView,
+    UploadSessionFinalizeView,
 )
 
 urlpatterns = [
     # List all listings
     path('listings/', ListingsListView.as_view(), name='listing_list'),
+
+    # Facet counts for the listings filters
+    path('facets/', ListingFacetsView.as_view(), name='listing_facets'),
     
     # Create a new listing
     path('create/', ListingCreateView.as_view(), name='listing_create'),
@@ -34,4 +41,9 @@ urlpatterns = [
     path('listings/<int:id>/delete/', ListingDestroyView.as_view(), name='listing_delete'),
 
     path('delete-image/<int:pk>/', ProductImageDeleteView.as_view(), name='listing_image_delete'),
+
+    # Resumable photo uploads
+    path('uploads/', UploadSessionCreateView.as_view(), name='listing_upload_create'),
+    path('uploads/<uuid:id>/', UploadSessionView.as_view(), name='listing_upload'),
+    path('uploads/<uuid:id>/finalize/', UploadSessionFinalizeView.as_view(), name='listing_upload_finalize'),
 ]
\ No newline at end of file
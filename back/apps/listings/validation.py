@@ -0,0 +1,219 @@
+"""
+Nyckel house-presence check of listing photos, run in the background.
+
+New images are collected per listing while the upload transaction runs and
+one `validate_listing_images` task is queued per listing on commit. The
+task classifies the images concurrently through a single authenticated
+Nyckel client per worker process; the listing stays CHECKING meanwhile and
+is rejected when a photo clearly shows no property. Passing photos leave it
+CHECKING for a moderator to accept; `Listing.images_checked_at` is cleared
+when a check is queued and set when it finishes.
+"""
+import base64
+import mimetypes
+import mmap
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+import requests
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from apps.listings.models import ImageVerdict, Listing
+from apps.shared.utils import get_logger
+
+logger = get_logger()
+
+NYCKEL_URL = 'https://www.nyckel.com'
+HOUSE_NOT_PRESENT = 'House Not Present'
+
+
+@dataclass(frozen=True)
+class Verdict:
+    image_id: int
+    label: Optional[str] = None
+    confidence: float = 0.0
+    error: Optional[str] = None
+    cached: bool = False
+
+    @property
+    def rejected(self):
+        return self.label == HOUSE_NOT_PRESENT and self.confidence >= settings.NYCKEL_REJECT_CONFIDENCE
+
+
+def nyckel_configured():
+    return bool(
+        settings.CLIENT_ID and settings.CLIENT_SECRET
+        and settings.CLIENT_ID != 'None' and settings.CLIENT_SECRET != 'None'
+    )
+
+
+class NyckelClient:
+    """
+    One OAuth token shared by every thread, renewed shortly before it
+    expires, and one pooled HTTP session per thread.
+    """
+    RENEW_MARGIN_SECONDS = 10 * 60
+
+    def __init__(self, client_id, client_secret, function_id, timeout=20):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.function_id = function_id
+        self.timeout = timeout
+        self._token = None
+        self._renew_at = 0
+        self._token_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def token(self):
+        with self._token_lock:
+            if self._token is None or time.time() > self._renew_at:
+                response = self._session().post(
+                    f'{NYCKEL_URL}/connect/token',
+                    data={
+                        'client_id': self.client_id,
+                        'client_secret': self.client_secret,
+                        'grant_type': 'client_credentials',
+                    },
+                    timeout=self.timeout,
+                )
+                response.raise_for_status()
+                payload = response.json()
+                self._token = payload['access_token']
+                self._renew_at = time.time() + payload['expires_in'] - self.RENEW_MARGIN_SECONDS
+            return self._token
+
+    def invoke(self, data):
+        response = self._session().post(
+            f'{NYCKEL_URL}/v1/functions/{self.function_id}/invoke',
+            json={'data': data},
+            headers={'Authorization': f'Bearer {self.token()}'},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Process-wide client, so the token is fetched once per worker rather than per image"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = NyckelClient(
+                    settings.CLIENT_ID,
+                    settings.CLIENT_SECRET,
+                    settings.NYCKEL_FUNCTION_ID,
+                    timeout=settings.NYCKEL_TIMEOUT,
+                )
+    return _client
+
+
+def image_data_uri(name):
+    content_type = mimetypes.guess_type(name)[0] or 'image/jpeg'
+    with default_storage.open(name, 'rb') as fh:
+        try:
+            # encode straight from the page cache when the file is on local disk
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                encoded = base64.b64encode(view).decode()
+        except (AttributeError, OSError, ValueError):
+            fh.seek(0)
+            encoded = base64.b64encode(fh.read()).decode()
+    return f'data:{content_type};base64,{encoded}'
+
+
+def classify(image_id, name):
+    try:
+        result = get_client().invoke(image_data_uri(name))
+    except Exception as e:
+        logger.error(f"Nyckel check of listing image {image_id} failed: {str(e)}")
+        return Verdict(image_id, error=str(e))
+    return Verdict(image_id, label=result.get('labelName'), confidence=result.get('confidence', 0))
+
+
+def classify_images(images):
+    """Verdicts for (image_id, storage name) pairs, checked concurrently"""
+    images = list(images)
+    if not images:
+        return []
+    workers = min(settings.NYCKEL_MAX_WORKERS, len(images))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda image: classify(*image), images))
+
+
+def check_images(images):
+    """
+    Verdicts for (image_id, storage name, sha256, phash) rows. Photos seen
+    before, by exact or perceptual hash, reuse the stored verdict; only the
+    rest go to Nyckel, and their verdicts are stored for next time.
+    """
+    images = list(images)
+    hashes = {sha256 for _, _, sha256, _ in images if sha256}
+    by_sha256 = {v.sha256: v for v in ImageVerdict.objects.filter(sha256__in=hashes)}
+    phashes = {phash for _, _, sha256, phash in images if phash and sha256 not in by_sha256}
+    by_phash = {v.phash: v for v in ImageVerdict.objects.filter(phash__in=phashes)} if phashes else {}
+
+    verdicts, unknown = [], []
+    for image_id, name, sha256, phash in images:
+        known = by_sha256.get(sha256) or by_phash.get(phash)
+        if known is not None:
+            verdicts.append(Verdict(image_id, label=known.label, confidence=known.confidence, cached=True))
+        else:
+            unknown.append((image_id, name, sha256, phash))
+
+    fresh = classify_images((image_id, name) for image_id, name, _, _ in unknown)
+    hashes_by_id = {image_id: (sha256, phash) for image_id, _, sha256, phash in unknown}
+    ImageVerdict.objects.bulk_create(
+        [
+            ImageVerdict(
+                sha256=hashes_by_id[v.image_id][0], phash=hashes_by_id[v.image_id][1],
+                label=v.label or '', confidence=v.confidence,
+            )
+            for v in fresh if v.error is None and hashes_by_id[v.image_id][0]
+        ],
+        ignore_conflicts=True,
+    )
+    return verdicts + fresh
+
+
+_pending = threading.local()
+
+
+def schedule_image_validation(listing_id, image_id):
+    """Collect new images and queue one validation task per listing on commit"""
+    if not nyckel_configured():
+        return
+    pending = getattr(_pending, 'images', None)
+    if pending is None:
+        pending = _pending.images = {}
+    pending.setdefault(listing_id, set()).add(image_id)
+    transaction.on_commit(_flush_pending_validations)
+
+
+def _flush_pending_validations():
+    from apps.listings.tasks import validate_listing_images  # tasks imports this module
+
+    pending = getattr(_pending, 'images', None)
+    _pending.images = None
+    if pending:
+        # a check is pending again until the task has seen the new photos
+        Listing.objects.filter(pk__in=list(pending)).update(images_checked_at=None)
+    for listing_id, image_ids in (pending or {}).items():
+        try:
+            validate_listing_images.delay(listing_id, sorted(image_ids))
+        except Exception as e:
+            logger.error(f"Could not queue image validation for listing {listing_id}: {str(e)}")
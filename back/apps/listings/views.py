@@ -1,30 +1,35 @@
-import requests
-import base64
-from io import BytesIO
 from apps.users.models import User
 from apps.shared.enum import ResultCodes
-from apps.shared.utils import SuccessResponse, ErrorResponse, detect_nsfw, get_logger
-
-from apps.listings.models import Listing, ListingImage
-from apps.listings.serializers import ListingSerializer, BaseListingSerializer, ListingDetailSerializer
-
-from apps.payment.models import Transaction
+from apps.shared.utils import SuccessResponse, ErrorResponse, get_logger
+
+from apps.listings.models import PUBLIC_DOCUMENTS, Listing, ListingImage, ListingSearchDocument, UploadSession
+from apps.listings.serializers import ListingSerializer, BaseListingSerializer, ListingDetailSerializer, ListingDocumentSerializer, UploadSessionSerializer
+from apps.listings import resumable
+from apps.listings.filters import ListingDocumentFilter
+from apps.listings.pagination import ListingCursorPagination
+from apps.listings.search import ListingSearchFilter
+from apps.listings.cache import FACET_CACHE_PARAMS, feed_cache_key, get_cached, set_cached
+from apps.listings.facets import compute_facets
+from apps.listings.uploads import ListingUploadMixin
+from apps.listings.attach import atomic_with_files
+from apps.listings.conditional import feed_etag, host_listings_validators, listing_validators
+from apps.shared.conditional import not_modified, set_validators
+
+from apps.payment import ledger
 
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.generics import CreateAPIView, RetrieveAPIView, UpdateAPIView, DestroyAPIView, ListAPIView, GenericAPIView
 
 from drf_spectacular.utils import extend_schema, OpenApiParameter
-from rest_framework.filters import SearchFilter
 from django_filters.rest_framework import DjangoFilterBackend
 from django.db import transaction as db_transaction
 from django.conf import settings
-import nyckel
 
 
 logger = get_logger()
 
-class ListingCreateView(CreateAPIView):
+class ListingCreateView(ListingUploadMixin, CreateAPIView):
     """Create a new listing with optional image uploads"""
     queryset = Listing.objects.all()
     serializer_class = ListingSerializer
@@ -85,114 +90,15 @@ class ListingCreateView(CreateAPIView):
         LISTING_CREATION_CHARGE = settings.LISTING_CREATION_CHARGE
         
         # If it's not the first listing, check for payment card and balance
+        # before the photos are processed; the charge itself is re-checked
         if not is_first_listing:
-            # Check if user has active cards
-            from apps.payment.models import Card
-            user_cards = Card.objects.filter(user=user, is_active=True).order_by('-balance')
-            
-            if not user_cards.exists():
-                return ErrorResponse(
-                    result=ResultCodes.VALIDATION_ERROR,
-                    message={
-                        "en": "Please add a payment card before creating a listing.",
-                        "ru": "Пожалуйста, добавьте платежную карту перед созданием объявления.",
-                        "uz": "Iltimos, e'lon yaratishdan oldin to'lov kartasini qo'shing."
-                    }
-                )
-            
-            # Try to find a card with sufficient balance
-            user_card = None
-            for card in user_cards:
-                if card.balance >= LISTING_CREATION_CHARGE:
-                    user_card = card
-                    break
-            
-            # If no card has sufficient balance
-            if not user_card:
-                total_balance = sum(card.balance for card in user_cards)
-                return ErrorResponse(
-                    result=ResultCodes.VALIDATION_ERROR,
-                    message={
-                        "en": f"Insufficient balance in all cards. You need {LISTING_CREATION_CHARGE} to create a listing. Total balance across all cards: {total_balance}",
-                        "ru": f"Недостаточно средств на всех картах. Для создания объявления требуется {LISTING_CREATION_CHARGE}. Общий баланс на всех картах: {total_balance}",
-                        "uz": f"Barcha kartalarda mablag' yetarli emas. E'lon yaratish uchun {LISTING_CREATION_CHARGE} kerak. Barcha kartalardagi umumiy balans: {total_balance}"
-                    }
-                )
-        else:
-            user_card = None
+            try:
+                ledger.ensure_funds(user, LISTING_CREATION_CHARGE)
+            except ledger.LedgerError as e:
+                return self.charge_error(e)
         
-        # Check for NSFW content in uploaded images BEFORE touching request.data
-        images_upload = request.FILES.getlist('images_upload')
-        if images_upload:
-            logger.info(f"Checking {len(images_upload)} images for content validation.")
-            
-            # Prepare validation tasks
-            # has_nyckel = settings.NYCKEL_TOKEN and settings.NYCKEL_TOKEN != 'None'
-            has_nyckel = settings.CLIENT_ID and settings.CLIENT_SECRET and settings.CLIENT_ID != 'None' and settings.CLIENT_SECRET != 'None'
-            logger.info(f"Nyckel validation is {'enabled' if has_nyckel else 'disabled'}.")
-            for image in images_upload:
-                # Read image bytes once
-                image.seek(0)
-                image_bytes = image.read()
-                image.seek(0)
-                
-                # Run NSFW check first (faster, local check)
-                # is_nsfw, nsfw_confidence = detect_nsfw(image)
-                # image.seek(0)
-                
-                # if is_nsfw:
-                #     return ErrorResponse(
-                #         result=ResultCodes.VALIDATION_ERROR,
-                #         message={
-                #             "en": f"Image contains inappropriate content (confidence: {nsfw_confidence:.2%}). Please upload appropriate property images.",
-                #             "ru": f"Изображение содержит неприемлемый контент (уверенность: {nsfw_confidence:.2%}). Пожалуйста, загрузите соответствующие изображения недвижимости.",
-                #             "uz": f"Rasm nomaqbul kontent o'z ichiga oladi (ishonch: {nsfw_confidence:.2%}). Iltimos, tegishli uy rasmlarini yuklang."
-                #         }
-                #     )
-                
-                logger.info(f"Running Nyckel content validation for an image.{image.name}")
-                # Only check Nyckel for house presence if configured
-                if has_nyckel:
-                    url = 'https://www.nyckel.com/v1/functions/house-presence-identifier/invoke'
-                    # headers = {'Authorization': 'Bearer ' + settings.NYCKEL_TOKEN}
-                    # logger.info(f"Sending image to Nyckel for validation.{headers}")
-                    # logger.info(settings.NYCKEL_TOKEN)
-                    credentials=nyckel.Credentials(client_id=settings.CLIENT_ID, client_secret=settings.CLIENT_SECRET)
-
-                    try:
-                        # result = requests.post(
-                        #     url, 
-                        #     headers=headers, 
-                        #     files={'data': (image.name, BytesIO(image_bytes), image.content_type)},
-                        #     timeout=20  # Add timeout to prevent hanging
-                        # )
-                        nyckel_response = nyckel.invoke("house-presence-identifier", "https://www.nyckel.com/assets/example.jpg", credentials)
-                        
-                        logger.info(f"Nyckel response: {nyckel_response}")
-                        label_name = nyckel_response.get('labelName', '')
-                        confidence = nyckel_response.get('confidence', 0)
-                        example_response = {
-                            "labelName": "Bird",
-                            "labelId": "label_2n5a7za51n329v0l",
-                            "confidence": 0.76
-                            }
-                        logger.info(f"Nyckel example response: {example_response}")
-                        logger.info(f"Nyckel example response: {nyckel_response}")
-                        # Reject if house is not present with high confidence
-                        if label_name == "House Not Present" and confidence >= 0.85:
-                            logger.error(f"Nyckel validation failed: House not present (confidence: {confidence:.2%})")
-                            return ErrorResponse(
-                                result=ResultCodes.VALIDATION_ERROR,
-                                message={
-                                    "en": f"Image does not contain a house/property (confidence: {confidence:.2%}). Please upload actual property images.",
-                                    "ru": f"Изображение не содержит дом/недвижимость (уверенность: {confidence:.2%}). Пожалуйста, загрузите фактические изображения недвижимости.",
-                                    "uz": f"Rasmda uy/ko'chmas mulk yo'q (ishonch: {confidence:.2%}). Iltimos, haqiqiy uy rasmlarini yuklang."
-                                }
-                            )
-                        logger.info(f"Nyckel validation passed for image.{image.name}")
-                    except Exception as e:
-                        logger.error(f"Nyckel API error: {str(e)}")
-                        # Continue without Nyckel validation if it fails
+        # Uploaded photos are checked by Nyckel in the background (see
+        # apps.listings.validation); the listing stays CHECKING until then.
 
         # Validate incoming data - serializer will handle for_whom array extraction
 
@@ -200,55 +106,103 @@ class ListingCreateView(CreateAPIView):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        with db_transaction.atomic():
-            listing = serializer.save(host=user)
-            
-            # Only charge if it's not the first listing
-            if not is_first_listing:
-                card_balance_before = float(user_card.balance)
-                user_card.balance = card_balance_before - LISTING_CREATION_CHARGE
-                user_card.save()
-                
-                # Create transaction record
-                Transaction.objects.create(
-                    user=user,
-                    card=user_card,
-                    listing=listing,
-                    amount=LISTING_CREATION_CHARGE,
-                    transaction_type='listing_charge',
-                    status='completed',
-                    description=f'Charge for creating listing: {listing.title}'
-                )
+        # photos stored for a listing that is not committed are removed again
+        try:
+            with atomic_with_files():
+                listing = serializer.save(host=user, state='CHECKING')
                 
-                logger.info(f"Charged {LISTING_CREATION_CHARGE} from user {user.email} for listing creation.")
-            else:
-                logger.info(f"First listing for user {user.email} - no charge applied.")
+                # Only charge if it's not the first listing
+                if not is_first_listing:
+                    ledger.charge(
+                        user, LISTING_CREATION_CHARGE, 'listing_charge', listing=listing,
+                        description=f'Charge for creating listing: {listing.title}',
+                    )
+                    logger.info(f"Charged {LISTING_CREATION_CHARGE} from user {user.email} for listing creation.")
+                else:
+                    logger.info(f"First listing for user {user.email} - no charge applied.")
+        except ledger.LedgerError as e:
+            # spent meanwhile by another charge, the listing is rolled back
+            return self.charge_error(e)
 
         return SuccessResponse(serializer.data)
 
+    def charge_error(self, error):
+        if isinstance(error, ledger.NoActiveCard):
+            return ErrorResponse(
+                result=ResultCodes.VALIDATION_ERROR,
+                message={
+                    "en": "Please add a payment card before creating a listing.",
+                    "ru": "Пожалуйста, добавьте платежную карту перед созданием объявления.",
+                    "uz": "Iltimos, e'lon yaratishdan oldin to'lov kartasini qo'shing."
+                }
+            )
+        LISTING_CREATION_CHARGE = settings.LISTING_CREATION_CHARGE
+        total_balance = error.balance
+        return ErrorResponse(
+            result=ResultCodes.VALIDATION_ERROR,
+            message={
+                "en": f"Insufficient balance in all cards. You need {LISTING_CREATION_CHARGE} to create a listing. Total balance across all cards: {total_balance}",
+                "ru": f"Недостаточно средств на всех картах. Для создания объявления требуется {LISTING_CREATION_CHARGE}. Общий баланс на всех картах: {total_balance}",
+                "uz": f"Barcha kartalarda mablag' yetarli emas. E'lon yaratish uchun {LISTING_CREATION_CHARGE} kerak. Barcha kartalardagi umumiy balans: {total_balance}"
+            }
+        )
+
 
 class ListingsListView(ListAPIView):
     """List all approved listings for homepage"""
-    queryset = Listing.objects.filter(is_active=True, state='ACCEPTED')
-    serializer_class = BaseListingSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter]
+    # Reads only the flat search documents, see apps.listings.documents
+    queryset = (
+        ListingSearchDocument.objects
+        .filter(PUBLIC_DOCUMENTS)
+        .defer('search_text', 'search_vector')
+    )
+    serializer_class = ListingDocumentSerializer
+    pagination_class = ListingCursorPagination
+    filter_backends = [DjangoFilterBackend, ListingSearchFilter]
+    filterset_class = ListingDocumentFilter
 
-    search_fields = ["title", "description", "location"]
+    def list(self, request, *args, **kwargs):
+        # Pages are cached per normalized filter set and catalogue version,
+        # any write to listings bumps the version (see apps.listings.signals)
+        cache_key = feed_cache_key(request)
+        etag = feed_etag(request)
+        response = not_modified(request, etag=etag)
+        if response is not None:
+            return response
+        result = get_cached(cache_key)
+        if result is None:
+            queryset = self.filter_queryset(self.get_queryset())
+            page = self.paginate_queryset(queryset)
+            serializer = self.get_serializer(page, many=True)
+            result = self.paginator.get_paginated_response(serializer.data)
+            set_cached(cache_key, result)
+        return set_validators(SuccessResponse(result), etag=etag)
+
+
+class ListingFacetsView(ListingsListView):
+    """Filter panel counts for the current feed filter state"""
+    pagination_class = None
 
-    filterset_fields = {
-        'price': ['gte', 'lte'],
-        'region': ['exact'],
-        'district': ['exact'],
-        'floor_of_this_apartment': ['exact'],
-        'rooms': ['exact'],
-        'for_whom__name': ['exact'],
-        'type': ['exact'],
-    }
+    @extend_schema(
+        summary="Listing facet counts",
+        tags=["listings"],
+        description="Counts per region, district, rooms, type, for_whom and price bucket. "
+                    "Accepts the same filter and search parameters as the listings feed.",
+    )
+    def get(self, request, *args, **kwargs):
+        return self.list(request, *args, **kwargs)
 
     def list(self, request, *args, **kwargs):
-        queryset = self.filter_queryset(self.get_queryset())
-        serializer = self.get_serializer(queryset, many=True)
-        return SuccessResponse(serializer.data)
+        cache_key = feed_cache_key(request, prefix='facets', params=FACET_CACHE_PARAMS)
+        etag = feed_etag(request, prefix='facets', params=FACET_CACHE_PARAMS)
+        response = not_modified(request, etag=etag)
+        if response is not None:
+            return response
+        result = get_cached(cache_key)
+        if result is None:
+            result = compute_facets(self.filter_queryset(self.get_queryset()))
+            set_cached(cache_key, result)
+        return set_validators(SuccessResponse(result), etag=etag)
 
 
 class ListingRetrieveView(RetrieveAPIView):
@@ -258,12 +212,16 @@ class ListingRetrieveView(RetrieveAPIView):
     lookup_field = 'id'
 
     def retrieve(self, request, *args, **kwargs):
+        etag, last_modified = listing_validators(kwargs[self.lookup_field])
+        response = not_modified(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            return response
         instance = self.get_object()
         serializer = self.get_serializer(instance)
-        return SuccessResponse(serializer.data)
+        return set_validators(SuccessResponse(serializer.data), etag=etag, last_modified=last_modified)
 
 
-class ListingUpdateView(UpdateAPIView):
+class ListingUpdateView(ListingUploadMixin, UpdateAPIView):
     """Update a listing"""
     queryset = Listing.objects.all()
     serializer_class = ListingSerializer
@@ -284,7 +242,8 @@ class ListingUpdateView(UpdateAPIView):
         data['host'] = user.id
         serializer = self.get_serializer(instance, data=data, partial=partial)
         serializer.is_valid(raise_exception=True)
-        self.perform_update(serializer)
+        with atomic_with_files():
+            self.perform_update(serializer)
         return SuccessResponse(serializer.data)
 
 
@@ -307,58 +266,43 @@ class ListingStatusUpdateView(UpdateAPIView):
             return ErrorResponse(result=ResultCodes.YOU_DO_NOT_HAVE_PERMISSION)
         if instance.is_active:
             instance.is_active = False
-        else:
-            instance.is_active = True
-            # Charge the user for activating the listing
+            instance.save()
+            return SuccessResponse({"is_active": instance.is_active})
+
+        # Charge the user for activating the listing
+        instance.is_active = True
+        try:
             with db_transaction.atomic():
-                from apps.payment.models import Card
-                user_cards = Card.objects.filter(user=user, is_active=True).order_by('-balance')
-                
-                if not user_cards.exists():
-                    return ErrorResponse(
-                        result=ResultCodes.VALIDATION_ERROR,
-                        message={
-                            "en": "Please add a payment card before activating the listing.",
-                            "ru": "Пожалуйста, добавьте платежную карту перед активацией объявления.",
-                            "uz": "Iltimos, e'lonni faollashtirishdan oldin to'lov kartasini qo'shing."
-                        }
-                    )
-                
-                # Try to find a card with sufficient balance
-                card = None
-                for c in user_cards:
-                    if c.balance >= settings.LISTING_ACTIVATION_CHARGE:
-                        card = c
-                        break
-                
-                # If no card has sufficient balance
-                if not card:
-                    total_balance = sum(c.balance for c in user_cards)
-                    return ErrorResponse(
-                        result=ResultCodes.VALIDATION_ERROR,
-                        message={
-                            "en": f"Insufficient balance in all cards. You need {settings.LISTING_ACTIVATION_CHARGE} to activate the listing. Total balance across all cards: {total_balance}",
-                            "ru": f"Недостаточно средств на всех картах. Для активации объявления требуется {settings.LISTING_ACTIVATION_CHARGE}. Общий баланс на всех картах: {total_balance}",
-                            "uz": f"Barcha kartalarda mablag' yetarli emas. E'lonni faollashtirish uchun {settings.LISTING_ACTIVATION_CHARGE} kerak. Barcha kartalardagi umumiy balans: {total_balance}"
-                        }
-                    )
-                # Deduct amount
-                card_balance_before = float(card.balance)
-                card.balance = card_balance_before - settings.LISTING_ACTIVATION_CHARGE
-                card.save()
-                Transaction.objects.create(
-                    user=user,
-                    listing=instance,
-                    card=card,
-                    amount=settings.LISTING_ACTIVATION_CHARGE,
-                    transaction_type='listing_activation_charge',
-                    status='completed',
-                    description=f'Charge for activating listing: {instance.title}'
+                ledger.charge(
+                    user, settings.LISTING_ACTIVATION_CHARGE, 'listing_activation_charge', listing=instance,
+                    description=f'Charge for activating listing: {instance.title}',
                 )
-                logger.info(f"Charged {settings.LISTING_ACTIVATION_CHARGE} from user {user.email} for listing activation.")
-        instance.save()
+                instance.save()
+        except ledger.LedgerError as e:
+            return self.charge_error(e)
+        logger.info(f"Charged {settings.LISTING_ACTIVATION_CHARGE} from user {user.email} for listing activation.")
         return SuccessResponse({"is_active": instance.is_active})
 
+    def charge_error(self, error):
+        if isinstance(error, ledger.NoActiveCard):
+            return ErrorResponse(
+                result=ResultCodes.VALIDATION_ERROR,
+                message={
+                    "en": "Please add a payment card before activating the listing.",
+                    "ru": "Пожалуйста, добавьте платежную карту перед активацией объявления.",
+                    "uz": "Iltimos, e'lonni faollashtirishdan oldin to'lov kartasini qo'shing."
+                }
+            )
+        total_balance = error.balance
+        return ErrorResponse(
+            result=ResultCodes.VALIDATION_ERROR,
+            message={
+                "en": f"Insufficient balance in all cards. You need {settings.LISTING_ACTIVATION_CHARGE} to activate the listing. Total balance across all cards: {total_balance}",
+                "ru": f"Недостаточно средств на всех картах. Для активации объявления требуется {settings.LISTING_ACTIVATION_CHARGE}. Общий баланс на всех картах: {total_balance}",
+                "uz": f"Barcha kartalarda mablag' yetarli emas. E'lonni faollashtirish uchun {settings.LISTING_ACTIVATION_CHARGE} kerak. Barcha kartalardagi umumiy balans: {total_balance}"
+            }
+        )
+
 class ListingDestroyView(DestroyAPIView):
     """Delete a listing"""
     queryset = Listing.objects.all()
@@ -387,9 +331,14 @@ class MyListingsListView(ListAPIView):
         return Listing.objects.filter(host=user)
 
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
-        return SuccessResponse(serializer.data)
+        etag, last_modified = host_listings_validators(request.user)
+        response = not_modified(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            queryset = self.get_queryset()
+            serializer = self.get_serializer(queryset, many=True)
+            response = set_validators(SuccessResponse(serializer.data), etag=etag, last_modified=last_modified)
+        response['Cache-Control'] = 'private, no-cache'
+        return response
     
 class ProductImageDeleteView(GenericAPIView):
     permissions_classes = [IsAuthenticated]
@@ -418,3 +367,132 @@ class ProductImageDeleteView(GenericAPIView):
         except Exception as e:
             logger.error(f"Error deleting product image: {str(e)}")
             return ErrorResponse(ResultCodes.INTERNAL_SERVER_ERROR)
+
+
+class UploadSessionCreateView(CreateAPIView):
+    """Start a resumable photo upload, see apps.listings.resumable"""
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        summary="Start a resumable photo upload",
+        tags=["listing-uploads"],
+        description="Declare the file name and size, then send the bytes with PATCH requests to the returned id.",
+    )
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if UploadSession.objects.filter(user=request.user, state='OPEN').count() >= settings.LISTING_UPLOAD_MAX_FILES:
+            return ErrorResponse(
+                result=ResultCodes.VALIDATION_ERROR,
+                message={
+                    "en": "Too many unfinished uploads, finish or cancel some first.",
+                    "ru": "Слишком много незавершённых загрузок, завершите или отмените часть из них.",
+                    "uz": "Tugallanmagan yuklashlar juda ko'p, avval ularning bir qismini yakunlang yoki bekor qiling.",
+                }
+            )
+        session = resumable.create_session(request.user, **serializer.validated_data)
+        return SuccessResponse(UploadSessionSerializer(session).data)
+
+
+class UploadSessionView(GenericAPIView):
+    """Offset of, chunks for and cancelling of a resumable upload"""
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+    lookup_field = 'id'
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(user=self.request.user)
+
+    def offset_response(self, session):
+        response = SuccessResponse(UploadSessionSerializer(session).data)
+        response['Upload-Offset'] = session.offset
+        response['Cache-Control'] = 'no-store'
+        return response
+
+    @extend_schema(summary="Resumable upload offset", tags=["listing-uploads"])
+    def get(self, request, *args, **kwargs):
+        return self.offset_response(self.get_object())
+
+    @extend_schema(
+        summary="Send a chunk of a resumable upload",
+        tags=["listing-uploads"],
+        request={'application/offset+octet-stream': {'type': 'string', 'format': 'binary'}},
+        parameters=[OpenApiParameter(name='Upload-Offset', type=int, location=OpenApiParameter.HEADER, required=True)],
+    )
+    def patch(self, request, *args, **kwargs):
+        session = self.get_object()
+        if not request.headers.get('Content-Length'):
+            # chunked bodies cannot be checked against the declared size up front
+            response = ErrorResponse(
+                result=ResultCodes.VALIDATION_ERROR,
+                message={
+                    "en": "The Content-Length header is required.",
+                    "ru": "Требуется заголовок Content-Length.",
+                    "uz": "Content-Length sarlavhasi talab qilinadi.",
+                }
+            )
+            response.status_code = 411
+            return response
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.headers['Content-Length'])
+            if offset < 0 or length < 0:
+                raise ValueError
+        except (KeyError, ValueError):
+            return ErrorResponse(
+                result=ResultCodes.VALIDATION_ERROR,
+                message={
+                    "en": "Upload-Offset and Content-Length headers are required.",
+                    "ru": "Требуются заголовки Upload-Offset и Content-Length.",
+                    "uz": "Upload-Offset va Content-Length sarlavhalari talab qilinadi.",
+                }
+            )
+        if length > settings.LISTING_UPLOAD_CHUNK_MAX_BYTES:
+            return ErrorResponse(
+                result=ResultCodes.VALIDATION_ERROR,
+                message={
+                    "en": f"Chunks may not exceed {settings.LISTING_UPLOAD_CHUNK_MAX_BYTES} bytes.",
+                    "ru": f"Размер фрагмента не должен превышать {settings.LISTING_UPLOAD_CHUNK_MAX_BYTES} байт.",
+                    "uz": f"Bo'lak hajmi {settings.LISTING_UPLOAD_CHUNK_MAX_BYTES} baytdan oshmasligi kerak.",
+                }
+            )
+        try:
+            # the raw body is read straight from the request stream, never parsed
+            resumable.write_chunk(session, offset, request._request, length)
+        except resumable.UploadOffsetMismatch as e:
+            response = ErrorResponse(result=ResultCodes.VALIDATION_ERROR, message=e.message)
+            response.status_code = 409
+            response['Upload-Offset'] = e.offset
+            return response
+        except resumable.UploadError as e:
+            return ErrorResponse(result=ResultCodes.VALIDATION_ERROR, message=e.message)
+        return self.offset_response(session)
+
+    @extend_schema(summary="Cancel a resumable upload", tags=["listing-uploads"])
+    def delete(self, request, *args, **kwargs):
+        resumable.discard_sessions([self.get_object()])
+        return SuccessResponse(result="Upload cancelled.")
+
+
+class UploadSessionFinalizeView(GenericAPIView):
+    """Check a fully received upload so listings can reference it by id"""
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+    lookup_field = 'id'
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(user=self.request.user)
+
+    @extend_schema(
+        summary="Finalize a resumable upload",
+        tags=["listing-uploads"],
+        request={'application/json': {'type': 'object', 'properties': {'sha256': {'type': 'string'}}}},
+    )
+    def post(self, request, *args, **kwargs):
+        session = self.get_object()
+        try:
+            resumable.finalize(session, sha256=str(request.data.get('sha256') or ''))
+        except resumable.UploadError as e:
+            return ErrorResponse(result=ResultCodes.VALIDATION_ERROR, message=e.message)
+        return SuccessResponse(UploadSessionSerializer(session).data)
@@ -1,6 +1,8 @@
+from django.conf import settings
 from django.contrib import admin
 
-from .models import Card, Transaction, ListingDailyCharge
+from . import ledger
+from .models import BalanceSnapshot, Card, Transaction, ListingDailyCharge, MonthlyTransactionSummary
 
 # Register your models here.
 
@@ -11,7 +13,21 @@ class CardAdmin(admin.ModelAdmin):
                     'created_at', 'updated_at')
     list_filter = ('is_active', 'expiry_year')
     search_fields = ('user__email', 'card_holder_name', 'card_number_last4')
-    # readonly_fields = ('created_at', 'updated_at')
+    # balances only move through apps.payment.ledger
+    readonly_fields = ('balance',)
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            return super().save_model(request, obj, form, change)
+        # a new card starts empty and gets its initial credit from the ledger,
+        # the admin view already runs in a transaction
+        obj.balance = 0
+        super().save_model(request, obj, form, change)
+        ledger.open_card(obj)
+        obj.balance = ledger.credit(
+            obj, settings.CARD_CREATED_INITIAL_BALANCE, 'initial_credit',
+            description='Initial credit on card addition',
+        ).balance
 
 @admin.register(Transaction)
 class TransactionAdmin(admin.ModelAdmin):
@@ -21,9 +37,42 @@ class TransactionAdmin(admin.ModelAdmin):
     search_fields = ('user__email', 'card__card_holder_name', 'listing__id')
     # readonly_fields = ('created_at', 'updated_at')
 
+    # the ledger is append-only, entries are only written by apps.payment.ledger
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(BalanceSnapshot)
+class BalanceSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('id', 'card', 'balance', 'transaction_id', 'created_at')
+    search_fields = ('card__user__email',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 @admin.register(ListingDailyCharge)
 class ListingDailyChargeAdmin(admin.ModelAdmin):
     list_display = ('id', 'listing', 'user', 'amount', 'charge_date', 'success')
     list_filter = ('success', 'charge_date')
     search_fields = ('user__email', 'listing__id')
-    # readonly_fields = ('created_at', 'updated_at')
\ No newline at end of file
+    # readonly_fields = ('created_at', 'updated_at')
+
+@admin.register(MonthlyTransactionSummary)
+class MonthlyTransactionSummaryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'month', 'transaction_type', 'count', 'total', 'updated_at')
+    list_filter = ('transaction_type', 'month')
+    search_fields = ('user__email',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
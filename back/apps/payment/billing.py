@@ -0,0 +1,185 @@
+"""
+Daily billing of active listings.
+
+Listings are billed per host, a chunk of hosts at a time. Every chunk is
+read with a handful of queries (the hosts' active listings, today's
+existing charges, the hosts' active cards), decided in memory and written
+back in one transaction (one conditional UPDATE of the cards through
+apps.payment.ledger, bulk inserts for the records), so the run costs a few
+queries per chunk instead of several per listing.
+
+Each listing is charged to its host's newest active card. A listing whose
+host has no active card, or not enough balance left on it, is deactivated
+and gets a failed ListingDailyCharge for the day. Listings that already
+have a charge for the day are skipped, so a run can be repeated safely.
+
+The nightly run splits the hosts into id ranges (`host_ranges`) billed as
+separate Celery tasks, see apps.payment.tasks.
+"""
+from dataclasses import asdict, dataclass
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from apps.listings.documents import schedule_document_refresh
+from apps.listings.models import Listing
+from apps.payment.ledger import debit_many, to_amount
+from apps.payment.models import Card, ListingDailyCharge, Transaction
+from apps.shared.utils import get_logger
+
+logger = get_logger()
+
+
+@dataclass
+class BillingResult:
+    listings: int = 0
+    charged: int = 0
+    failed: int = 0
+    deactivated: int = 0
+    skipped: int = 0
+    amount: Decimal = Decimal('0')
+    failed_batches: int = 0
+
+    def merge(self, other):
+        self.listings += other.listings
+        self.charged += other.charged
+        self.failed += other.failed
+        self.deactivated += other.deactivated
+        self.skipped += other.skipped
+        self.amount += other.amount
+        self.failed_batches += other.failed_batches
+
+    def as_dict(self):
+        """JSON-safe form, for Celery results"""
+        return {**asdict(self), 'amount': str(self.amount)}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{**data, 'amount': Decimal(data['amount'])})
+
+
+def billed_hosts(batch_size, after=0, last=None):
+    """Chunks of ids of hosts with active listings, in id order, up to `last` when given"""
+    while True:
+        queryset = Listing.objects.filter(is_active=True, host_id__gt=after)
+        if last is not None:
+            queryset = queryset.filter(host_id__lte=last)
+        host_ids = list(queryset.order_by('host_id').values_list('host_id', flat=True).distinct()[:batch_size])
+        if not host_ids:
+            return
+        yield host_ids
+        after = host_ids[-1]
+
+
+def host_ranges(shard_size):
+    """(first, last) host id ranges of `shard_size` hosts each, covering every host with active listings"""
+    return [(host_ids[0], host_ids[-1]) for host_ids in billed_hosts(shard_size)]
+
+
+def charge_range(today, amount, first=None, last=None, batch_size=500, dry_run=False, report=None):
+    """
+    Bill hosts with ids in [first, last] (all hosts by default) chunk by
+    chunk, returns the summed BillingResult. A failing chunk rolls back on
+    its own and is counted in `failed_batches`; rerunning the range bills it.
+    """
+    total = BillingResult()
+    after = first - 1 if first is not None else 0
+    for host_ids in billed_hosts(batch_size, after=after, last=last):
+        try:
+            total.merge(charge_hosts(host_ids, today, amount, dry_run=dry_run, report=report))
+        except Exception as e:
+            total.failed_batches += 1
+            logger.error(f'Error charging users {host_ids[0]}..{host_ids[-1]}: {str(e)}')
+    return total
+
+
+def charge_hosts(host_ids, today, amount, dry_run=False, report=None):
+    """
+    Charge the active listings of `host_ids` for `today`, returns a
+    BillingResult. `report(level, message)` is called for every listing,
+    level being 'charged', 'skipped' or 'failed'.
+    """
+    amount = to_amount(amount)
+    report = report or (lambda level, message: None)
+    result = BillingResult()
+    deactivated_ids = []
+
+    with transaction.atomic():
+        listings = list(
+            Listing.objects.filter(is_active=True, host_id__in=host_ids)
+            .order_by('host_id', 'id').values_list('id', 'title', 'host_id', 'host__email')
+        )
+        result.listings = len(listings)
+        already_charged = set(
+            ListingDailyCharge.objects.filter(charge_date=today, listing__host_id__in=host_ids)
+            .values_list('listing_id', flat=True)
+        )
+        # locked for the chunk, so the balances the charges are decided on stay exact
+        cards = {}
+        active_cards = (
+            Card.objects.select_for_update().filter(user_id__in=host_ids, is_active=True)
+            .order_by('user_id', '-created_at', '-id')
+        )
+        for card in active_cards:
+            cards.setdefault(card.user_id, card)
+
+        now = timezone.now()
+        transactions, charges, failed_charges = [], [], []
+        for listing_id, title, host_id, email in listings:
+            if listing_id in already_charged:
+                result.skipped += 1
+                report('skipped', f'Listing {listing_id} already charged today, skipping')
+                continue
+
+            card = cards.get(host_id)
+            if card is None or card.balance < amount:
+                if card is None:
+                    report('failed', f'User {email} has no active card. Deactivating listing {listing_id}')
+                else:
+                    result.failed += 1
+                    report('failed', (
+                        f'Insufficient balance for user {email} '
+                        f'(balance: {card.balance}, needed: {amount}). '
+                        f'Deactivating listing {listing_id}'
+                    ))
+                result.deactivated += 1
+                deactivated_ids.append(listing_id)
+                failed_charges.append(ListingDailyCharge(
+                    listing_id=listing_id, user_id=host_id, amount=amount, charge_date=today, success=False,
+                ))
+                continue
+
+            # in memory only, the ledger debits the card
+            card.balance -= amount
+            transactions.append(Transaction(
+                user_id=host_id,
+                card=card,
+                listing_id=listing_id,
+                amount=amount,
+                transaction_type='daily_charge',
+                status='completed',
+                description=f'Daily charge for listing: {title}',
+            ))
+            charges.append(ListingDailyCharge(
+                listing_id=listing_id, user_id=host_id, amount=amount, charge_date=today, success=True,
+            ))
+            result.charged += 1
+            result.amount += amount
+            report('charged', (
+                f'Charged {amount} from user {email} for listing {listing_id}. '
+                f'Remaining balance: {card.balance}'
+            ))
+
+        if dry_run:
+            transaction.set_rollback(True)
+            return result
+
+        transactions = debit_many(transactions)
+        for charge, transaction_obj in zip(charges, transactions):
+            charge.transaction = transaction_obj
+        ListingDailyCharge.objects.bulk_create(charges + failed_charges)
+        if deactivated_ids:
+            Listing.objects.filter(pk__in=deactivated_ids).update(is_active=False, updated_at=now)
+            schedule_document_refresh(*deactivated_ids)
+    return result
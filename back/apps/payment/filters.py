@@ -0,0 +1,27 @@
+from datetime import datetime, time, timedelta
+
+import django_filters
+from django.utils import timezone
+
+from apps.payment.models import Transaction
+
+
+class TransactionFilter(django_filters.FilterSet):
+    """Date range and type filters, both served by the (user, [transaction_type,] created_at) indexes"""
+    date_from = django_filters.DateFilter(method='filter_date_from')
+    date_to = django_filters.DateFilter(method='filter_date_to')
+    transaction_type = django_filters.MultipleChoiceFilter(choices=Transaction.TRANSACTION_TYPE_CHOICES)
+    status = django_filters.ChoiceFilter(choices=Transaction.TRANSACTION_STATUS_CHOICES)
+    card = django_filters.NumberFilter(field_name='card_id')
+    listing = django_filters.NumberFilter(field_name='listing_id')
+
+    class Meta:
+        model = Transaction
+        fields = []
+
+    # whole days as a range on created_at, `created_at__date` would not use the index
+    def filter_date_from(self, queryset, name, value):
+        return queryset.filter(created_at__gte=timezone.make_aware(datetime.combine(value, time.min)))
+
+    def filter_date_to(self, queryset, name, value):
+        return queryset.filter(created_at__lt=timezone.make_aware(datetime.combine(value + timedelta(days=1), time.min)))
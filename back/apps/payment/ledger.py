@@ -0,0 +1,339 @@
+"""
+Charging cards.
+
+Every debit of Card.balance goes through this module. A card is never
+read, changed in Python and saved back: the debit is a conditional UPDATE
+(`balance = balance - x ... WHERE balance >= x`), so concurrent charges
+cannot lose updates or overdraw a card, and they do not queue up behind
+row locks held across a read-modify-write.
+
+Transactions are the source of truth and are never changed once written.
+A card's ledger balance is its latest BalanceSnapshot plus the completed
+transactions after it (`with_ledger_balance`), so rebuilding a balance
+reads only the history since the last compaction. Card.balance is only a
+cache of that result, moved in the same transaction as every ledger entry
+so balance reads stay a column read; `reconcile_balances` checks the cache
+against the ledger and `compact_ledger` writes new snapshots.
+
+Every card has a snapshot from the start: new cards are opened empty
+(`open_card`). A card without one predates the ledger and has history the
+ledger never saw (the old initial balance was not a transaction), so
+`open_ledgers` adopts its balance as the opening snapshot first; the
+nightly compact_ledger run does that before compacting.
+
+`charge` picks the card and debits it in the same statement. On
+PostgreSQL the Transaction row is inserted by that statement as well, so a
+charge is a single round trip; other databases run the card selection,
+the debit and the insert as separate statements in one transaction. `debit_many` applies a batch
+of already decided charges (the daily billing) with one UPDATE. `credit`
+adds to a card, e.g. the initial credit of a new card.
+
+Amounts are Decimal, rounded to cents.
+"""
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection, transaction
+from django.db.models import Case, Count, DecimalField, Exists, F, Max, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from apps.payment.models import BalanceSnapshot, Card, Transaction
+
+CENT = Decimal('0.01')
+
+# transaction types that add to the balance, every other type is a debit
+CREDIT_TYPES = ('initial_credit', 'refund')
+
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+
+# a card picked by `charge` can be drained by a concurrent charge before the
+# debit, the next best card is tried this many times
+ATTEMPTS = 3
+
+
+class LedgerError(Exception):
+    pass
+
+
+class NoActiveCard(LedgerError):
+    pass
+
+
+class InsufficientFunds(LedgerError):
+    def __init__(self, balance):
+        # sums of decimals come back as floats on SQLite
+        self.balance = to_amount(balance) if balance is not None else None
+        super().__init__(f'Insufficient balance: {self.balance}')
+
+
+def to_amount(value):
+    """Decimal amount in cents, ValueError when `value` is not a number"""
+    try:
+        amount = Decimal(str(value)).quantize(CENT)
+    except InvalidOperation:
+        raise ValueError(f'Invalid amount: {value!r}')
+    if not amount.is_finite():
+        raise ValueError(f'Invalid amount: {value!r}')
+    return amount
+
+
+def _pk(obj):
+    if obj is None:
+        return None
+    return int(getattr(obj, 'pk', obj))
+
+
+def active_cards(user, card=None):
+    cards = Card.objects.filter(user=user, is_active=True)
+    if card is not None:
+        cards = cards.filter(pk=_pk(card))
+    return cards
+
+
+def ensure_funds(user, amount, card=None):
+    """Raise NoActiveCard / InsufficientFunds unless one active card covers `amount` right now"""
+    funds = active_cards(user, card).aggregate(cards=Count('id'), best=Max('balance'), total=Sum('balance'))
+    if not funds['cards']:
+        raise NoActiveCard()
+    if funds['best'] < to_amount(amount):
+        raise InsufficientFunds(funds['total'])
+
+
+def charge(user, amount, transaction_type, card=None, listing=None, description=''):
+    """
+    Debit `amount` from `card`, or from the user's active card with the
+    highest balance, and record a completed Transaction. Returns the
+    Transaction, with the card's new balance in `.balance`.
+    """
+    amount = to_amount(amount)
+    if amount <= 0:
+        raise ValueError('Amount must be positive')
+    card_id = _pk(card)
+    listing_id = _pk(listing)
+    record = _debit_and_record_postgresql if connection.vendor == 'postgresql' else _debit_and_record
+
+    for _ in range(ATTEMPTS):
+        now = timezone.now()
+        row = record(user.pk, card_id, listing_id, amount, transaction_type, description, now)
+        if row is not None:
+            transaction_id, debited_card_id, balance = row
+            transaction_obj = Transaction(
+                id=transaction_id, user=user, card_id=debited_card_id, listing_id=listing_id,
+                amount=amount, transaction_type=transaction_type, status='completed',
+                description=description, created_at=now, updated_at=now,
+            )
+            transaction_obj.balance = balance
+            return transaction_obj
+        # no card qualified, or the chosen one was drained meanwhile
+        ensure_funds(user, amount, card_id)
+    raise InsufficientFunds(active_cards(user, card_id).aggregate(total=Sum('balance'))['total'])
+
+
+DEBIT_AND_RECORD = """
+WITH debited AS (
+    UPDATE {card} SET balance = balance - %(amount)s, updated_at = %(now)s
+    WHERE id = (
+        SELECT id FROM {card}
+        WHERE user_id = %(user_id)s AND is_active AND balance >= %(amount)s {card_filter}
+        ORDER BY balance DESC, id
+        LIMIT 1
+    ) AND is_active AND balance >= %(amount)s
+    RETURNING id, balance
+), recorded AS (
+    INSERT INTO {transaction}
+        (user_id, card_id, listing_id, amount, transaction_type, status, description, created_at, updated_at)
+    SELECT %(user_id)s, id, %(listing_id)s::{listing_type}, %(amount)s, %(transaction_type)s, 'completed', %(description)s,
+           %(now)s, %(now)s
+    FROM debited
+    RETURNING id, card_id
+)
+SELECT recorded.id, recorded.card_id, debited.balance FROM recorded JOIN debited ON debited.id = recorded.card_id
+"""
+
+
+def _debit_and_record_postgresql(user_id, card_id, listing_id, amount, transaction_type, description, now):
+    sql = DEBIT_AND_RECORD.format(
+        card=connection.ops.quote_name(Card._meta.db_table),
+        transaction=connection.ops.quote_name(Transaction._meta.db_table),
+        card_filter='AND id = %(card_id)s' if card_id is not None else '',
+        # a bare NULL in the SELECT list would be typed text
+        listing_type=Transaction._meta.get_field('listing').db_type(connection),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {
+            'user_id': user_id, 'card_id': card_id, 'listing_id': listing_id, 'amount': amount,
+            'transaction_type': transaction_type, 'description': description, 'now': now,
+        })
+        return cursor.fetchone()
+
+
+def _debit_and_record(user_id, card_id, listing_id, amount, transaction_type, description, now):
+    cards = Card.objects.filter(user_id=user_id, is_active=True, balance__gte=amount)
+    if card_id is not None:
+        cards = cards.filter(pk=card_id)
+    with transaction.atomic():
+        picked = cards.order_by('-balance', 'id').values_list('id', flat=True).first()
+        if picked is None:
+            return None
+        debited = Card.objects.filter(pk=picked, is_active=True, balance__gte=amount).update(
+            balance=F('balance') - amount, updated_at=now,
+        )
+        if not debited:
+            return None
+        transaction_obj = Transaction.objects.create(
+            user_id=user_id, card_id=picked, listing_id=listing_id, amount=amount,
+            transaction_type=transaction_type, status='completed', description=description,
+        )
+        balance = Card.objects.filter(pk=picked).values_list('balance', flat=True).get()
+    return transaction_obj.pk, picked, balance
+
+
+def credit(card, amount, transaction_type='initial_credit', description=''):
+    """
+    Add `amount` to `card` and record a completed Transaction, in one
+    transaction. Returns the Transaction, with the card's new balance in
+    `.balance`.
+    """
+    amount = to_amount(amount)
+    if amount <= 0:
+        raise ValueError('Amount must be positive')
+    if transaction_type not in CREDIT_TYPES:
+        raise ValueError(f'Not a credit: {transaction_type}')
+    card_id = _pk(card)
+    with transaction.atomic():
+        credited = Card.objects.filter(pk=card_id).update(balance=F('balance') + amount, updated_at=timezone.now())
+        if not credited:
+            raise Card.DoesNotExist(f'Card {card_id} does not exist')
+        user_id, balance = Card.objects.filter(pk=card_id).values_list('user_id', 'balance').get()
+        transaction_obj = Transaction.objects.create(
+            user_id=user_id, card_id=card_id, amount=amount, transaction_type=transaction_type,
+            status='completed', description=description,
+        )
+    transaction_obj.balance = balance
+    return transaction_obj
+
+
+def open_card(card):
+    """Record the empty opening balance of a new card, before its first entry"""
+    return BalanceSnapshot.objects.create(card_id=_pk(card), balance=Decimal('0.00'), transaction_id=0)
+
+
+def open_ledgers(card_ids):
+    """
+    Adopt the current balance of the cards in `card_ids` that have no
+    snapshot yet as their opening snapshot, after their latest transaction.
+    Returns how many cards were opened.
+    """
+    with transaction.atomic():
+        # locked, so no charge lands between reading the balance and the last transaction
+        cards = list(
+            Card.objects.select_for_update()
+            .filter(pk__in=card_ids)
+            .exclude(Exists(BalanceSnapshot.objects.filter(card=OuterRef('pk'))))
+            .values_list('pk', 'balance')
+        )
+        if not cards:
+            return 0
+        latest = dict(
+            Transaction.objects.filter(card_id__in=[pk for pk, _ in cards]).order_by()
+            .values('card_id').annotate(last=Max('id')).values_list('card_id', 'last')
+        )
+        BalanceSnapshot.objects.bulk_create(
+            BalanceSnapshot(card_id=pk, balance=balance, transaction_id=latest.get(pk, 0))
+            for pk, balance in cards
+        )
+    return len(cards)
+
+
+def debit_many(transactions):
+    """
+    Apply unsaved Transactions (card and amount set) with one conditional
+    UPDATE of the cards, then insert them. Raises InsufficientFunds and
+    changes nothing when a card cannot cover its total.
+    """
+    totals = defaultdict(Decimal)
+    for transaction_obj in transactions:
+        totals[transaction_obj.card_id] += to_amount(transaction_obj.amount)
+    if not totals:
+        return []
+
+    with transaction.atomic():
+        debit = Case(
+            *(When(pk=card_id, then=Value(total)) for card_id, total in totals.items()),
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        )
+        covered = Q()
+        for card_id, total in totals.items():
+            covered |= Q(pk=card_id, balance__gte=total)
+        debited = Card.objects.filter(covered).update(balance=F('balance') - debit, updated_at=timezone.now())
+        if debited != len(totals):
+            # raising rolls the debits of the other cards back as well
+            raise InsufficientFunds(None)
+        return Transaction.objects.bulk_create(transactions)
+
+
+def signed_amount():
+    """Transaction amount as it moves the balance"""
+    return Case(
+        When(transaction_type__in=CREDIT_TYPES, then=F('amount')),
+        default=-F('amount'),
+        output_field=MONEY,
+    )
+
+
+def with_ledger_balance(cards, upto=None):
+    """
+    Annotate `cards` with `ledger_balance` (latest snapshot plus the
+    completed transactions after it), `snapshot_transaction` and `entries`
+    (how many transactions the snapshot does not cover yet). With `upto`,
+    only transactions with ids up to it count.
+    """
+    snapshots = BalanceSnapshot.objects.filter(card=OuterRef('pk')).order_by('-transaction_id')
+    if upto is not None:
+        snapshots = snapshots.filter(transaction_id__lte=upto)
+    cards = cards.annotate(
+        snapshot_balance=Subquery(snapshots.values('balance')[:1], output_field=MONEY),
+        snapshot_transaction=Coalesce(Subquery(snapshots.values('transaction_id')[:1]), 0),
+    )
+    tail = Transaction.objects.filter(card=OuterRef('pk'), status='completed', id__gt=OuterRef('snapshot_transaction'))
+    if upto is not None:
+        tail = tail.filter(id__lte=upto)
+    tail = tail.order_by().values('card')
+    return cards.annotate(
+        ledger_balance=(
+            Coalesce(F('snapshot_balance'), Value(Decimal('0')), output_field=MONEY)
+            + Coalesce(Subquery(tail.annotate(total=Sum(signed_amount())).values('total'), output_field=MONEY),
+                       Value(Decimal('0')), output_field=MONEY)
+        ),
+        entries=Coalesce(Subquery(tail.annotate(count=Count('id')).values('count')), 0),
+    )
+
+
+def ledger_balance(card):
+    """Balance of `card` rebuilt from the ledger"""
+    return to_amount(with_ledger_balance(Card.objects.filter(pk=_pk(card))).values_list('ledger_balance', flat=True).get())
+
+
+def take_snapshots(card_ids, upto):
+    """
+    Snapshot the ledger balance up to transaction `upto` of the cards in
+    `card_ids` that have transactions past their latest snapshot, and drop
+    the snapshots that superseded. Returns how many were written.
+    """
+    # cards opened after `upto` have no ledger balance at `upto`
+    opened_later = BalanceSnapshot.objects.filter(card=OuterRef('pk'), transaction_id__gt=upto)
+    cards = (
+        with_ledger_balance(Card.objects.filter(pk__in=card_ids).exclude(Exists(opened_later)), upto=upto)
+        .filter(entries__gt=0)
+    )
+    snapshots = [
+        BalanceSnapshot(card_id=card_id, balance=to_amount(balance), transaction_id=upto)
+        for card_id, balance in cards.values_list('pk', 'ledger_balance')
+    ]
+    with transaction.atomic():
+        BalanceSnapshot.objects.bulk_create(snapshots)
+        BalanceSnapshot.objects.filter(
+            card_id__in=[snapshot.card_id for snapshot in snapshots], transaction_id__lt=upto,
+        ).delete()
+    return len(snapshots)
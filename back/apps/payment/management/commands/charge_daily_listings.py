@@ -1,13 +1,10 @@
+from decimal import Decimal
+
 from django.utils import timezone
 from django.conf import settings
 from django.core.management.base import BaseCommand
-from django.db import transaction as db_transaction
-
-from apps.shared.utils import get_logger
-from apps.listings.models import Listing
-from apps.payment.models import Card, Transaction, ListingDailyCharge
 
-logger = get_logger()
+from apps.payment.billing import charge_range
 
 
 class Command(BaseCommand):
@@ -21,156 +18,51 @@ class Command(BaseCommand):
         )
         parser.add_argument(
             '--charge-amount',
-            type=float,
+            type=Decimal,
             default=None,
             help=f'Amount to charge per listing per day (default: from settings)',
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.DAILY_BILLING_BATCH_SIZE,
+            help=f'Users billed per transaction (default: {settings.DAILY_BILLING_BATCH_SIZE})',
+        )
 
     def handle(self, *args, **options):
         dry_run = options['dry_run']
         charge_amount = options['charge_amount'] or settings.DAILY_LISTING_CHARGE
         today = timezone.now().date()
+        # one line per listing only when asked for, the summary is always printed
+        verbose = options['verbosity'] >= 2
 
         self.stdout.write(self.style.NOTICE(f'Starting daily listing charges for {today}'))
         
         if dry_run:
             self.stdout.write(self.style.WARNING('DRY RUN MODE - No actual charges will be made'))
 
-        # Get all active listings
-        active_listings = Listing.objects.filter(is_active=True).select_related('host')
-        
-        total_listings = active_listings.count()
-        successful_charges = 0
-        failed_charges = 0
-        deactivated_listings = 0
-
-        self.stdout.write(f'Found {total_listings} active listings to charge')
-
-        for listing in active_listings:
-            user = listing.host
-            
-            # Check if already charged today
-            already_charged = ListingDailyCharge.objects.filter(
-                listing=listing,
-                charge_date=today
-            ).exists()
-            
-            if already_charged:
-                self.stdout.write(
-                    self.style.WARNING(f'Listing {listing.id} already charged today, skipping')
-                )
-                continue
-
-            # Get user's active card
-            user_card = Card.objects.filter(user=user, is_active=True).first()
-            
-            if not user_card:
-                self.stdout.write(
-                    self.style.ERROR(f'User {user.email} has no active card. Deactivating listing {listing.id}')
-                )
-                if not dry_run:
-                    listing.is_active = False
-                    listing.save()
-                    
-                    # Record failed charge
-                    ListingDailyCharge.objects.create(
-                        listing=listing,
-                        user=user,
-                        amount=charge_amount,
-                        charge_date=today,
-                        success=False
-                    )
-                    deactivated_listings += 1
-                continue
+        styles = {'charged': self.style.SUCCESS, 'skipped': self.style.WARNING, 'failed': self.style.ERROR}
 
-            # Check if sufficient balance
-            if user_card.balance < charge_amount:
-                self.stdout.write(
-                    self.style.ERROR(
-                        f'Insufficient balance for user {user.email} '
-                        f'(balance: {user_card.balance}, needed: {charge_amount}). '
-                        f'Deactivating listing {listing.id}'
-                    )
-                )
-                if not dry_run:
-                    listing.is_active = False
-                    listing.save()
-                    
-                    # Record failed charge
-                    ListingDailyCharge.objects.create(
-                        listing=listing,
-                        user=user,
-                        amount=charge_amount,
-                        charge_date=today,
-                        success=False
-                    )
-                    deactivated_listings += 1
-                    failed_charges += 1
-                continue
+        def report(level, message):
+            if verbose:
+                prefix = '[DRY RUN] ' if dry_run else ''
+                self.stdout.write(styles[level](prefix + message))
 
-            # Charge the card
-            try:
-                if not dry_run:
-                    with db_transaction.atomic():
-                        # Deduct from card balance
-                        balance_before = float(user_card.balance)
-                        charged = balance_before - charge_amount
-                        user_card.balance = charged
-
-                        user_card.save()
-                        
-                        # Create transaction record
-                        transaction_obj = Transaction.objects.create(
-                            user=user,
-                            card=user_card,
-                            listing=listing,
-                            amount=charge_amount,
-                            transaction_type='daily_charge',
-                            status='completed',
-                            description=f'Daily charge for listing: {listing.title}'
-                        )
-                        
-                        # Record daily charge
-                        ListingDailyCharge.objects.create(
-                            listing=listing,
-                            user=user,
-                            amount=charge_amount,
-                            charge_date=today,
-                            transaction=transaction_obj,
-                            success=True
-                        )
-                        
-                        successful_charges += 1
-                        self.stdout.write(
-                            self.style.SUCCESS(
-                                f'Charged {charge_amount} from user {user.email} '
-                                f'for listing {listing.id}. Remaining balance: {user_card.balance}'
-                            )
-                        )
-                else:
-                    self.stdout.write(
-                        self.style.SUCCESS(
-                            f'[DRY RUN] Would charge {charge_amount} from user {user.email} '
-                            f'for listing {listing.id}'
-                        )
-                    )
-                    successful_charges += 1
-                    
-            except Exception as e:
-                logger.error(f'Error charging user {user.email} for listing {listing.id}: {str(e)}')
-                self.stdout.write(
-                    self.style.ERROR(f'Error charging listing {listing.id}: {str(e)}')
-                )
-                failed_charges += 1
+        total = charge_range(
+            today, charge_amount, batch_size=options['batch_size'], dry_run=dry_run, report=report,
+        )
 
         # Summary
         self.stdout.write(self.style.NOTICE('\n' + '='*50))
         self.stdout.write(self.style.NOTICE('DAILY CHARGE SUMMARY'))
         self.stdout.write(self.style.NOTICE('='*50))
-        self.stdout.write(f'Total active listings: {total_listings}')
-        self.stdout.write(self.style.SUCCESS(f'Successful charges: {successful_charges}'))
-        self.stdout.write(self.style.ERROR(f'Failed charges: {failed_charges}'))
-        self.stdout.write(self.style.WARNING(f'Deactivated listings: {deactivated_listings}'))
+        self.stdout.write(f'Total active listings: {total.listings}')
+        self.stdout.write(self.style.SUCCESS(f'Successful charges: {total.charged} ({total.amount})'))
+        self.stdout.write(self.style.ERROR(f'Failed charges: {total.failed}'))
+        self.stdout.write(self.style.WARNING(f'Deactivated listings: {total.deactivated}'))
+        self.stdout.write(f'Already charged today: {total.skipped}')
+        if total.failed_batches:
+            self.stdout.write(self.style.ERROR(f'Failed batches: {total.failed_batches} (see the log)'))
         self.stdout.write(self.style.NOTICE('='*50))
         
         if dry_run:
@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from django.utils import timezone
+
+from apps.payment.ledger import open_ledgers, take_snapshots
+from apps.payment.models import Card, Transaction
+
+
+class Command(BaseCommand):
+    help = (
+        'Open the ledger of cards that predate it, then write a balance snapshot '
+        'for every card with transactions since its last snapshot'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Cards snapshotted per transaction (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        # transactions still committing may carry lower ids than committed ones,
+        # only the history older than the lag is folded in
+        cutoff = timezone.now() - settings.LEDGER_SNAPSHOT_LAG
+        upto = Transaction.objects.filter(created_at__lte=cutoff).aggregate(last=Max('id'))['last']
+
+        opened = written = 0
+        card_ids = Card.objects.order_by('pk').values_list('pk', flat=True)
+        after = 0
+        while True:
+            chunk = list(card_ids.filter(pk__gt=after)[:batch_size])
+            if not chunk:
+                break
+            after = chunk[-1]
+            opened += open_ledgers(chunk)
+            if upto is not None:
+                written += take_snapshots(chunk, upto)
+
+        if opened:
+            self.stdout.write(f'Opened the ledger of {opened} cards at their current balance')
+        if upto is None:
+            self.stdout.write('No transactions to compact')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully wrote {written} snapshots up to transaction {upto}'
+        ))
@@ -0,0 +1,92 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Exists, F, Max, OuterRef
+
+from apps.payment.ledger import to_amount, with_ledger_balance
+from apps.payment.models import BalanceSnapshot, Card, Transaction
+
+
+class Command(BaseCommand):
+    help = 'Compare every card balance with its ledger (latest snapshot plus later transactions) and report drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Cards checked per query (default: 1000)',
+        )
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Correct drifted Card.balance values to the ledger balance',
+        )
+        parser.add_argument(
+            '--adopt',
+            action='store_true',
+            help='Trust drifted Card.balance values instead, recording them as snapshots',
+        )
+
+    def handle(self, *args, **options):
+        if options['fix'] and options['adopt']:
+            raise CommandError('--fix and --adopt are mutually exclusive')
+        batch_size = options['batch_size']
+
+        checked = drifted = unopened = 0
+        after = 0
+        while True:
+            with transaction.atomic():
+                cards = Card.objects.filter(pk__gt=after).order_by('pk')
+                if options['adopt']:
+                    # the balance must not move between reading and recording it
+                    cards = cards.select_for_update()
+                rows = list(
+                    with_ledger_balance(cards[:batch_size])
+                    .annotate(opened=Exists(BalanceSnapshot.objects.filter(card=OuterRef('pk'))))
+                    .values_list('pk', 'balance', 'ledger_balance', 'opened')
+                )
+                if not rows:
+                    break
+                after = rows[-1][0]
+                checked += len(rows)
+
+                # cards that predate the ledger have no history to compare with until
+                # compact_ledger opens them
+                unopened += sum(1 for *_, opened in rows if not opened)
+                # SQLite returns the computed sums as floats
+                rows = [(pk, balance, to_amount(ledger)) for pk, balance, ledger, opened in rows if opened]
+                drift = [(pk, balance, ledger) for pk, balance, ledger in rows if balance != ledger]
+                drifted += len(drift)
+                for pk, balance, ledger in drift:
+                    self.stdout.write(self.style.WARNING(
+                        f'Card {pk}: balance {balance}, ledger {ledger} (drift {balance - ledger})'
+                    ))
+                if drift and options['fix']:
+                    self.fix(drift)
+                elif drift and options['adopt']:
+                    self.adopt(drift)
+            if checked % (batch_size * 10) == 0:
+                self.stdout.write(f'Checked {checked} cards, {drifted} drifted')
+
+        action = ', fixed' if options['fix'] else ', adopted' if options['adopt'] else ''
+        style = self.style.SUCCESS if not drifted else self.style.WARNING
+        self.stdout.write(style(f'Checked {checked} cards, {drifted} drifted{action}'))
+        if unopened:
+            self.stdout.write(self.style.WARNING(
+                f'{unopened} cards predate the ledger and were skipped, compact_ledger opens them'
+            ))
+
+    def fix(self, drift):
+        for pk, balance, ledger in drift:
+            # relative, so a charge landing meanwhile is kept
+            Card.objects.filter(pk=pk).update(balance=F('balance') + (ledger - balance))
+
+    def adopt(self, drift):
+        latest = dict(
+            Transaction.objects.filter(card_id__in=[pk for pk, _, _ in drift])
+            .values('card_id').annotate(last=Max('id')).values_list('card_id', 'last')
+        )
+        BalanceSnapshot.objects.bulk_create(
+            BalanceSnapshot(card_id=pk, balance=balance, transaction_id=latest.get(pk, 0))
+            for pk, balance, _ in drift
+        )
@@ -1,35 +1,50 @@
 import os
-import uuid
+
+from django.core.files.storage import default_storage
 from django.core.management.base import BaseCommand
-from apps.listings.models import ListingImage
+from django.db import transaction
+
+from apps.listings.conditional import touch_listings
+from apps.listings.documents import schedule_document_refresh
+from apps.listings.models import ListingImage, listing_image_path
 
 class Command(BaseCommand):
     help = 'Rename listing images with Cyrillic characters to ASCII-safe names'
 
     def handle(self, *args, **options):
-        images = ListingImage.objects.all()
+        names = (
+            ListingImage.objects
+            .exclude(image='')
+            .order_by('image')
+            .values_list('image', flat=True)
+            .distinct()
+        )
         renamed_count = 0
-        
-        for img in images:
-            old_path = img.image.path
-            old_name = os.path.basename(old_path)
-            
+
+        for old_name in names.iterator():
             # Check if filename contains non-ASCII characters
-            if not old_name.isascii():
-                # Generate new safe filename
-                ext = old_name.split('.')[-1].lower()
-                new_name = f"{uuid.uuid4().hex[:12]}.{ext}"
-                new_path = os.path.join(os.path.dirname(old_path), new_name)
-                
-                # Rename file on disk
-                if os.path.exists(old_path):
-                    os.rename(old_path, new_path)
-                    
-                    # Update database
-                    img.image.name = f"listing/images/{new_name}"
-                    img.save()
-                    
-                    renamed_count += 1
-                    self.stdout.write(f"Renamed: {old_name} -> {new_name}")
-        
+            if os.path.basename(old_name).isascii():
+                continue
+            if not default_storage.exists(old_name):
+                self.stdout.write(self.style.WARNING(f"Missing file: {old_name}"))
+                continue
+
+            # Generate new safe, sharded filename
+            new_name = default_storage.generate_filename(listing_image_path(ListingImage(), os.path.basename(old_name)))
+            with default_storage.open(old_name, 'rb') as fh:
+                new_name = default_storage.save(new_name, fh)
+
+            # Update database, every row sharing the file
+            with transaction.atomic():
+                rows = ListingImage.objects.filter(image=old_name)
+                listing_ids = list(rows.values_list('listing_id', flat=True).distinct())
+                rows.update(image=new_name)
+                # search documents and cached pages keep the cover file name
+                touch_listings(*listing_ids)
+                schedule_document_refresh(*listing_ids)
+                transaction.on_commit(lambda old_name=old_name: default_storage.delete(old_name))
+
+            renamed_count += 1
+            self.stdout.write(f"Renamed: {old_name} -> {new_name}")
+
         self.stdout.write(self.style.SUCCESS(f'Successfully renamed {renamed_count} images'))
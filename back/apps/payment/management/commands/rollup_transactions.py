@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Min
+from django.utils import timezone
+
+from apps.payment.models import Transaction
+from apps.payment.rollup import add_months, month_start, rollup_month
+
+
+class Command(BaseCommand):
+    help = 'Roll completed transactions up into monthly per-user summaries'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months',
+            type=int,
+            default=1,
+            help='Closed months to (re)build, counting back from the previous one (default: 1)',
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Rebuild every closed month since the first transaction',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Summary rows written per INSERT (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        current = month_start(timezone.localdate())
+        if options['all']:
+            first = Transaction.objects.aggregate(first=Min('created_at'))['first']
+            if first is None:
+                self.stdout.write('No transactions to roll up')
+                return
+            month = month_start(timezone.localtime(first).date())
+        else:
+            month = add_months(current, -options['months'])
+
+        written = 0
+        while month < current:
+            rows = rollup_month(month, batch_size=options['batch_size'])
+            self.stdout.write(f'{month:%Y-%m}: {rows} summaries')
+            written += rows
+            month = add_months(month, 1)
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully wrote {written} monthly summaries'))
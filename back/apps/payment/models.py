@@ -9,7 +9,7 @@ class Card(models.Model):
     card_holder_name = models.CharField(max_length=255)
     expiry_month = models.IntegerField()
     expiry_year = models.IntegerField()
-    balance = models.DecimalField(max_digits=10, decimal_places=2, default=500.00, help_text="Card balance in system")
+    balance = models.DecimalField(max_digits=10, decimal_places=2, default=0, help_text="Card balance in system, moved by apps.payment.ledger only")
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -21,6 +21,16 @@ class Card(models.Model):
         return f"{self.card_holder_name} - **** {self.card_number_last4}"
 
 
+class TransactionQuerySet(models.QuerySet):
+    """Bulk changes are refused like changes of single transactions"""
+
+    def update(self, **kwargs):
+        raise ValueError("Transactions cannot be changed once recorded")
+
+    def delete(self):
+        raise ValueError("Transactions cannot be deleted")
+
+
 class Transaction(models.Model):
     TRANSACTION_TYPE_CHOICES = [
         ('initial_credit', 'Initial Credit'),
@@ -37,8 +47,13 @@ class Transaction(models.Model):
     ]
     
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='transactions')
-    card = models.ForeignKey(Card, on_delete=models.SET_NULL, null=True, blank=True, related_name='transactions')
-    listing = models.ForeignKey(Listing, on_delete=models.SET_NULL, null=True, blank=True, related_name='transactions')
+    # deleting a card or a listing leaves its history as it was, ids included
+    card = models.ForeignKey(
+        Card, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='transactions',
+    )
+    listing = models.ForeignKey(
+        Listing, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='transactions',
+    )
     
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     transaction_type = models.CharField(max_length=50, choices=TRANSACTION_TYPE_CHOICES)
@@ -48,12 +63,51 @@ class Transaction(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = TransactionQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # the history of one user, newest first (keyset pagination, date ranges)
+            models.Index(fields=['user', '-created_at', '-id'], name='transaction_user_created_idx'),
+            models.Index(fields=['user', 'transaction_type', '-created_at', '-id'], name='transaction_user_type_idx'),
+            # month rollups
+            models.Index(fields=['created_at'], name='transaction_created_idx'),
+        ]
         
     def __str__(self):
         return f"{self.user.email} - {self.transaction_type} - {self.amount}"
 
+    def save(self, *args, **kwargs):
+        # the ledger is append-only, corrections are new transactions
+        if not self._state.adding:
+            raise ValueError("Transactions cannot be changed once recorded")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Transactions cannot be deleted")
+
+
+class BalanceSnapshot(models.Model):
+    """
+    Balance of a card including every completed transaction up to
+    `transaction_id`, written by the compact_ledger command. The ledger
+    balance is the latest snapshot plus the transactions after it.
+    """
+    card = models.ForeignKey(Card, on_delete=models.CASCADE, related_name='snapshots')
+    balance = models.DecimalField(max_digits=12, decimal_places=2)
+    transaction_id = models.IntegerField(help_text="Last transaction included in the balance")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-transaction_id']
+        indexes = [
+            models.Index(fields=['card', '-transaction_id'], name='snapshot_card_latest_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.card_id} - {self.balance} @ {self.transaction_id}"
+
 
 class ListingDailyCharge(models.Model):
     listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='daily_charges')
@@ -70,4 +124,39 @@ class ListingDailyCharge(models.Model):
         unique_together = ['listing', 'charge_date']
         
     def __str__(self):
-        return f"{self.listing.title} - {self.charge_date} - {self.amount}"
\ No newline at end of file
+        return f"{self.listing.title} - {self.charge_date} - {self.amount}"
+
+class MonthlyTransactionSummary(models.Model):
+    """
+    Completed transactions of one user per month and type, rolled up by the
+    rollup_transactions command once the month is over.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='transaction_summaries')
+    month = models.DateField(help_text="First day of the month")
+    transaction_type = models.CharField(max_length=50, choices=Transaction.TRANSACTION_TYPE_CHOICES)
+    count = models.PositiveIntegerField(default=0)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-month', 'transaction_type']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'month', 'transaction_type'], name='transaction_summary_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.month:%Y-%m} - {self.transaction_type}: {self.total}"
+
+
+class BillingLock(models.Model):
+    """
+    Lease of a billing run, held from the start of the nightly run until
+    its chord callback (see apps.payment.tasks). Taken and released with
+    conditional UPDATEs, so it works across workers with any cache backend.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    token = models.CharField(max_length=32, blank=True, default='')
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} until {self.expires_at}"
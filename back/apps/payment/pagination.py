@@ -0,0 +1,12 @@
+from apps.shared.pagination import KeysetPagination
+
+
+class TransactionCursorPagination(KeysetPagination):
+    """Keyset pagination over a user's transaction history, newest first"""
+    page_size = 20
+    max_page_size = 100
+    orderings = {
+        'newest': ('-created_at', '-id'),
+        'oldest': ('created_at', 'id'),
+    }
+    default_ordering = 'newest'
@@ -0,0 +1,103 @@
+"""
+Monthly transaction summaries.
+
+Closed months are read from MonthlyTransactionSummary, rolled up from the
+transactions by the nightly rollup_transactions command. Only the current
+and the previous month (which may not be rolled up yet early in a month)
+are aggregated live, over the (user, created_at) index. Transactions are
+append-only, so a rolled up month never goes stale.
+"""
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from apps.payment.ledger import CREDIT_TYPES, to_amount
+from apps.payment.models import MonthlyTransactionSummary, Transaction
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_bounds(month):
+    """[start, end) of `month` as aware datetimes"""
+    start = timezone.make_aware(datetime.combine(month, datetime.min.time()))
+    end = timezone.make_aware(datetime.combine(add_months(month, 1), datetime.min.time()))
+    return start, end
+
+
+def completed_in(start, end):
+    return Transaction.objects.filter(status='completed', created_at__gte=start, created_at__lt=end)
+
+
+def rollup_month(month, batch_size=1000):
+    """(Re)build the summaries of `month` for every user, returns how many rows were written"""
+    start, end = month_bounds(month)
+    totals = (
+        completed_in(start, end).order_by()
+        .values('user_id', 'transaction_type')
+        .annotate(count=Count('id'), total=Sum('amount'))
+    )
+    rows = [
+        MonthlyTransactionSummary(
+            user_id=row['user_id'], month=month, transaction_type=row['transaction_type'],
+            count=row['count'], total=to_amount(row['total']),
+        )
+        for row in totals.iterator(chunk_size=batch_size)
+    ]
+    with transaction.atomic():
+        MonthlyTransactionSummary.objects.bulk_create(
+            rows,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['user', 'month', 'transaction_type'],
+            update_fields=['count', 'total', 'updated_at'],
+        )
+    return len(rows)
+
+
+def monthly_summary(user, months=12):
+    """
+    The last `months` months of `user`, newest first: count, credits,
+    debits and a per-type breakdown for each month with transactions.
+    """
+    current = month_start(timezone.localdate())
+    first = add_months(current, 1 - months)
+    live_from = max(add_months(current, -1), first)
+    by_month = {}
+
+    def add(month, transaction_type, count, total):
+        summary = by_month.setdefault(month, {
+            'month': f'{month:%Y-%m}', 'count': 0, 'credits': Decimal('0.00'), 'debits': Decimal('0.00'), 'types': {},
+        })
+        total = to_amount(total)
+        summary['count'] += count
+        summary['credits' if transaction_type in CREDIT_TYPES else 'debits'] += total
+        summary['types'][transaction_type] = {'count': count, 'total': str(total)}
+
+    rolled_up = MonthlyTransactionSummary.objects.filter(user=user, month__gte=first, month__lt=live_from)
+    for month, transaction_type, count, total in rolled_up.values_list('month', 'transaction_type', 'count', 'total'):
+        add(month, transaction_type, count, total)
+
+    start, end = month_bounds(live_from)[0], month_bounds(current)[1]
+    live = (
+        completed_in(start, end).filter(user=user).order_by()
+        .annotate(month=TruncMonth('created_at'))
+        .values('month', 'transaction_type').annotate(count=Count('id'), total=Sum('amount'))
+    )
+    for row in live:
+        add(timezone.localtime(row['month']).date(), row['transaction_type'], row['count'], row['total'])
+
+    return [
+        {**summary, 'credits': str(summary['credits']), 'debits': str(summary['debits'])}
+        for _, summary in sorted(by_month.items(), reverse=True)
+    ]
@@ -1,8 +1,10 @@
 from rest_framework import serializers
 from django.conf import settings
+from django.db import transaction
 
 from apps.users.models import User
 
+from . import ledger
 from .models import Card, Transaction, ListingDailyCharge
 
 
@@ -67,23 +69,20 @@ class CardCreateSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         """Create card with last 4 digits and initial balance"""
         from django.conf import settings
-        
+
         card_number = validated_data.pop('card_number')
         validated_data['card_number_last4'] = card_number[-4:]
-        validated_data['balance'] = settings.CARD_CREATED_INITIAL_BALANCE
-        
-        card = Card.objects.create(**validated_data)
-        
-        # Create initial credit transaction
-        Transaction.objects.create(
-            user=card.user,
-            card=card,
-            amount=settings.CARD_CREATED_INITIAL_BALANCE,
-            transaction_type='initial_credit',
-            status='completed',
-            description='Initial credit on card addition'
-        )
-        
+        validated_data['balance'] = 0
+
+        with transaction.atomic():
+            card = Card.objects.create(**validated_data)
+            ledger.open_card(card)
+            # the initial balance is a ledger entry like any other
+            card.balance = ledger.credit(
+                card, settings.CARD_CREATED_INITIAL_BALANCE, 'initial_credit',
+                description='Initial credit on card addition',
+            ).balance
+
         return card
 
 
@@ -1,17 +1,115 @@
-from celery import shared_task
+import uuid
+from datetime import date, timedelta
+
+from celery import chord, shared_task
+from django.conf import settings
 from django.core.management import call_command
+from django.utils import timezone
+
+from apps.payment.billing import BillingResult, charge_range, host_ranges
+from apps.payment.models import BillingLock
 from apps.shared.utils import get_logger
 
 logger = get_logger()
 
+# Held from the start of a run until its callback, so a repeated beat
+# trigger cannot start an overlapping run. A row in the database, the
+# workers share it whatever the cache backend is.
+BILLING_LOCK_NAME = 'daily-billing'
+
+
+def acquire_billing_lock(token):
+    """Take the lease unless another run holds an unexpired one"""
+    now = timezone.now()
+    BillingLock.objects.get_or_create(name=BILLING_LOCK_NAME, defaults={'expires_at': now})
+    return bool(
+        BillingLock.objects.filter(name=BILLING_LOCK_NAME, expires_at__lte=now).update(
+            token=token, expires_at=now + timedelta(seconds=settings.DAILY_BILLING_LOCK_TIMEOUT),
+        )
+    )
+
+
+def release_billing_lock(token):
+    # a run that outlived the timeout must not release its successor's lock
+    BillingLock.objects.filter(name=BILLING_LOCK_NAME, token=token).update(token='', expires_at=timezone.now())
+
 
 @shared_task
 def charge_daily_listings_task():
-    logger.info("Starting daily listing charge task")
-    
+    """Split the daily billing into host id ranges billed in parallel, summed up by a chord callback"""
+    token = uuid.uuid4().hex
+    if not acquire_billing_lock(token):
+        logger.warning("Daily listing charge already running, skipping this trigger")
+        return
+
     try:
-        call_command('charge_daily_listings')
-        logger.info("Daily listing charge task completed successfully")
+        # every shard bills the same day, even when the run crosses midnight
+        today = timezone.now().date().isoformat()
+        ranges = host_ranges(settings.DAILY_BILLING_SHARD_SIZE)
+        logger.info(f"Starting daily listing charge task for {today}, {len(ranges)} shards")
+        if not ranges:
+            release_billing_lock(token)
+            return
+
+        header = [charge_listing_shard.s(first, last, today) for first, last in ranges]
+        callback = finish_daily_charges.s(token=token).on_error(release_daily_charges_lock.si(token))
+        chord(header)(callback)
     except Exception as e:
         logger.error(f"Error in daily listing charge task: {str(e)}")
+        release_billing_lock(token)
+        raise
+
+
+@shared_task
+def charge_listing_shard(first, last, today):
+    """Bill hosts `first`..`last`; safe to rerun, listings charged for the day are skipped"""
+    result = charge_range(
+        date.fromisoformat(today), settings.DAILY_LISTING_CHARGE, first=first, last=last,
+        batch_size=settings.DAILY_BILLING_BATCH_SIZE,
+    )
+    return result.as_dict()
+
+
+@shared_task
+def finish_daily_charges(results, token):
+    total = BillingResult()
+    for result in results:
+        total.merge(BillingResult.from_dict(result))
+    release_billing_lock(token)
+
+    logger.info(
+        f"Daily listing charge task completed: {total.listings} active listings, "
+        f"{total.charged} charged ({total.amount}), {total.failed} failed, "
+        f"{total.deactivated} deactivated, {total.skipped} already charged today"
+    )
+    if total.failed_batches:
+        logger.error(f"Daily listing charge task: {total.failed_batches} batches failed, rerun the task to bill them")
+    return total.as_dict()
+
+
+@shared_task
+def release_daily_charges_lock(token):
+    logger.error("Daily listing charge task failed, releasing its lock")
+    release_billing_lock(token)
+
+
+@shared_task
+def compact_ledger_task():
+    logger.info("Starting ledger compaction task")
+    try:
+        call_command('compact_ledger')
+        logger.info("Ledger compaction task completed successfully")
+    except Exception as e:
+        logger.error(f"Error in ledger compaction task: {str(e)}")
+        raise
+
+
+@shared_task
+def rollup_transactions_task():
+    logger.info("Starting transaction rollup task")
+    try:
+        call_command('rollup_transactions')
+        logger.info("Transaction rollup task completed successfully")
+    except Exception as e:
+        logger.error(f"Error in transaction rollup task: {str(e)}")
         raise
@@ -1,3 +1,334 @@
-from django.test import TestCase
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apps.listings.models import Listing
+from apps.payment import ledger
+from apps.payment.rollup import add_months, month_start, monthly_summary, rollup_month
+from apps.payment.billing import billed_hosts, charge_hosts, charge_range, host_ranges
+from apps.payment.models import BalanceSnapshot, BillingLock, Card, ListingDailyCharge, Transaction
+from apps.payment.tasks import acquire_billing_lock, release_billing_lock
+from apps.shared.enum import ResultCodes
+from apps.users.models import User
+
+
+def record(moment, **fields):
+    """A completed transaction recorded at `moment`, transactions cannot be backdated afterwards"""
+    with mock.patch('django.utils.timezone.now', return_value=moment):
+        return Transaction.objects.create(status='completed', **fields)
+
+
+class DailyBillingTests(TestCase):
+    TODAY = date(2025, 1, 15)
+
+    def make_host(self, name, listings, balance=None):
+        host = User.objects.create(email=f'{name}@example.com', username=name)
+        if balance is not None:
+            Card.objects.create(
+                user=host, card_number_last4='4242', card_holder_name=name,
+                expiry_month=1, expiry_year=2030, balance=balance,
+            )
+        Listing.objects.bulk_create(
+            Listing(title='Listing', description='', price=Decimal('1000000'), host=host, location='Toshkent')
+            for _ in range(listings)
+        )
+        return host
+
+    def test_charges(self):
+        rich = self.make_host('rich', 3, balance=Decimal('100.00'))
+        poor = self.make_host('poor', 3, balance=Decimal('25.00'))
+        cardless = self.make_host('cardless', 2)
+
+        result = charge_hosts([rich.pk, poor.pk, cardless.pk], self.TODAY, 10.00)
+
+        self.assertEqual((result.charged, result.failed, result.deactivated), (5, 1, 3))
+        self.assertEqual(Card.objects.get(user=rich).balance, Decimal('70.00'))
+        self.assertEqual(Card.objects.get(user=poor).balance, Decimal('5.00'))
+        self.assertEqual(Listing.objects.filter(host=poor, is_active=False).count(), 1)
+        self.assertEqual(Listing.objects.filter(host=cardless, is_active=True).count(), 0)
+        self.assertEqual(Transaction.objects.filter(transaction_type='daily_charge').count(), 5)
+        self.assertFalse(ListingDailyCharge.objects.filter(success=True, transaction=None).exists())
+
+        # a second run the same day changes nothing
+        again = charge_hosts([rich.pk, poor.pk, cardless.pk], self.TODAY, 10.00)
+        self.assertEqual((again.charged, again.skipped), (0, 5))
+        self.assertEqual(Card.objects.get(user=rich).balance, Decimal('70.00'))
+
+    def test_queries_do_not_grow_with_listings(self):
+        small = [self.make_host(f'small{i}', 1, balance=Decimal('500.00')).pk for i in range(2)]
+        large = [self.make_host(f'large{i}', 20, balance=Decimal('500.00')).pk for i in range(2)]
+
+        with CaptureQueriesContext(connection) as few:
+            charge_hosts(small, self.TODAY, 10.00)
+        with CaptureQueriesContext(connection) as many:
+            charge_hosts(large, self.TODAY, 10.00)
+        self.assertEqual(len(few), len(many))
+
+    def test_billed_hosts(self):
+        hosts = [self.make_host(f'host{i}', 1).pk for i in range(5)]
+        self.assertEqual(list(billed_hosts(2)), [hosts[:2], hosts[2:4], hosts[4:]])
+
+    def test_ranges_bill_every_host_once(self):
+        for i in range(7):
+            self.make_host(f'host{i}', 2, balance=Decimal('500.00'))
+        ranges = host_ranges(3)
+        self.assertEqual(len(ranges), 3)
+
+        charged = sum(charge_range(self.TODAY, 10.00, first, last, batch_size=2).charged for first, last in ranges)
+        self.assertEqual(charged, 14)
+        # a shard that runs twice bills nothing new
+        first, last = ranges[0]
+        self.assertEqual(charge_range(self.TODAY, 10.00, first, last).skipped, 6)
+        self.assertEqual(ListingDailyCharge.objects.filter(charge_date=self.TODAY).count(), 14)
+
+    def test_billing_lock(self):
+        self.assertTrue(acquire_billing_lock('first'))
+        self.assertFalse(acquire_billing_lock('second'))
+        # only the holder releases it
+        release_billing_lock('second')
+        self.assertFalse(acquire_billing_lock('second'))
+        release_billing_lock('first')
+        self.assertTrue(acquire_billing_lock('second'))
+
+        # a crashed run stops blocking once its lease expires
+        BillingLock.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertTrue(acquire_billing_lock('third'))
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='payer@example.com', username='payer')
+        self.small, self.large = (
+            Card.objects.create(
+                user=self.user, card_number_last4='4242', card_holder_name='Payer',
+                expiry_month=1, expiry_year=2030, balance=balance,
+            )
+            for balance in (Decimal('20.00'), Decimal('30.00'))
+        )
+
+    def test_charge_debits_the_richest_card(self):
+        transaction_obj = ledger.charge(self.user, '12.5', 'listing_charge')
+        self.assertEqual(transaction_obj.card_id, self.large.pk)
+        self.assertEqual(transaction_obj.balance, Decimal('17.50'))
+        self.assertTrue(Transaction.objects.filter(pk=transaction_obj.pk, amount=Decimal('12.50')).exists())
+
+        # the small card is richer now
+        self.assertEqual(ledger.charge(self.user, 1, 'listing_charge').card_id, self.small.pk)
+
+    def test_charge_never_overdraws(self):
+        with self.assertRaises(ledger.InsufficientFunds) as raised:
+            ledger.charge(self.user, '30.01', 'listing_charge')
+        self.assertEqual(raised.exception.balance, Decimal('50.00'))
+        with self.assertRaises(ledger.InsufficientFunds):
+            ledger.charge(self.user, '25', 'listing_charge', card=self.small)
+        self.small.is_active = False
+        self.small.save()
+        with self.assertRaises(ledger.NoActiveCard):
+            ledger.charge(self.user, '1', 'listing_charge', card=self.small)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_debit_many_is_all_or_nothing(self):
+        charges = [
+            Transaction(user=self.user, card=self.small, amount=Decimal('15.00'), transaction_type='daily_charge'),
+            Transaction(user=self.user, card=self.small, amount=Decimal('15.00'), transaction_type='daily_charge'),
+            Transaction(user=self.user, card=self.large, amount=Decimal('10.00'), transaction_type='daily_charge'),
+        ]
+        with self.assertRaises(ledger.InsufficientFunds):
+            ledger.debit_many(charges)
+        self.assertEqual(Card.objects.get(pk=self.large.pk).balance, Decimal('30.00'))
+        self.assertFalse(Transaction.objects.exists())
+
+        ledger.debit_many(charges[1:])
+        self.assertEqual(Card.objects.get(pk=self.small.pk).balance, Decimal('5.00'))
+        self.assertEqual(Card.objects.get(pk=self.large.pk).balance, Decimal('20.00'))
+
+    def test_ledger_balance_from_snapshot_and_tail(self):
+        # the setUp cards predate the ledger, their balances are the baseline
+        self.assertEqual(ledger.open_ledgers([self.small.pk, self.large.pk]), 2)
+        self.assertEqual(ledger.open_ledgers([self.small.pk, self.large.pk]), 0)
+        first = ledger.charge(self.user, '4.00', 'listing_charge', card=self.large)
+        self.assertEqual(ledger.take_snapshots([self.small.pk, self.large.pk], upto=first.pk), 1)
+        ledger.charge(self.user, '6.00', 'listing_charge', card=self.large)
+
+        self.assertEqual(BalanceSnapshot.objects.get(card=self.large).balance, Decimal('26.00'))
+        self.assertEqual(ledger.ledger_balance(self.large), Decimal('20.00'))
+        self.assertEqual(ledger.ledger_balance(self.large), Card.objects.get(pk=self.large.pk).balance)
+        self.assertEqual(ledger.ledger_balance(self.small), Decimal('20.00'))
+
+        with self.assertRaises(ValueError):
+            Transaction.objects.get(pk=first.pk).save()
+
+    def test_history_is_append_only(self):
+        first = ledger.charge(self.user, '4.00', 'listing_charge', card=self.large)
+        with self.assertRaises(ValueError):
+            Transaction.objects.filter(pk=first.pk).update(amount=0)
+        with self.assertRaises(ValueError):
+            Transaction.objects.filter(pk=first.pk).delete()
+        with self.assertRaises(ValueError):
+            Transaction.objects.get(pk=first.pk).delete()
+
+        # deleting the card or the listing leaves the entry as it was
+        listing = Listing.objects.create(host=self.user, title='Flat', price=100)
+        second = ledger.charge(self.user, '1.00', 'listing_charge', card=self.small, listing=listing)
+        large_id, listing_id = self.large.pk, listing.pk
+        self.large.delete()
+        listing.delete()
+        self.assertEqual(
+            list(Transaction.objects.order_by('pk').values_list('card_id', 'listing_id', 'amount')),
+            [(large_id, None, Decimal('4.00')), (self.small.pk, listing_id, Decimal('1.00'))],
+        )
+        self.assertEqual(ledger.ledger_balance(self.small), Decimal('-1.00'))
+
+    @override_settings(LEDGER_SNAPSHOT_LAG=timedelta(0))
+    def test_compaction_opens_cards_that_predate_the_ledger(self):
+        # an old card: a balance of 500 that was never a transaction, and a charge since
+        legacy = Card.objects.create(
+            user=self.user, card_number_last4='1111', card_holder_name='Payer',
+            expiry_month=1, expiry_year=2030, balance=Decimal('490.00'),
+        )
+        Transaction.objects.create(
+            user=self.user, card=legacy, amount=Decimal('10.00'), transaction_type='daily_charge', status='completed',
+        )
+        out = StringIO()
+        call_command('reconcile_balances', stdout=out)
+        self.assertIn('Checked 3 cards, 0 drifted', out.getvalue())
+        self.assertIn('3 cards predate the ledger', out.getvalue())
+
+        call_command('compact_ledger', stdout=StringIO())
+        self.assertEqual(ledger.ledger_balance(legacy), Decimal('490.00'))
+        ledger.charge(self.user, '5.00', 'listing_charge', card=legacy)
+        call_command('compact_ledger', stdout=StringIO())
+        self.assertEqual(BalanceSnapshot.objects.get(card=legacy).balance, Decimal('485.00'))
+
+        out = StringIO()
+        call_command('reconcile_balances', stdout=out)
+        self.assertIn('Checked 3 cards, 0 drifted', out.getvalue())
+        self.assertNotIn('predate', out.getvalue())
+
+    def test_new_card_is_credited_through_the_ledger(self):
+        User.objects.filter(pk=self.user.pk).update(is_active=True)
+        token = AccessToken.for_user(self.user)
+        response = self.client.post('/api/payment/cards/add/', HTTP_AUTHORIZATION=f'Bearer {token}', data={
+            'card_number': '4242424242424242', 'card_holder_name': 'Payer',
+            'expiry_month': 1, 'expiry_year': date.today().year + 1,
+        })
+        self.assertEqual(response.status_code, 200)
+        card = Card.objects.get(user=self.user, card_number_last4='4242', expiry_year=date.today().year + 1)
+        self.assertEqual(card.balance, settings.CARD_CREATED_INITIAL_BALANCE)
+        self.assertEqual(ledger.ledger_balance(card), card.balance)
+        self.assertEqual(
+            list(Transaction.objects.filter(card=card).values_list('transaction_type', 'amount')),
+            [('initial_credit', settings.CARD_CREATED_INITIAL_BALANCE)],
+        )
+
+    def test_charge_rejects_malformed_ids(self):
+        User.objects.filter(pk=self.user.pk).update(is_active=True)
+        token = AccessToken.for_user(self.user)
+        for data in ({'card_id': 'abc', 'amount': '1'}, {'card_id': self.small.pk, 'amount': '1', 'listing_id': 'x'}):
+            with self.subTest(data=data):
+                response = self.client.post('/api/payment/charge/', data, HTTP_AUTHORIZATION=f'Bearer {token}')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()['error']['code'], ResultCodes.VALIDATION_ERROR.value)
+        self.assertFalse(Transaction.objects.exists())
+        self.small.refresh_from_db()
+        self.assertEqual(self.small.balance, Decimal('20.00'))
+
+
+class TransactionHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='history@example.com', username='history', is_active=True)
+        now = timezone.now()
+        for i in range(120):
+            record(
+                now - timedelta(days=i), user=cls.user, amount=Decimal('10.00'),
+                transaction_type='refund' if i % 4 == 0 else 'daily_charge',
+            )
+
+    def test_summary_reads_closed_months_from_rollups(self):
+        current = month_start(timezone.localdate())
+        for months_back in range(1, 6):
+            rollup_month(add_months(current, -months_back))
+        summary = monthly_summary(self.user, months=6)
+        self.assertEqual(sum(month['count'] for month in summary), 120)
+        self.assertEqual(
+            sum(Decimal(month['debits']) - Decimal(month['credits']) for month in summary),
+            Decimal('10.00') * (90 - 30),
+        )
+
+        # months before the previous one are not scanned again
+        record(timezone.now() - timedelta(days=100), user=self.user, amount=Decimal('99.00'), transaction_type='daily_charge')
+        self.assertEqual(monthly_summary(self.user, months=6), summary)
+
+    def get(self, url='/api/payment/transactions/', **params):
+        token = AccessToken.for_user(self.user)
+        response = self.client.get(url, params, HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['result']
+
+    def test_list_walks_every_page_once(self):
+        page = self.get(page_size=50, with_count=1)
+        self.assertEqual(page['total_count'], 120)
+        self.assertIsNone(page['previous'])
+        ids = [row['id'] for row in page['results']]
+        while page['next']:
+            page = self.get(page['next'])
+            ids += [row['id'] for row in page['results']]
+        self.assertEqual(len(page['results']), 20)
+        self.assertEqual(
+            ids, list(Transaction.objects.filter(user=self.user).order_by('-created_at', '-id').values_list('id', flat=True)),
+        )
+
+        # and back from the last page
+        page = self.get(page['previous'])
+        self.assertEqual([row['id'] for row in page['results']], ids[50:100])
+
+    def test_list_is_newest_first_and_sized(self):
+        page = self.get()
+        self.assertEqual(page['count'], 20)
+        self.assertNotIn('total_count', page)
+        created = [row['created_at'] for row in page['results']]
+        self.assertEqual(created, sorted(created, reverse=True))
+        self.assertEqual(self.get(page_size=1000)['count'], 100)
+
+    def test_date_filters_take_whole_days(self):
+        user = User.objects.create(email='days@example.com', username='days', is_active=True)
+        day = date(2026, 3, 10)
+        moments = {
+            'before': datetime.combine(day - timedelta(days=1), time.max),
+            'first': datetime.combine(day, time.min),
+            'last': datetime.combine(day + timedelta(days=1), time.max),
+            'after': datetime.combine(day + timedelta(days=2), time.min),
+        }
+        for description, moment in moments.items():
+            record(
+                timezone.make_aware(moment), user=user, amount=Decimal('1.00'), transaction_type='daily_charge',
+                description=description,
+            )
+
+        self.user = user
+        page = self.get(date_from=day.isoformat(), date_to=(day + timedelta(days=1)).isoformat(), with_count=1)
+        self.assertEqual([row['description'] for row in page['results']], ['last', 'first'])
+        self.assertEqual(page['total_count'], 2)
+        self.assertEqual(
+            [row['description'] for row in self.get(date_from=day.isoformat())['results']], ['after', 'last', 'first'],
+        )
+        self.assertEqual([row['description'] for row in self.get(date_to=day.isoformat())['results']], ['first', 'before'])
+
+    def test_filters_carry_over_to_the_next_page(self):
+        page = self.get(transaction_type='refund', page_size=10)
+        self.assertIn('transaction_type=refund', page['next'])
+        types = [row['transaction_type'] for row in page['results']]
+        while page['next']:
+            page = self.get(page['next'])
+            types += [row['transaction_type'] for row in page['results']]
+        self.assertEqual(types, ['refund'] * 30)
@@ -6,6 +6,7 @@ from .views import (
     CardUpdateView,
     CardDeleteView,
     TransactionListView,
+    TransactionSummaryView,
     ChargeCardView
 )
 
@@ -18,5 +19,6 @@ urlpatterns = [
     path('cards/<int:pk>/update_status/', CardUpdateView.as_view(), name='card-update-status'),
     path('cards/<int:pk>/delete/', CardDeleteView.as_view(), name='card-delete'),
     path('transactions/', TransactionListView.as_view(), name='transactions'),
+    path('transactions/summary/', TransactionSummaryView.as_view(), name='transaction-summary'),
     path('charge/', ChargeCardView.as_view(), name='charge-card'),
 ]
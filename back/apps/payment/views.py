@@ -2,9 +2,13 @@ from rest_framework import generics, status, permissions
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from django.db import transaction as db_transaction
-from drf_spectacular.utils import extend_schema
+from drf_spectacular.utils import extend_schema, OpenApiParameter
+from django_filters.rest_framework import DjangoFilterBackend
 
+from . import ledger
+from .filters import TransactionFilter
+from .pagination import TransactionCursorPagination
+from .rollup import monthly_summary
 from .models import Card, Transaction, ListingDailyCharge
 from .serializers import (
     CardSerializer, 
@@ -111,14 +115,33 @@ class CardDeleteView(generics.DestroyAPIView):
 class TransactionListView(generics.ListAPIView):
     serializer_class = TransactionSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = TransactionCursorPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = TransactionFilter
     
     def get_queryset(self):
-        return Transaction.objects.filter(user=self.request.user)
+        return Transaction.objects.filter(user=self.request.user).select_related('card', 'listing')
     
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
-        return SuccessResponse(serializer.data)
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return SuccessResponse(self.paginator.get_paginated_response(serializer.data))
+
+
+class TransactionSummaryView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    @extend_schema(
+        summary="Monthly transaction summary",
+        parameters=[OpenApiParameter('months', int, description='Months to include, newest first (default 12, max 36)')],
+    )
+    def get(self, request):
+        try:
+            months = min(max(int(request.query_params.get('months', 12)), 1), 36)
+        except ValueError:
+            months = 12
+        return SuccessResponse(monthly_summary(request.user, months))
 
 
 class ChargeCardView(APIView):
@@ -135,58 +158,76 @@ class ChargeCardView(APIView):
         if not card_id or not amount:
             return ErrorResponse(
                 result=ResultCodes.VALIDATION_ERROR,
-                message={"error": "card_id and amount are required"}
+                message={
+                    "en": "card_id and amount are required.",
+                    "ru": "Требуются card_id и amount.",
+                    "uz": "card_id va amount talab qilinadi."
+                }
             )
         
         try:
-            amount = float(amount)
+            card_id = int(card_id)
+            listing_id = int(listing_id) if listing_id not in (None, '') else None
+        except (TypeError, ValueError):
+            return ErrorResponse(
+                result=ResultCodes.VALIDATION_ERROR,
+                message={
+                    "en": "card_id and listing_id must be integers.",
+                    "ru": "card_id и listing_id должны быть целыми числами.",
+                    "uz": "card_id va listing_id butun son bo'lishi kerak."
+                }
+            )
+        
+        try:
+            amount = ledger.to_amount(amount)
             if amount <= 0:
                 return ErrorResponse(
                     result=ResultCodes.VALIDATION_ERROR,
-                    message={"error": "Amount must be positive"}
+                    message={
+                        "en": "Amount must be positive.",
+                        "ru": "Сумма должна быть положительной.",
+                        "uz": "Summa musbat bo'lishi kerak."
+                    }
                 )
         except ValueError:
             return ErrorResponse(
                 result=ResultCodes.VALIDATION_ERROR,
-                message={"error": "Invalid amount format"}
+                message={
+                    "en": "Invalid amount format.",
+                    "ru": "Неверный формат суммы.",
+                    "uz": "Summa formati noto'g'ri."
+                }
             )
         
-        # Get card
+        # Card lookup, balance check and debit are one conditional update
         try:
-            card = Card.objects.get(id=card_id, user=user, is_active=True)
-        except Card.DoesNotExist:
+            transaction_obj = ledger.charge(
+                user, amount, 'listing_charge', card=card_id, listing=listing_id, description=description,
+            )
+        except ledger.NoActiveCard:
             return ErrorResponse(
                 result=ResultCodes.CARD_NOT_FOUND,
-                message={"error": "Card not found or inactive"}
+                message={
+                    "en": "Card not found or inactive.",
+                    "ru": "Карта не найдена или неактивна.",
+                    "uz": "Karta topilmadi yoki nofaol."
+                }
             )
-        
-        # Check balance
-        if card.balance < amount:
+        except ledger.InsufficientFunds as e:
             return ErrorResponse(
                 result=ResultCodes.INSUFFICIENT_BALANCE,
-                message={"error": "Insufficient balance", "balance": str(card.balance)}
+                message={
+                    "en": f"Insufficient balance: {e.balance}.",
+                    "ru": f"Недостаточно средств: {e.balance}.",
+                    "uz": f"Mablag' yetarli emas: {e.balance}."
+                }
             )
         
-        # Perform transaction
-        with db_transaction.atomic():
-            card.balance -= amount
-            card.save()
-            
-            transaction_obj = Transaction.objects.create(
-                user=user,
-                card=card,
-                listing_id=listing_id,
-                amount=amount,
-                transaction_type='listing_charge',
-                status='completed',
-                description=description
-            )
-            
-            logger.info(f"Charged {amount} from card {card.id} for user {user.email}")
+        logger.info(f"Charged {amount} from card {transaction_obj.card_id} for user {user.email}")
         
         return SuccessResponse({
             "message": "Payment successful",
             "transaction_id": transaction_obj.id,
-            "remaining_balance": str(card.balance)
+            "remaining_balance": str(transaction_obj.balance)
         })
 
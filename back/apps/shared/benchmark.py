@@ -0,0 +1,401 @@
+"""
+Endpoint benchmark harness.
+
+`seed()` fills the database with a configurable catalogue, `ENDPOINTS`
+describes how to call every URL in apps/*/urls.py through the test client,
+and `run()` reports p50/p95 latency and SQL query counts per endpoint.
+Used by the `benchmark` management command and by the query budget tests
+in apps/shared/tests.py.
+"""
+import json
+import math
+import random
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO
+from typing import Callable, Optional
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, get_resolver, reverse
+from PIL import Image
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apps.listings.documents import refresh_listing_documents
+from apps.listings import resumable
+from apps.listings.models import ForWhom, Listing, ListingImage, UploadSession
+from apps.payment.models import Card, Transaction
+from apps.shared.models import District, Region
+from apps.users.models import User
+
+PASSWORD = 'benchmark-password'
+
+
+@dataclass
+class SeedConfig:
+    users: int = 200
+    listings_per_user: int = 5
+    images_per_listing: int = 4
+    cards_per_user: int = 2
+    transactions_per_user: int = 20
+    random_seed: int = 42
+
+
+@dataclass
+class BenchmarkContext:
+    """Ids of the seeded rows the endpoints act on"""
+    user: User
+    cardholder: User
+    listing_id: int
+    toggle_listing_id: int
+    card_id: int
+    toggle_card_id: int
+
+
+@dataclass
+class Endpoint:
+    name: str  # URL name, namespaced where the urlconf sets app_name
+    method: str = 'get'
+    auth: bool = False
+    as_user: Optional[Callable] = None  # ctx -> user to authenticate as, default ctx.user
+    query: str = ''
+    query_budget: Optional[int] = None
+    url_kwargs: Optional[Callable] = None  # ctx -> reverse() kwargs, called before every request
+    payload: Optional[Callable] = None  # ctx -> request body
+
+    @property
+    def label(self):
+        return f'{self.name}?{self.query}' if self.query else self.name
+
+
+@dataclass
+class Result:
+    label: str
+    method: str
+    status: int
+    iterations: int
+    p50_ms: float
+    p95_ms: float
+    queries: int
+    query_budget: Optional[int] = None
+
+    @property
+    def over_budget(self):
+        return self.query_budget is not None and self.queries > self.query_budget
+
+
+def seed(config=None, stdout=None):
+    """Bulk-insert users, cards, listings, images and transactions; returns a BenchmarkContext"""
+    config = config or SeedConfig()
+    rnd = random.Random(config.random_seed)
+    log = stdout.write if stdout else (lambda message: None)
+
+    if not Region.objects.exists():
+        call_command('loaddata', 'regions.json', 'districts.json', verbosity=0)
+    districts = list(District.objects.values_list('id', 'region_id'))
+    for_whom = [ForWhom.objects.get_or_create(name=name)[0] for name, _ in ForWhom.FOR_WHOM_CHOICES]
+
+    password = make_password(PASSWORD)
+    run_id = time.time_ns()
+    users = User.objects.bulk_create(
+        User(
+            email=f'bench-{run_id}-{i}@example.com', username=f'bench-{run_id}-{i}',
+            password=password, is_active=True, is_verified=True, full_name=f'Bench User {i}',
+        )
+        for i in range(config.users + 1)
+    )
+    cardholder, users = users[0], users[1:]
+    log(f'Seeded {len(users) + 1} users')
+
+    cards = Card.objects.bulk_create(
+        Card(
+            user=user, card_number_last4=f'{rnd.randint(0, 9999):04d}', card_holder_name=user.full_name,
+            expiry_month=rnd.randint(1, 12), expiry_year=date.today().year + 3, balance=Decimal('1000000.00'),
+        )
+        for user in [cardholder, *users] for _ in range(config.cards_per_user)
+    )
+    cards_by_user = {}
+    for card in cards:
+        cards_by_user.setdefault(card.user_id, []).append(card)
+    log(f'Seeded {len(cards)} cards')
+
+    today = date.today()
+    listings = []
+    for user in users:
+        for _ in range(config.listings_per_user):
+            district_id, region_id = rnd.choice(districts)
+            rooms = rnd.randint(1, 6)
+            listings.append(Listing(
+                title=f'{rooms} xonali kvartira', description='Benchmark listing', host=user,
+                price=Decimal(rnd.randrange(500000, 9000000, 50000)), location='Toshkent', rooms=rooms,
+                state=rnd.choices(['ACCEPTED', 'CHECKING', 'REJECTED'], [85, 10, 5])[0],
+                is_active=rnd.random() < 0.9, type=rnd.choice(['EMPTY', 'PARTNERSHIP']),
+                total_floor_of_building=9, floor_of_this_apartment=rnd.randint(1, 9),
+                district_id=district_id, region_id=region_id,
+            ))
+    listings = Listing.objects.bulk_create(listings, batch_size=1000)
+    # created_at is auto_now_add, spread it so the feed ordering is realistic
+    for listing in listings:
+        listing.created_at = today - timedelta(days=rnd.randint(0, 365))
+    Listing.objects.bulk_update(listings, ['created_at'], batch_size=1000)
+    Listing.for_whom.through.objects.bulk_create((
+        Listing.for_whom.through(listing_id=listing.id, forwhom_id=fw.id)
+        for listing in listings for fw in rnd.sample(for_whom, rnd.randint(1, 2))
+    ), batch_size=1000)
+    log(f'Seeded {len(listings)} listings')
+
+    images = ListingImage.objects.bulk_create((
+        ListingImage(listing=listing, image=f'listing/images/bench-{listing.id}-{n}.jpg')
+        for listing in listings for n in range(config.images_per_listing)
+    ), batch_size=1000)
+    log(f'Seeded {len(images)} images')
+
+    transactions = Transaction.objects.bulk_create((
+        Transaction(
+            user=user, card=rnd.choice(cards_by_user[user.id]), amount=Decimal('10.00'),
+            transaction_type=rnd.choice(['listing_charge', 'daily_charge', 'listing_activation_charge']),
+            status='completed', description='Benchmark transaction',
+        )
+        for user in users for _ in range(config.transactions_per_user)
+    ), batch_size=1000)
+    log(f'Seeded {len(transactions)} transactions')
+
+    listing_ids = [listing.id for listing in listings]
+    for start in range(0, len(listing_ids), 1000):
+        refresh_listing_documents(listing_ids[start:start + 1000])
+    log('Built listing search documents')
+
+    user = users[0]
+    own_listings = [listing for listing in listings if listing.host_id == user.id]
+    Listing.objects.filter(id=own_listings[0].id).update(state='ACCEPTED', is_active=True)
+    refresh_listing_documents([own_listings[0].id])
+    return BenchmarkContext(
+        user=user,
+        cardholder=cardholder,
+        listing_id=own_listings[0].id,
+        toggle_listing_id=own_listings[-1].id,
+        card_id=cards_by_user[user.id][0].id,
+        toggle_card_id=cards_by_user[cardholder.id][0].id,
+    )
+
+
+def _new_listing(ctx):
+    listing = Listing.objects.create(
+        title='Disposable listing', description='', price=Decimal('1000000'),
+        host=ctx.user, location='Toshkent',
+    )
+    return {'id': listing.id}
+
+
+def _new_image(ctx):
+    image = ListingImage.objects.create(listing_id=ctx.listing_id, image='listing/images/bench-disposable.jpg')
+    return {'pk': image.id}
+
+
+def _new_card(ctx):
+    card = Card.objects.create(
+        user=ctx.user, card_number_last4='0000', card_holder_name='Disposable',
+        expiry_month=1, expiry_year=date.today().year + 1,
+    )
+    return {'pk': card.id}
+
+
+def _upload_payload(ctx):
+    # stay below the per-user limit of unfinished uploads across iterations
+    UploadSession.objects.filter(user=ctx.user).delete()
+    return {'filename': 'photo.jpg', 'size': 1024 * 1024}
+
+
+def _new_upload(ctx):
+    return {'id': resumable.create_session(ctx.user, 'photo.jpg', 1024 * 1024).pk}
+
+
+def _received_upload(ctx):
+    buffer = BytesIO()
+    Image.new('RGB', (64, 48), 'white').save(buffer, 'JPEG')
+    session = resumable.create_session(ctx.user, 'photo.jpg', len(buffer.getvalue()))
+    resumable.write_chunk(session, 0, BytesIO(buffer.getvalue()), session.size)
+    return {'id': session.pk}
+
+
+def _listing_payload(ctx):
+    return {
+        'title': '2 xonali kvartira', 'description': 'Benchmark', 'price': '1500000',
+        'location': 'Toshkent', 'rooms': 2, 'region': 2, 'for_whom': ['FAMILY'],
+    }
+
+
+def _card_payload(ctx):
+    return {'card_number': '8600123412341234', 'card_holder_name': 'Bench', 'expiry_month': 12, 'expiry_year': date.today().year + 2}
+
+
+ENDPOINTS = [
+    # listings
+    Endpoint('listing_list', query_budget=1),
+    Endpoint('listing_list', query='region=2&rooms=2&ordering=price', query_budget=1),
+    Endpoint('listing_list', query='search=kvartira', query_budget=1),
+    Endpoint('listing_facets', query_budget=1),
+    Endpoint('listing_retrieve', url_kwargs=lambda ctx: {'id': ctx.listing_id}, query_budget=5),
+    Endpoint('my_listings', auth=True, query_budget=6),
+    Endpoint('listing_create', method='post', auth=True, payload=_listing_payload, query_budget=24),
+    Endpoint('listing_update', method='patch', auth=True, url_kwargs=lambda ctx: {'id': ctx.listing_id},
+             payload=lambda ctx: {'title': 'Updated title'}, query_budget=16),
+    Endpoint('listing_update_status', method='patch', auth=True,
+             url_kwargs=lambda ctx: {'id': ctx.toggle_listing_id}, query_budget=18),
+    Endpoint('listing_delete', method='delete', auth=True, url_kwargs=_new_listing, query_budget=15),
+    Endpoint('listing_image_delete', method='delete', auth=True, url_kwargs=_new_image, query_budget=14),
+    Endpoint('listing_upload_create', method='post', auth=True, payload=_upload_payload, query_budget=3),
+    Endpoint('listing_upload', auth=True, url_kwargs=_new_upload, query_budget=2),
+    Endpoint('listing_upload_finalize', method='post', auth=True, url_kwargs=_received_upload, query_budget=3),
+    # shared
+    Endpoint('shared-view', query_budget=0),
+    Endpoint('regions-list', query_budget=0),
+    Endpoint('districts-list', query_budget=0),
+    # payment
+    Endpoint('payment:list-cards', auth=True, query_budget=2),
+    Endpoint('payment:card-retrieve', auth=True, url_kwargs=lambda ctx: {'pk': ctx.card_id}, query_budget=2),
+    # the card, then its initial credit through the ledger
+    Endpoint('payment:add-card', method='post', auth=True, payload=_card_payload, query_budget=10),
+    Endpoint('payment:card-update-status', method='patch', auth=True, as_user=lambda ctx: ctx.cardholder,
+             url_kwargs=lambda ctx: {'pk': ctx.toggle_card_id}, query_budget=4),
+    Endpoint('payment:card-delete', method='delete', auth=True, url_kwargs=_new_card, query_budget=8),
+    Endpoint('payment:transactions', auth=True, query_budget=2),
+    Endpoint('payment:transaction-summary', auth=True, query_budget=3),
+    # one statement on PostgreSQL, the budget covers the multi-statement fallback
+    Endpoint('payment:charge-card', method='post', auth=True,
+             payload=lambda ctx: {'card_id': ctx.card_id, 'amount': '1.00'}, query_budget=7),
+    # users
+    Endpoint('login', method='post', payload=lambda ctx: {'email': ctx.user.email, 'password': PASSWORD}, query_budget=3),
+    Endpoint('get_profile', auth=True, query_budget=1),
+    Endpoint('profile_update', method='patch', auth=True, payload=lambda ctx: {'full_name': 'Updated Name'}, query_budget=3),
+    Endpoint('google_login', query_budget=0),
+]
+
+# URLs that cannot be replayed offline, with the reason
+SKIPPED = {
+    'register': 'sends an OTP email',
+    'verify_otp': 'needs the OTP from the registration email',
+    'otp_forgot_password': 'sends an OTP email',
+    'verify_forgot_password': 'needs the code from the password reset email',
+    'password_reset': 'needs a verified password reset token',
+    'google_callback': 'exchanges the code with Google',
+}
+
+
+def app_url_names():
+    """Names of every URL defined in apps/*/urls.py, namespaced like reverse() expects"""
+    names = set()
+
+    def walk(patterns, namespace):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                module = getattr(pattern.urlconf_module, '__name__', '')
+                if module.startswith('apps.'):
+                    prefix = f'{namespace}{pattern.namespace}:' if pattern.namespace else namespace
+                    walk(pattern.url_patterns, prefix)
+            elif isinstance(pattern, URLPattern) and pattern.name:
+                names.add(f'{namespace}{pattern.name}')
+
+    walk([p for p in get_resolver().url_patterns if isinstance(p, URLResolver)], '')
+    return names
+
+
+def uncovered_url_names():
+    covered = {endpoint.name for endpoint in ENDPOINTS} | set(SKIPPED)
+    return sorted(app_url_names() - covered)
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    index = max(0, math.ceil(fraction * len(ordered)) - 1)
+    return ordered[index]
+
+
+def _client(user=None):
+    # a 500 is reported in the status column rather than aborting the run
+    if user is None:
+        return Client(raise_request_exception=False)
+    return Client(raise_request_exception=False, HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+
+
+def run(endpoints, ctx, iterations=20, warmup=2):
+    """Call every endpoint `warmup + iterations` times and collect timings and query counts"""
+    results = []
+    for endpoint in endpoints:
+        client = _client((endpoint.as_user or (lambda ctx: ctx.user))(ctx) if endpoint.auth else None)
+        call = getattr(client, endpoint.method)
+        timings, queries, status = [], 0, None
+        for i in range(warmup + iterations):
+            kwargs = endpoint.url_kwargs(ctx) if endpoint.url_kwargs else None
+            path = reverse(endpoint.name, kwargs=kwargs)
+            if endpoint.query:
+                path = f'{path}?{endpoint.query}'
+            payload = endpoint.payload(ctx) if endpoint.payload else None
+            request_kwargs = {'content_type': 'application/json'} if endpoint.method != 'get' else {}
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = call(path, data=payload, **request_kwargs)
+                elapsed = (time.perf_counter() - started) * 1000
+            if i >= warmup:
+                timings.append(elapsed)
+                queries = max(queries, len(captured.captured_queries))
+                status = response.status_code
+        results.append(Result(
+            label=endpoint.label,
+            method=endpoint.method.upper(),
+            status=status,
+            iterations=iterations,
+            p50_ms=round(percentile(timings, 0.5), 2),
+            p95_ms=round(percentile(timings, 0.95), 2),
+            queries=queries,
+            query_budget=endpoint.query_budget,
+        ))
+    return results
+
+
+@dataclass
+class Comparison:
+    label: str
+    p95_ms: float
+    baseline_p95_ms: float
+    queries: int
+    baseline_queries: int
+    regressions: list = field(default_factory=list)
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Compare results with a baseline loaded by load_baseline(); p95 may grow by `tolerance`"""
+    previous = {row['label']: row for row in baseline.get('results', [])}
+    comparisons = []
+    for result in results:
+        row = previous.get(result.label)
+        if row is None:
+            continue
+        comparison = Comparison(result.label, result.p95_ms, row['p95_ms'], result.queries, row['queries'])
+        if result.queries > row['queries']:
+            comparison.regressions.append('queries')
+        if result.p95_ms > row['p95_ms'] * (1 + tolerance):
+            comparison.regressions.append('p95')
+        comparisons.append(comparison)
+    return comparisons
+
+
+def save_baseline(path, results, config):
+    data = {
+        'created': date.today().isoformat(),
+        'database': connection.vendor,
+        'seed': asdict(config),
+        'results': [asdict(result) for result in results],
+    }
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data, indent=2) + '\n')
+
+
+def load_baseline(path):
+    return json.loads(path.read_text())
@@ -0,0 +1,53 @@
+import hashlib
+
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+def strong_etag(body):
+    """Strong ETag for a response body"""
+    return '"%s"' % hashlib.sha1(body).hexdigest()
+
+
+def conditional_bytes_response(request, body, etag=None, content_type='application/json', cache_control=None):
+    """
+    Serve pre-rendered bytes, or 304 Not Modified when the client already has them.
+    """
+    etag = etag or strong_etag(body)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(body, content_type=content_type)
+    response['ETag'] = etag
+    if cache_control:
+        response['Cache-Control'] = cache_control
+    return response
+
+
+
+def version_etag(*parts):
+    """
+    Weak ETag derived from whatever versions a representation depends on,
+    so it can be checked without rendering the body.
+    """
+    token = ':'.join(str(part) for part in parts)
+    return 'W/"%s"' % hashlib.sha1(token.encode()).hexdigest()
+
+
+def not_modified(request, etag=None, last_modified=None):
+    """304 response when the request's validators match, otherwise None"""
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is not None:
+        set_validators(response, etag=etag, last_modified=last_modified)
+    return response
+
+
+def set_validators(response, etag=None, last_modified=None):
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
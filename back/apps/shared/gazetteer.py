@@ -0,0 +1,186 @@
+"""
+In-process, read-only copy of the regions / districts gazetteer.
+
+The data only changes when the fixtures are reloaded, so every worker
+loads it once into frozen lookup tables and pre-renders the JSON bodies of
+the shared endpoints. The snapshot is only reloaded when a Region or
+District row changes: the worker making the change drops its snapshot
+right away, and with a shared cache (CACHE_REDIS_URL) it also bumps a
+version counter there that the other workers look at, at most every
+GAZETTEER_VERSION_CHECK_INTERVAL seconds, so most accesses never leave the
+process. Without a shared cache there is nothing to look at and snapshots
+never expire.
+
+`Gazetteer.version` is derived from the content, so every worker holding
+the same data puts the same version into the ETags built on it.
+"""
+import json
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from apps.shared.conditional import strong_etag
+from apps.shared.models import District, Region
+from apps.shared.utils import get_logger
+
+logger = get_logger()
+
+GAZETTEER_VERSION_KEY = 'shared:gazetteer-version'
+
+
+@dataclass(frozen=True)
+class RegionEntry:
+    id: int
+    soato_id: int
+    name_uz: str
+    name_ru: str
+    name_en: str
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'soato_id': self.soato_id,
+            'name_uz': self.name_uz,
+            'name_ru': self.name_ru,
+            'name_en': self.name_en,
+        }
+
+
+@dataclass(frozen=True)
+class DistrictEntry:
+    id: int
+    soato_id: int
+    name_uz: str
+    name_ru: str
+    name_en: str
+    region_id: int
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'soato_id': self.soato_id,
+            'name_uz': self.name_uz,
+            'name_ru': self.name_ru,
+            'name_en': self.name_en,
+            'region': self.region_id,
+        }
+
+
+@dataclass(frozen=True)
+class RenderedBody:
+    body: bytes
+    etag: str
+
+
+class Gazetteer:
+    """Immutable snapshot of all regions and districts"""
+
+    def __init__(self, shared_version, regions, districts):
+        # the shared counter this snapshot was loaded at, None without a shared cache
+        self.shared_version = shared_version
+        self.regions = MappingProxyType({r.id: r for r in regions})
+        self.districts = MappingProxyType({d.id: d for d in districts})
+        self.regions_by_soato = MappingProxyType({r.soato_id: r for r in regions if r.soato_id is not None})
+        self.districts_by_soato = MappingProxyType({d.soato_id: d for d in districts if d.soato_id is not None})
+
+        by_region = {r.id: [] for r in regions}
+        for district in districts:
+            by_region.setdefault(district.region_id, []).append(district)
+        self.districts_by_region = MappingProxyType({k: tuple(v) for k, v in by_region.items()})
+
+        self.regions_body = render([r.as_dict() for r in regions])
+        self.districts_body = render([d.as_dict() for d in districts])
+        self.regions_with_districts_body = render([
+            # "disctricts" is the key the API has always used
+            {**r.as_dict(), 'disctricts': [d.as_dict() for d in self.districts_by_region[r.id]]}
+            for r in regions
+        ])
+        self.version = strong_etag(self.regions_body.body + self.districts_body.body).strip('"')
+
+    def region(self, region_id):
+        return self.regions.get(region_id)
+
+    def district(self, district_id):
+        return self.districts.get(district_id)
+
+
+def render(result):
+    """Same envelope and encoding as SuccessResponse / DRF's JSONRenderer"""
+    body = json.dumps({'success': True, 'result': result}, ensure_ascii=False, separators=(',', ':')).encode()
+    return RenderedBody(body=body, etag=strong_etag(body))
+
+
+_lock = threading.Lock()
+_snapshot = None
+# time.monotonic() of the last look at the shared version
+_checked_at = 0.0
+
+
+def get_gazetteer():
+    """Current snapshot, reloaded after a change here or a newer shared version"""
+    global _snapshot, _checked_at
+    snapshot = _snapshot
+    if snapshot is not None and not check_due():
+        return snapshot
+    version = _shared_version()
+    with _lock:
+        # a failed lookup keeps the snapshot rather than reloading on every access
+        if _snapshot is None or (version is not None and _snapshot.shared_version != version):
+            _snapshot = load(version)
+        _checked_at = time.monotonic()
+        return _snapshot
+
+
+def check_due():
+    """Whether to look at the shared version again, never without a shared cache"""
+    if not settings.CACHE_REDIS_URL:
+        return False
+    return time.monotonic() - _checked_at >= settings.GAZETTEER_VERSION_CHECK_INTERVAL
+
+
+def load(version):
+    regions = [
+        RegionEntry(**row)
+        for row in Region.objects.order_by('id').values('id', 'soato_id', 'name_uz', 'name_ru', 'name_en')
+    ]
+    districts = [
+        DistrictEntry(**row)
+        for row in District.objects.order_by('id').values('id', 'soato_id', 'name_uz', 'name_ru', 'name_en', 'region_id')
+    ]
+    return Gazetteer(version, regions, districts)
+
+
+def invalidate():
+    """Drop this worker's snapshot and tell the others once the change commits"""
+    global _snapshot
+    _snapshot = None
+    transaction.on_commit(_bump_shared_version)
+
+
+def _shared_version():
+    """The shared counter, None when there is no shared cache or it failed"""
+    if not settings.CACHE_REDIS_URL:
+        return None
+    try:
+        version = cache.get(GAZETTEER_VERSION_KEY)
+        if version is None:
+            cache.add(GAZETTEER_VERSION_KEY, time.time_ns(), timeout=None)
+            version = cache.get(GAZETTEER_VERSION_KEY)
+        return version
+    except Exception as e:
+        logger.error(f"Gazetteer version lookup failed: {str(e)}")
+        return None
+
+
+def _bump_shared_version():
+    global _snapshot
+    _snapshot = None
+    try:
+        cache.set(GAZETTEER_VERSION_KEY, time.time_ns(), timeout=None)
+    except Exception as e:
+        logger.error(f"Failed to bump gazetteer version: {str(e)}")
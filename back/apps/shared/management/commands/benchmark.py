@@ -0,0 +1,93 @@
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from apps.shared import benchmark
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / 'benchmarks' / 'baseline.json'
+
+# Seeding and the write endpoints bump cache versions, never touch the real cache
+LOCAL_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'}}
+
+
+class Command(BaseCommand):
+    help = 'Seed a throwaway test database and report p50/p95 latency and query counts for every API endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help='Users to seed (default: 200)')
+        parser.add_argument('--listings-per-user', type=int, default=5, help='Listings per user (default: 5)')
+        parser.add_argument('--images-per-listing', type=int, default=4, help='Images per listing (default: 4)')
+        parser.add_argument('--cards-per-user', type=int, default=2, help='Cards per user (default: 2)')
+        parser.add_argument('--transactions-per-user', type=int, default=20, help='Transactions per user (default: 20)')
+        parser.add_argument('--iterations', type=int, default=20, help='Measured requests per endpoint (default: 20)')
+        parser.add_argument('--warmup', type=int, default=2, help='Unmeasured requests per endpoint (default: 2)')
+        parser.add_argument('--only', nargs='+', default=None, help='Only run endpoints with these URL names')
+        parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE, help='Baseline file to compare with')
+        parser.add_argument('--save-baseline', action='store_true', help='Write the results to the baseline file')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed p95 growth against the baseline (default: 0.2)')
+        parser.add_argument('--fail-on-regression', action='store_true', help='Exit with an error on regressions or exceeded query budgets')
+        parser.add_argument('--keepdb', action='store_true', help='Keep the benchmark database between runs')
+
+    def handle(self, *args, **options):
+        config = benchmark.SeedConfig(
+            users=options['users'],
+            listings_per_user=options['listings_per_user'],
+            images_per_listing=options['images_per_listing'],
+            cards_per_user=options['cards_per_user'],
+            transactions_per_user=options['transactions_per_user'],
+        )
+        endpoints = benchmark.ENDPOINTS
+        if options['only']:
+            endpoints = [endpoint for endpoint in endpoints if endpoint.name in options['only']]
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'], serialize=False)
+        try:
+            with tempfile.TemporaryDirectory(prefix='kvarthub-staging-') as staging, \
+                    override_settings(CACHES=LOCAL_CACHES, UPLOAD_STAGING_ROOT=staging):
+                self.stdout.write(self.style.NOTICE(f'Seeding benchmark database ({connection.vendor})'))
+                ctx = benchmark.seed(config, stdout=self.stdout)
+                results = benchmark.run(endpoints, ctx, iterations=options['iterations'], warmup=options['warmup'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        self.report(results)
+        for name in benchmark.uncovered_url_names():
+            self.stdout.write(self.style.WARNING(f'Not benchmarked: {name}'))
+        for name, reason in benchmark.SKIPPED.items():
+            self.stdout.write(f'Skipped {name}: {reason}')
+
+        regressions = [result.label for result in results if result.over_budget]
+        if options['baseline'].exists():
+            comparisons = benchmark.compare(results, benchmark.load_baseline(options['baseline']), options['tolerance'])
+            self.report_comparison(comparisons)
+            regressions += [c.label for c in comparisons if c.regressions]
+        else:
+            self.stdout.write(f'No baseline at {options["baseline"]}')
+
+        if options['save_baseline']:
+            benchmark.save_baseline(options['baseline'], results, config)
+            self.stdout.write(self.style.SUCCESS(f'Baseline written to {options["baseline"]}'))
+
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f'Performance regressions: {", ".join(sorted(set(regressions)))}')
+
+    def report(self, results):
+        self.stdout.write(f'\n{"endpoint":<58} {"method":<7} {"status":>6} {"p50 ms":>9} {"p95 ms":>9} {"queries":>8} {"budget":>7}')
+        for result in results:
+            line = (
+                f'{result.label:<58} {result.method:<7} {result.status:>6} {result.p50_ms:>9.2f} '
+                f'{result.p95_ms:>9.2f} {result.queries:>8} {"" if result.query_budget is None else result.query_budget:>7}'
+            )
+            self.stdout.write(self.style.ERROR(line) if result.over_budget else line)
+
+    def report_comparison(self, comparisons):
+        self.stdout.write(f'\n{"endpoint":<58} {"p95 ms":>9} {"baseline":>9} {"queries":>8} {"baseline":>9}')
+        for c in comparisons:
+            line = f'{c.label:<58} {c.p95_ms:>9.2f} {c.baseline_p95_ms:>9.2f} {c.queries:>8} {c.baseline_queries:>9}'
+            self.stdout.write(self.style.ERROR(f'{line}  {", ".join(c.regressions)}') if c.regressions else line)
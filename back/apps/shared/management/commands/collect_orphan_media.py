@@ -0,0 +1,229 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import models
+from django.db.models import Q
+
+from apps.listings.images import VARIANTS_DIR
+from apps.listings.models import LISTING_IMAGES_DIR, ListingImage
+
+QUARANTINE_DIR = '.quarantine'
+
+
+def scan(root, directory=''):
+    """Yield (relative name, DirEntry) of every file below `directory`, skipping dot entries"""
+    try:
+        entries = os.scandir(os.path.join(root, directory))
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            name = f'{directory}/{entry.name}' if directory else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                yield from scan(root, name)
+            elif entry.is_file(follow_symlinks=False):
+                yield name, entry
+
+
+def file_fields():
+    """(model, field name) of every FileField/ImageField in the project"""
+    for model in apps.get_models():
+        for field in model._meta.concrete_fields:
+            if isinstance(field, models.FileField):
+                yield model, field.name
+
+
+def referenced_names(chunk_size):
+    """Every media name the database points at, read in chunks"""
+    names = set()
+    for model, field in file_fields():
+        queryset = model._default_manager.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+        names.update(queryset.values_list(field, flat=True).iterator(chunk_size=chunk_size))
+    variants = ListingImage.objects.exclude(variants={}).values_list('variants', flat=True)
+    for formats in variants.iterator(chunk_size=chunk_size):
+        for paths in formats.values():
+            names.update(paths.values())
+    return names
+
+
+def variant_owner_prefixes(name):
+    """
+    Name prefixes of the originals the variant file `name` can belong to:
+    variants are named `<stem>-<variant>.<fmt>` and sharded like their
+    original (see apps.listings.images), or the original is still flat.
+    """
+    directory, filename = os.path.split(name)
+    stem = filename.rsplit('-', 1)[0]
+    shard = os.path.relpath(directory, VARIANTS_DIR)
+    return [f'{LISTING_IMAGES_DIR}/{shard}/{stem}.', f'{LISTING_IMAGES_DIR}/{stem}.']
+
+
+def still_referenced(names):
+    """Subset of `names` referenced by a file field or a variants map right now, for rows written since the mark phase"""
+    found = set()
+    for model, field in file_fields():
+        found.update(model._default_manager.filter(**{f'{field}__in': names}).values_list(field, flat=True))
+
+    variant_names = {name for name in names if name.startswith(f'{VARIANTS_DIR}/')}
+    if variant_names:
+        # only the originals of these variants, through the index on `image`
+        owners = Q()
+        for name in variant_names:
+            for prefix in variant_owner_prefixes(name):
+                owners |= Q(image__startswith=prefix)
+        for formats in ListingImage.objects.filter(owners).exclude(variants={}).values_list('variants', flat=True):
+            for paths in formats.values():
+                found.update(variant_names.intersection(paths.values()))
+    return found
+
+
+class Command(BaseCommand):
+    help = 'Delete (or quarantine) media files no database row references any more'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-hours',
+            type=float,
+            default=settings.MEDIA_ORPHAN_GRACE_HOURS,
+            help=f'Only collect files older than this (default: {settings.MEDIA_ORPHAN_GRACE_HOURS})',
+        )
+        parser.add_argument(
+            '--quarantine',
+            action='store_true',
+            help=f'Move orphans to MEDIA_ROOT/{QUARANTINE_DIR}/ instead of deleting them',
+        )
+        parser.add_argument(
+            '--purge-quarantine-days',
+            type=float,
+            default=None,
+            help='Also delete quarantined files older than this many days',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=8,
+            help='Threads deleting files (default: 8)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Orphans re-checked and removed per batch, also the DB chunk size (default: 1000)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report orphans without touching them',
+        )
+
+    def handle(self, *args, **options):
+        self.root = str(settings.MEDIA_ROOT)
+        self.dry_run = options['dry_run']
+        self.quarantine = options['quarantine']
+        batch_size = options['batch_size']
+        # files written once the mark phase started may belong to rows it
+        # did not see, they are never collected whatever the grace period
+        marked_at = time.time()
+        cutoff = self.cutoff = marked_at - max(options['grace_hours'], 0) * 3600
+
+        # mark
+        referenced = referenced_names(batch_size)
+        self.stdout.write(f'{len(referenced)} referenced files')
+
+        # sweep, the walk goes on while the pool removes earlier batches
+        self.scanned = self.orphans = self.removed = self.freed = 0
+        self.pending = []
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            batch = []
+            for directory in settings.MEDIA_ORPHAN_DIRS:
+                for name, entry in scan(self.root, directory):
+                    self.scanned += 1
+                    if self.scanned % 10000 == 0:
+                        self.progress()
+                    if name in referenced:
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                    if stat.st_mtime > cutoff:
+                        continue
+                    batch.append((name, stat.st_size))
+                    if len(batch) == batch_size:
+                        self.sweep(pool, batch)
+                        batch = []
+            if batch:
+                self.sweep(pool, batch)
+            self.collect()
+
+        if options['purge_quarantine_days'] is not None:
+            self.purge_quarantine(time.time() - options['purge_quarantine_days'] * 86400)
+
+        action = 'would remove' if self.dry_run else 'quarantined' if self.quarantine else 'removed'
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully scanned {self.scanned} files, {action} {self.removed} orphans '
+            f'({self.freed / (1024 * 1024):.1f} MB)'
+        ))
+
+    def progress(self):
+        self.stdout.write(f'Scanned {self.scanned}, orphans {self.orphans}, removed {self.removed}')
+
+    def sweep(self, pool, batch):
+        # rows may have started pointing at a file since the mark phase
+        # (content addressing reuses existing files), never remove those
+        alive = still_referenced([name for name, _ in batch])
+        batch = [(name, size) for name, size in batch if name not in alive]
+        self.orphans += len(batch)
+        if self.dry_run:
+            for name, size in batch:
+                self.stdout.write(f'Orphan: {name} ({size} bytes)')
+            self.removed += len(batch)
+            self.freed += sum(size for _, size in batch)
+            return
+        # one batch stays in flight while the walk looks for the next
+        self.collect()
+        self.pending = [(size, pool.submit(self.remove, name)) for name, size in batch]
+
+    def collect(self):
+        for size, future in self.pending:
+            if future.result():
+                self.removed += 1
+                self.freed += size
+        self.pending = []
+        self.progress()
+
+    def remove(self, name):
+        path = os.path.join(self.root, name)
+        try:
+            if os.stat(path, follow_symlinks=False).st_mtime > self.cutoff:
+                # reused since the walk, see apps.listings.images.reuse_file
+                return False
+            if self.quarantine:
+                target = os.path.join(self.root, QUARANTINE_DIR, name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(path, target)
+                # quarantine age counts from now, not from the upload
+                os.utime(target)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            self.stderr.write(f'Could not remove {name}: {str(e)}')
+            return False
+        return True
+
+    def purge_quarantine(self, cutoff):
+        quarantine = os.path.join(self.root, QUARANTINE_DIR)
+        purged = 0
+        for name, entry in scan(quarantine):
+            if entry.stat(follow_symlinks=False).st_mtime <= cutoff:
+                if self.dry_run:
+                    self.stdout.write(f'Quarantined: {name}')
+                else:
+                    os.remove(entry.path)
+                purged += 1
+        self.stdout.write(f'{"Would purge" if self.dry_run else "Purged"} {purged} quarantined files')
@@ -0,0 +1,139 @@
+"""
+Serving MEDIA_URL without streaming files through the Python workers.
+
+Django resolves and checks the requested file, then, depending on
+MEDIA_SERVE_MODE, hands the transfer off to the web server:
+
+    accel     nginx, `X-Accel-Redirect: <MEDIA_ACCEL_PREFIX><path>`
+    sendfile  Apache mod_xsendfile / lighttpd, `X-Sendfile: <absolute path>`
+    django    the file is streamed by Django itself (development only)
+
+nginx needs an internal location for the prefix, e.g.
+
+    location /protected-media/ {
+        internal;
+        alias /srv/kvarthub/back/media/;
+    }
+
+The web server answers Range requests for the handed-off file itself; the
+django mode answers single-range requests as well. Content-hashed files
+(`<sha256>.<ext>` photos and their `<sha256>-<variant>.<ext>` variants)
+never change under their name and are sent as immutable.
+"""
+import mimetypes
+import os
+import re
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+from apps.shared.conditional import not_modified, set_validators
+
+CONTENT_HASHED = re.compile(r'^[0-9a-f]{64}(-[\w]+)?\.\w+$')
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def media_cache_control(name):
+    if CONTENT_HASHED.match(os.path.basename(name)):
+        return f'public, max-age={settings.MEDIA_IMMUTABLE_MAX_AGE}, immutable'
+    return f'public, max-age={settings.MEDIA_MAX_AGE}'
+
+
+def resolve_media(path):
+    """Absolute path of a servable media file, Http404 otherwise"""
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+    except (SuspiciousFileOperation, ValueError):
+        raise Http404('Not found')
+    # no dotfiles or dot-directories (.quarantine, .staging, ...)
+    if any(part.startswith('.') for part in path.split('/')) or not os.path.isfile(fullpath):
+        raise Http404('Not found')
+    return fullpath
+
+
+def byte_range(header, size):
+    """(start, end) of a single `bytes=` range, None to send the whole file, False when unsatisfiable"""
+    match = RANGE.match(header.strip())
+    if not match or not any(match.groups()):
+        # malformed or multiple ranges, the full response is also a valid answer
+        return None
+    first, last = match.groups()
+    if not first:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def stream_file(request, fullpath, stat, content_type, ranged=True):
+    """Django-side transfer, with single-range support"""
+    size = stat.st_size
+    requested = None
+    if ranged and 'HTTP_RANGE' in request.META:
+        requested = byte_range(request.META['HTTP_RANGE'], size)
+    if requested is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    fh = open(fullpath, 'rb')
+    if requested is None:
+        response = FileResponse(fh, content_type=content_type)
+        response['Content-Length'] = size
+        return response
+    start, end = requested
+    fh.seek(start)
+    response = FileResponse(_limited(fh, end - start + 1), content_type=content_type, status=206)
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = end - start + 1
+    return response
+
+
+def _limited(fh, length, block_size=64 * 1024):
+    try:
+        while length > 0:
+            chunk = fh.read(min(block_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        fh.close()
+
+
+@require_safe
+def serve_media(request, path):
+    fullpath = resolve_media(path)
+    stat = os.stat(fullpath)
+    etag = f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+    last_modified = datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
+    cache_control = media_cache_control(path)
+
+    response = not_modified(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        response['Cache-Control'] = cache_control
+        return response
+
+    content_type = mimetypes.guess_type(fullpath)[0] or 'application/octet-stream'
+    mode = settings.MEDIA_SERVE_MODE
+    if mode == 'accel':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = f'{settings.MEDIA_ACCEL_PREFIX}{quote(path)}'
+    elif mode == 'sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = fullpath
+    else:
+        # a stale If-Range asks for the whole file instead of the range
+        if_range = request.META.get('HTTP_IF_RANGE')
+        ranged = if_range is None or if_range in (etag, http_date(stat.st_mtime))
+        response = stream_file(request, fullpath, stat, content_type, ranged)
+    response['Accept-Ranges'] = 'bytes'
+    response['Cache-Control'] = cache_control
+    return set_validators(response, etag=etag, last_modified=last_modified)
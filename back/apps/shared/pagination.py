@@ -1,5 +1,13 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date, datetime
+from decimal import Decimal
+
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import replace_query_param
 from django.core.paginator import EmptyPage
+from django.db.models import Q
 # from apps.shared.utils.utils import SuccessResponse
 
 
@@ -23,3 +31,173 @@ class CustomPageNumberPagination(PageNumberPagination):
             'previous': self.get_previous_link() if self.page else None,
             'results': data
         }
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a composite (field, id) key.
+
+    Every ordering is a pair of fields where the last one is unique, so the
+    position of a row never depends on rows inserted before or after it and
+    no OFFSET / COUNT(*) is needed. Cursors are opaque base64 tokens that
+    carry the ordering name, the key of the boundary row and the direction.
+
+    `total_count` is only computed when the client asks for it with
+    `?with_count=1`.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    count_query_param = 'with_count'
+    invalid_cursor_message = 'Invalid cursor'
+
+    # name -> (field, unique tie-breaker); prefix with '-' for descending
+    orderings = {
+        'newest': ('-created_at', '-id'),
+    }
+    default_ordering = 'newest'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering_name = self.get_ordering_name(request, view)
+        self.ordering = self.orderings[self.ordering_name]
+
+        cursor = self.decode_cursor(request)
+        self.reverse = bool(cursor and cursor['r'])
+
+        order_by = self.ordering
+        if self.reverse:
+            order_by = tuple(self._invert(field) for field in order_by)
+        queryset = queryset.order_by(*order_by)
+        self.total_count = queryset.count() if self.with_count(request) else None
+        if cursor:
+            queryset = queryset.filter(self._after(order_by, cursor['v']))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.reverse:
+            rows.reverse()
+
+        # A cursor always means we came from a neighbouring page.
+        self.has_next = has_more if not self.reverse else True
+        self.has_previous = bool(cursor) if not self.reverse else has_more
+        self.page = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        response = {
+            'count': len(data),
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+        if self.total_count is not None:
+            response['total_count'] = self.total_count
+        return response
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_ordering_name(self, request, view=None):
+        name = request.query_params.get(self.ordering_query_param)
+        if name in self.orderings:
+            return name
+        return self.default_ordering
+
+    def with_count(self, request):
+        return request.query_params.get(self.count_query_param) in ('1', 'true', 'True')
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def encode_cursor(self, row, reverse):
+        values = [self._key_value(row, field.lstrip('-')) for field in self.ordering]
+        payload = json.dumps({'o': self.ordering_name, 'v': values, 'r': int(reverse)}, separators=(',', ':'))
+        token = urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            payload = json.loads(urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+            values = payload['v']
+            if payload['o'] != self.ordering_name or len(values) != len(self.ordering):
+                raise ValueError
+            return {'v': values, 'r': bool(payload.get('r'))}
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Opaque cursor returned in `next` / `previous`.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': f'Number of results per page (max {self.max_page_size}).',
+                'schema': {'type': 'integer'},
+            },
+            {
+                'name': self.ordering_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Result ordering.',
+                'schema': {'type': 'string', 'enum': list(self.orderings)},
+            },
+            {
+                'name': self.count_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Set to 1 to include `total_count` (runs a COUNT query).',
+                'schema': {'type': 'boolean'},
+            },
+        ]
+
+    @staticmethod
+    def _invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def _after(order_by, values):
+        """Rows strictly after `values` in `order_by` order (row-value comparison)."""
+        (first, last), (first_value, last_value) = order_by, values
+        first_lookup = 'lt' if first.startswith('-') else 'gt'
+        last_lookup = 'lt' if last.startswith('-') else 'gt'
+        first, last = first.lstrip('-'), last.lstrip('-')
+        return (
+            Q(**{f'{first}__{first_lookup}': first_value})
+            | Q(**{first: first_value, f'{last}__{last_lookup}': last_value})
+        )
+
+    @staticmethod
+    def _key_value(row, field):
+        value = row[field] if isinstance(row, dict) else getattr(row, field)
+        if isinstance(value, (date, datetime)):
+            return value.isoformat()
+        if isinstance(value, Decimal):
+            return str(value)
+        return value
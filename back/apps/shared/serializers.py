@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from apps.shared.models import Region, District
+from apps.shared.gazetteer import get_gazetteer
 
 
 class DistrictSerializer(serializers.ModelSerializer):  
@@ -15,8 +16,8 @@ class RegionDistrictSerializer(serializers.ModelSerializer):
         fields = ['id', 'soato_id', 'name_uz', 'name_ru', 'name_en', 'disctricts']
     
     def get_disctricts(self, obj):
-        districts = District.objects.filter(region=obj)
-        return DistrictSerializer(districts, many=True).data
+        districts = get_gazetteer().districts_by_region.get(obj.id, ())
+        return [district.as_dict() for district in districts]
 
 class RegionSerializer(serializers.ModelSerializer):
     class Meta:
@@ -0,0 +1,13 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from apps.shared import gazetteer
+from apps.shared.models import District, Region
+
+
+@receiver(post_save, sender=Region)
+@receiver(post_delete, sender=Region)
+@receiver(post_save, sender=District)
+@receiver(post_delete, sender=District)
+def invalidate_gazetteer(sender, **kwargs):
+    gazetteer.invalidate()
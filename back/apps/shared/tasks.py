@@ -0,0 +1,18 @@
+from celery import shared_task
+from django.core.management import call_command
+from apps.shared.utils import get_logger
+
+logger = get_logger()
+
+
+@shared_task
+def collect_orphan_media_task():
+    logger.info("Starting orphan media collection task")
+
+    try:
+        # quarantined for a week before they are gone for good
+        call_command('collect_orphan_media', quarantine=True, purge_quarantine_days=7)
+        logger.info("Orphan media collection task completed successfully")
+    except Exception as e:
+        logger.error(f"Error in orphan media collection task: {str(e)}")
+        raise
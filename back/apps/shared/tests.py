@@ -1,3 +1,234 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+import time
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from apps.listings.models import Listing, ListingImage
+from apps.shared import benchmark, gazetteer
+from apps.shared.models import Region
+from apps.users.models import User
+
+DUMMY_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+LOCAL_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shared-tests'}}
+
+
+@override_settings(CACHES=DUMMY_CACHE, UPLOAD_STAGING_ROOT=tempfile.mkdtemp(prefix='kvarthub-staging-'))
+class EndpointQueryBudgetTests(TestCase):
+    """SQL query counts of every endpoint, with the response caches off, stay within budget"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ctx = benchmark.seed(benchmark.SeedConfig(
+            users=5, listings_per_user=4, images_per_listing=2, cards_per_user=2, transactions_per_user=3,
+        ))
+
+    def test_every_app_url_is_benchmarked(self):
+        self.assertEqual(benchmark.uncovered_url_names(), [])
+
+    def test_query_budgets(self):
+        results = benchmark.run(benchmark.ENDPOINTS, self.ctx, iterations=1, warmup=1)
+        for result in results:
+            with self.subTest(endpoint=result.label):
+                self.assertFalse(result.over_budget, f'{result.queries} queries, budget {result.query_budget}')
+
+
+HASHED_NAME = 'listing/images/ab/cd/' + 'abcd' * 16 + '.jpg'
+PLAIN_NAME = 'facility/icons/wifi.png'
+
+
+class MediaServingTests(SimpleTestCase):
+    """MEDIA_URL responses: validators, ranges, cache lifetimes and the web server hand-off"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp(prefix='kvarthub-media-')
+        cls.addClassCleanup(shutil.rmtree, cls.media_root, ignore_errors=True)
+        for name in (HASHED_NAME, PLAIN_NAME, '.quarantine/old.jpg'):
+            path = os.path.join(cls.media_root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as fh:
+                fh.write(bytes(range(100)))
+
+    def get(self, name, mode='django', **headers):
+        with self.settings(MEDIA_ROOT=self.media_root, MEDIA_SERVE_MODE=mode):
+            return self.client.get(f'/media/{name}', **headers)
+
+    def test_hashed_files_are_immutable(self):
+        response = self.get(HASHED_NAME)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(100)))
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        plain = self.get(PLAIN_NAME)
+        self.assertNotIn('immutable', plain['Cache-Control'])
+
+    def test_revalidation(self):
+        etag = self.get(HASHED_NAME)['ETag']
+        response = self.get(HASHED_NAME, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_ranges(self):
+        response = self.get(HASHED_NAME, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(10, 20)))
+
+        response = self.get(HASHED_NAME, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(95, 100)))
+
+        response = self.get(HASHED_NAME, HTTP_RANGE='bytes=100-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */100')
+
+        # a range of an older version of the file sends the whole current one
+        response = self.get(HASHED_NAME, HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_web_server_hand_off(self):
+        response = self.get(HASHED_NAME, mode='accel', HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{HASHED_NAME}')
+        self.assertEqual(response.content, b'')
+
+        response = self.get(HASHED_NAME, mode='sendfile')
+        self.assertEqual(response['X-Sendfile'], os.path.join(self.media_root, HASHED_NAME))
+
+    def test_hidden_and_missing_files(self):
+        for name in ('.quarantine/old.jpg', 'listing/missing.jpg', '../secret'):
+            with self.subTest(name=name):
+                self.assertEqual(self.get(name).status_code, 404)
+
+
+@override_settings(CACHES=LOCAL_CACHE, CACHE_REDIS_URL='')
+class GazetteerTests(TestCase):
+    """The snapshot is only reloaded for Region / District changes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.region = Region.objects.create(name_uz='Toshkent', soato_id=1726)
+
+    def setUp(self):
+        cache.clear()
+        gazetteer._snapshot = None
+        self.addCleanup(setattr, gazetteer, '_snapshot', None)
+
+    def test_without_a_shared_cache_only_local_changes_reload(self):
+        snapshot = gazetteer.get_gazetteer()
+        with self.assertNumQueries(0), mock.patch('apps.shared.gazetteer.time.monotonic', return_value=10 ** 9):
+            # no expiry, however old the snapshot
+            self.assertIs(gazetteer.get_gazetteer(), snapshot)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Region.objects.create(name_uz='Samarqand', soato_id=1718)
+        reloaded = gazetteer.get_gazetteer()
+        self.assertEqual(len(reloaded.regions), 2)
+        self.assertNotEqual(reloaded.version, snapshot.version)
+
+    @override_settings(CACHE_REDIS_URL='redis://shared', GAZETTEER_VERSION_CHECK_INTERVAL=60)
+    def test_other_workers_changes_are_seen_after_the_check_interval(self):
+        snapshot = gazetteer.get_gazetteer()
+        # another worker renames the region and bumps the shared version
+        Region.objects.filter(pk=self.region.pk).update(name_uz='Tashkent')
+        gazetteer._bump_shared_version()
+        gazetteer._snapshot = snapshot
+
+        with self.assertNumQueries(0):
+            self.assertIs(gazetteer.get_gazetteer(), snapshot)
+        with mock.patch('apps.shared.gazetteer.time.monotonic', return_value=gazetteer._checked_at + 61):
+            reloaded = gazetteer.get_gazetteer()
+        self.assertEqual(reloaded.region(self.region.pk).name_uz, 'Tashkent')
+
+
+class CollectOrphanMediaTests(TestCase):
+    """Mark and sweep of media files no row references"""
+    ORIGINAL = 'listing/images/ab/cd/' + 'abcd' * 16 + '.jpg'
+    VARIANT = 'listing/images/variants/ab/cd/' + 'abcd' * 16 + '-thumb.webp'
+    ORPHAN = 'listing/images/12/34/' + '1234' * 16 + '.jpg'
+    ORPHAN_VARIANT = 'listing/images/variants/12/34/' + '1234' * 16 + '-thumb.webp'
+    YOUNG = 'listing/images/56/78/' + '5678' * 16 + '.jpg'
+    # outside MEDIA_ORPHAN_DIRS, and a dot directory
+    ELSEWHERE = 'avatars/old.jpg'
+    HIDDEN = 'listing/.cache/old.jpg'
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp(prefix='kvarthub-media-')
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        old = time.time() - 3 * 86400
+        for name in (self.ORIGINAL, self.VARIANT, self.ORPHAN, self.ORPHAN_VARIANT, self.YOUNG, self.ELSEWHERE, self.HIDDEN):
+            path = self.path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as fh:
+                fh.write(bytes(100))
+            if name != self.YOUNG:
+                os.utime(path, (old, old))
+
+        host = User.objects.create(email='host@example.com', username='host')
+        listing = Listing.objects.create(
+            title='Listing', description='', price=Decimal('1000000'), host=host, location='Toshkent',
+        )
+        # bulk_create skips the upload signals, the files are already in place
+        ListingImage.objects.bulk_create([
+            ListingImage(listing=listing, image=self.ORIGINAL, variants={'thumb': {'webp': self.VARIANT}}),
+        ])
+
+    def path(self, name):
+        return os.path.join(self.media_root, name)
+
+    def collect(self, *args):
+        out = StringIO()
+        call_command('collect_orphan_media', *args, stdout=out)
+        return out.getvalue()
+
+    def remaining(self):
+        return {
+            name for name in (self.ORIGINAL, self.VARIANT, self.ORPHAN, self.ORPHAN_VARIANT, self.YOUNG, self.ELSEWHERE, self.HIDDEN)
+            if os.path.exists(self.path(name))
+        }
+
+    def test_dry_run_removes_nothing(self):
+        out = self.collect('--dry-run')
+        self.assertIn(f'Orphan: {self.ORPHAN} (100 bytes)', out)
+        self.assertIn(f'Orphan: {self.ORPHAN_VARIANT} (100 bytes)', out)
+        self.assertIn('would remove 2 orphans', out)
+        self.assertEqual(len(self.remaining()), 7)
+
+    def test_removes_old_orphans_only(self):
+        self.assertIn('removed 2 orphans', self.collect())
+        self.assertEqual(self.remaining(), {self.ORIGINAL, self.VARIANT, self.YOUNG, self.ELSEWHERE, self.HIDDEN})
+
+        # a shorter grace period takes the young file too
+        self.assertIn('removed 1 orphans', self.collect('--grace-hours', '0'))
+        self.assertNotIn(self.YOUNG, self.remaining())
+
+    def test_rows_written_after_the_mark_keep_their_files(self):
+        # the mark saw no rows at all, the sweep re-checks each batch
+        with mock.patch('apps.shared.management.commands.collect_orphan_media.referenced_names', return_value=set()):
+            self.assertIn('removed 2 orphans', self.collect())
+        self.assertTrue({self.ORIGINAL, self.VARIANT} <= self.remaining())
+
+    def test_quarantine(self):
+        self.assertIn('quarantined 2 orphans', self.collect('--quarantine'))
+        self.assertNotIn(self.ORPHAN, self.remaining())
+        quarantined = self.path(os.path.join('.quarantine', self.ORPHAN))
+        self.assertTrue(os.path.exists(quarantined))
+
+        # quarantine age counts from the move
+        self.assertIn('Purged 0 quarantined files', self.collect('--purge-quarantine-days', '1'))
+        old = time.time() - 2 * 86400
+        os.utime(quarantined, (old, old))
+        self.assertIn('Purged 1 quarantined files', self.collect('--purge-quarantine-days', '1'))
+        self.assertFalse(os.path.exists(quarantined))
@@ -207,9 +207,13 @@ def detect_nsfw(image_file):
     
     # Properly format the file for requests library
     # requests expects: {'file': (filename, file_object, content_type)}
-    files = {'media': (image_file.name, image_file.read(), image_file.content_type)}
+    # Pass the file object itself so requests reads it from the (temporary)
+    # file instead of an extra in-memory copy.
+    image_file.seek(0)
+    files = {'media': (image_file.name, image_file, image_file.content_type)}
     
     r = requests.post('https://api.sightengine.com/1.0/check-workflow.json', files=files, data=params)
+    image_file.seek(0)
     logger.info(r.text)
     output = json.loads(r.text)
 
@@ -2,10 +2,16 @@ from drf_spectacular.utils import extend_schema_view, extend_schema
 from rest_framework.response import Response
 from rest_framework import generics, permissions
 
+from apps.shared import gazetteer
+from apps.shared.conditional import conditional_bytes_response
 from apps.shared.models import District, Region
 from .utils import SuccessResponse
 from apps.shared.serializers import RegionDistrictSerializer, DistrictSerializer, RegionSerializer
 
+
+# The endpoints below serve JSON pre-rendered by the in-process gazetteer
+# (apps.shared.gazetteer) with a strong ETag; a matching If-None-Match gets a 304.
+
 @extend_schema(
     summary="Shared API View for Regions and Districts",
     description="This is an API view to retrieve shared data like regions and districts.",
@@ -15,11 +21,8 @@ class SharedView(generics.ListAPIView):
     serializer_class = RegionDistrictSerializer
 
     def get(self, request, *args, **kwargs):
-
-        serializer = self.get_serializer(Region.objects.all(), many=True)
-        return SuccessResponse(
-            result=serializer.data
-        )
+        rendered = gazetteer.get_gazetteer().regions_with_districts_body
+        return conditional_bytes_response(request, rendered.body, etag=rendered.etag)
 
 
 @extend_schema_view(
@@ -34,10 +37,8 @@ class RegionsListView(generics.ListAPIView):
     queryset = Region.objects.all()
 
     def get(self, request, *args, **kwargs):
-        serializer = self.get_serializer(self.get_queryset(), many=True)
-        return SuccessResponse(
-            result=serializer.data
-        )
+        rendered = gazetteer.get_gazetteer().regions_body
+        return conditional_bytes_response(request, rendered.body, etag=rendered.etag)
     
 
 @extend_schema_view(
@@ -52,7 +53,5 @@ class DistrictsListView(generics.ListAPIView):
     queryset = District.objects.all()
 
     def get(self, request, *args, **kwargs):
-        serializer = self.get_serializer(self.get_queryset(), many=True)
-        return SuccessResponse(
-            result=serializer.data
-        )
\ No newline at end of file
+        rendered = gazetteer.get_gazetteer().districts_body
+        return conditional_bytes_response(request, rendered.body, etag=rendered.etag)
@@ -10,7 +10,7 @@ from .managers import MyUserManager
 
 class BaseModel(models.Model):
     created_at = models.DateField(auto_now_add=True,null=True)
-    updated_at = models.DateField(auto_now=True,null=True)
+    updated_at = models.DateTimeField(auto_now=True,null=True)
 
     class Meta:
         abstract = True
@@ -18,7 +18,7 @@ class Settings(BaseSettings):
     
     # django
     SECRET_KEY: str
-    DEBUG: str
+    DEBUG: bool
 
     ALLOWED_HOSTS: list[str] = Field(default_factory=list)
     
@@ -52,6 +52,16 @@ class Settings(BaseSettings):
     CLIENT_ID: str = 'None'
     CLIENT_SECRET: str = 'None'
 
+    # cache
+    CACHE_REDIS_URL: str = ''
+
+    # celery, run tasks inline (local development without a worker)
+    CELERY_TASK_ALWAYS_EAGER: bool = False
+
+    # media, how MEDIA_URL is handed to the web server: accel, sendfile or
+    # django (DEBUG only); defaults to django with DEBUG, accel otherwise
+    MEDIA_SERVE_MODE: str = ''
+
 
     class Config:
         env_file = ".env"
@@ -22,6 +22,22 @@ app.conf.beat_schedule = {
         'task': 'apps.payment.tasks.charge_daily_listings_task',
         'schedule': crontab(hour=0, minute=1),
     },
+    'compact-ledger': {
+        'task': 'apps.payment.tasks.compact_ledger_task',
+        'schedule': crontab(hour=2, minute=0),
+    },
+    'rollup-transactions': {
+        'task': 'apps.payment.tasks.rollup_transactions_task',
+        'schedule': crontab(hour=1, minute=30),
+    },
+    'purge-upload-sessions': {
+        'task': 'apps.listings.tasks.purge_upload_sessions',
+        'schedule': crontab(minute=15),
+    },
+    'collect-orphan-media': {
+        'task': 'apps.shared.tasks.collect_orphan_media_task',
+        'schedule': crontab(hour=3, minute=30, day_of_week='sun'),
+    },
 }
 
 app.conf.timezone = 'UTC'
@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+from decimal import Decimal
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 from config.config import settings
@@ -71,6 +74,7 @@ LIBS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 ]
 
 INSTALLED_APPS = LIBS + OUT + APPS
@@ -242,6 +246,22 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Django only checks media requests and leaves the transfer to the web
+# server (accel: nginx X-Accel-Redirect, sendfile: X-Sendfile), see apps.shared.media.
+# Streaming through Django ties up a worker per download, development only.
+MEDIA_SERVE_MODE = settings.MEDIA_SERVE_MODE or ('django' if DEBUG else 'accel')
+if MEDIA_SERVE_MODE not in ('accel', 'sendfile', 'django'):
+    raise ImproperlyConfigured(f'Unknown MEDIA_SERVE_MODE: {MEDIA_SERVE_MODE!r}')
+if MEDIA_SERVE_MODE == 'django' and not DEBUG:
+    raise ImproperlyConfigured("MEDIA_SERVE_MODE 'django' is only allowed with DEBUG")
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+# content-hashed files never change, everything else is revalidated hourly
+MEDIA_IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+MEDIA_MAX_AGE = 60 * 60
+# collect_orphan_media sweeps these MEDIA_ROOT directories, sparing files
+# younger than the grace period (uploads whose rows are not committed yet)
+MEDIA_ORPHAN_DIRS = ['listing', 'facility']
+MEDIA_ORPHAN_GRACE_HOURS = 24
 
 AUTH_USER_MODEL = 'users.User'
 
@@ -274,11 +294,74 @@ CORS_ALLOW_HEADERS = [
 ]
 
 # Payment Settings
-LISTING_CREATION_CHARGE = 50.00
-DAILY_LISTING_CHARGE = 10.00
-CARD_CREATED_INITIAL_BALANCE = 5000.00
-LISTING_ACTIVATION_CHARGE = 5.00
-CARD_INITIAL_BALANCE = 5000.00
+LISTING_CREATION_CHARGE = Decimal('50.00')
+DAILY_LISTING_CHARGE = Decimal('10.00')
+CARD_CREATED_INITIAL_BALANCE = Decimal('5000.00')
+LISTING_ACTIVATION_CHARGE = Decimal('5.00')
+CARD_INITIAL_BALANCE = Decimal('5000.00')
+# The nightly run is split into shards of this many hosts, billed in parallel
+DAILY_BILLING_SHARD_SIZE = 2000
+# Hosts per transaction inside a shard
+DAILY_BILLING_BATCH_SIZE = 500
+# A crashed run stops blocking the next one after this many seconds
+DAILY_BILLING_LOCK_TIMEOUT = 3 * 60 * 60
+# Ledger snapshots only cover transactions at least this old
+LEDGER_SNAPSHOT_LAG = timedelta(minutes=10)
+
+# Cache
+# Redis when CACHE_REDIS_URL is set, otherwise a per-process local-memory cache
+CACHE_REDIS_URL = settings.CACHE_REDIS_URL
+
+if CACHE_REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+            'KEY_PREFIX': 'kvarthub',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'kvarthub',
+        }
+    }
+
+# Feed and facet responses are cached in the default cache, keyed on the
+# catalogue version kept in the same cache. With the local-memory fallback a
+# write only bumps the version of the worker that handled it, so pages are
+# kept for a shorter time there.
+LISTINGS_FEED_CACHE = True
+LISTINGS_FEED_CACHE_TIMEOUT = 60 * 5 if CACHE_REDIS_URL else 30
+
+# With a shared cache, workers look for regions / districts changes made by
+# other workers at most this often, in seconds (see apps.shared.gazetteer)
+GAZETTEER_VERSION_CHECK_INTERVAL = 5
+
+# Upper bounds of the price facet buckets, the last bucket is open-ended
+LISTING_PRICE_BUCKETS = [1000000, 2000000, 3000000, 5000000, 8000000]
+
+# Listing photo variants, generated by apps.listings.tasks
+LISTING_IMAGE_THUMBNAIL_SIZE = (480, 360)
+LISTING_IMAGE_VARIANT_WIDTHS = [640, 1280]
+LISTING_IMAGE_VARIANT_FORMATS = ['webp', 'avif']
+# Uploads are re-encoded at this quality with the longest edge capped
+LISTING_IMAGE_MAX_EDGE = 2560
+LISTING_IMAGE_JPEG_QUALITY = 82
+# threads normalizing and writing the photos of one upload, see apps.listings.attach
+LISTING_IMAGE_ATTACH_WORKERS = 4
+# also store a difference hash so re-encoded copies of a photo reuse its verdict
+LISTING_IMAGE_PERCEPTUAL_HASH = True
+
+# Per-request limits of listing photo uploads, see apps.listings.uploads
+LISTING_UPLOAD_MAX_BYTES = 60 * 1024 * 1024
+LISTING_UPLOAD_MAX_FILES = 20
+LISTING_UPLOAD_MAX_PIXELS = 50_000_000
+# Resumable uploads (apps.listings.resumable) are staged on local disk
+UPLOAD_STAGING_ROOT = BASE_DIR / 'staging'
+LISTING_UPLOAD_CHUNK_MAX_BYTES = 4 * 1024 * 1024
+LISTING_UPLOAD_SESSION_TTL = timedelta(hours=24)
 
 # Celery Configuration
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
@@ -288,10 +371,17 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Asia/Tashkent'
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+CELERY_TASK_ALWAYS_EAGER = settings.CELERY_TASK_ALWAYS_EAGER
 
 NYCKEL_TOKEN = settings.NYCKEL_TOKEN
 CLIENT_ID = settings.CLIENT_ID
 CLIENT_SECRET = settings.CLIENT_SECRET
+
+# Nyckel photo validation, see apps.listings.validation
+NYCKEL_FUNCTION_ID = 'house-presence-identifier'
+NYCKEL_REJECT_CONFIDENCE = 0.85
+NYCKEL_MAX_WORKERS = 4
+NYCKEL_TIMEOUT = 20
 FRONTEND_URL = "https://kvarthub.solohiddin.tech"
 
 GOOGLE_CLIENT_ID = settings.GOOGLE_CLIENT_ID
@@ -1,8 +1,8 @@
-from django.conf.urls.static import static
 from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 from drf_spectacular.views import (SpectacularAPIView, SpectacularSwaggerView)
+from apps.shared.media import serve_media
 # from allauth.socialaccount.providers.google.views import GoogleOAuth2Adapter
 # from dj_rest_auth.registration.views import SocialLoginView
 # from config.config import settings
@@ -19,5 +19,5 @@ urlpatterns = [
     path('api/listings/', include('apps.listings.urls')),
     path('api/shared/', include('apps.shared.urls')),
     path('api/payment/', include('apps.payment.urls')),
-
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path(f"{settings.MEDIA_URL.strip('/')}/<path:path>", serve_media, name='media'),
+]
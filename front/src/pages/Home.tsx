@@ -1,4 +1,4 @@
-import { useEffect, useMemo, useState } from "react"
+import { useCallback, useEffect, useMemo, useRef, useState } from "react"
 import { useNavigate } from "react-router-dom"
 import type { ForWhomType, ProductsType, Region } from "../types/auth"
 import { LikedFilledIcon, LikedIcon } from "../assets/icons"
@@ -7,7 +7,17 @@ import { Skleton } from "../components"
 import apiClient from "../services/api"
 import type { ListingFilters } from "../modules/Header" // pathni o'zingni strukturangga qarab to'g'rila
 
+// backend sahifa hajmi (ListingCursorPagination.page_size)
+const PAGE_SIZE = 20
 
+// `next` to'liq URL bo'lib keladi: apiClient uchun path + query qoldiramiz,
+// umumiy son faqat birinchi sahifada kerak
+function nextPageUrl(next?: string | null) {
+  if (!next) return null
+  const url = new URL(next, window.location.origin)
+  url.searchParams.delete("with_count")
+  return `${url.pathname}${url.search}`
+}
 
 
 const Home = () => {
@@ -15,6 +25,10 @@ const Home = () => {
   const [products, setProducts] = useState<ProductsType[]>([])
   const [loading, setLoading] = useState(false)
   const [productsCount, setProductsCount] = useState<number>(0)
+  const [nextUrl, setNextUrl] = useState<string | null>(null)
+  const [loadingMore, setLoadingMore] = useState(false)
+  const nextUrlRef = useRef<string | null>(null)
+  const sentinelRef = useRef<HTMLDivElement | null>(null)
   const [regions, setRegions] = useState<Region[]>([])
   const [regionsLoading, setRegionsLoading] = useState(false)
   
@@ -56,31 +70,31 @@ const Home = () => {
     return params.toString();
   }, [filters]);
 
-  // listings fetch (filter o'zgarsa qayta chaqiladi)
+  // listings fetch (filter o'zgarsa qayta chaqiladi), birinchi sahifa + umumiy soni
   useEffect(() => {
     const fetchListings = async () => {
       try {
         setLoading(true)
-
-        const url = queryString
-          ? `/api/listings/listings/?${queryString}`
-          : `/api/listings/listings/`
-
-        const response = await apiClient.get(url)
-        if (response.data?.result && Array.isArray(response.data.result)) {
-          setProducts(response.data.result)
-          setProductsCount(response.data.result.length)
-        } else if (Array.isArray(response.data)) {
-          setProducts(response.data)
-          setProductsCount(response.data.length)
+        setNextUrl(null)
+
+        const params = new URLSearchParams(queryString)
+        params.set("with_count", "1")
+        const response = await apiClient.get(`/api/listings/listings/?${params.toString()}`)
+        const result = response.data?.result
+        if (result && Array.isArray(result.results)) {
+          setProducts(result.results)
+          setProductsCount(result.total_count ?? result.results.length)
+          setNextUrl(nextPageUrl(result.next))
         } else {
           setProducts([])
           setProductsCount(0)
+          setNextUrl(null)
         }
       } catch (error) {
         console.error("Failed to fetch listings:", error)
         setProducts([])
         setProductsCount(0)
+        setNextUrl(null)
       } finally {
         setLoading(false)
       }
@@ -91,6 +105,47 @@ const Home = () => {
     return () => clearTimeout(t)
   }, [queryString])
 
+  // keyingi sahifa: backend bergan `next` cursor bo'yicha
+  const loadMore = useCallback(async () => {
+    if (!nextUrl || loadingMore) return
+    const requested = nextUrl
+    try {
+      setLoadingMore(true)
+      const response = await apiClient.get(requested)
+      const result = response.data?.result
+      // filter o'zgargan bo'lsa eski javobni tashlab yuboramiz
+      if (nextUrlRef.current !== requested) return
+      if (result && Array.isArray(result.results)) {
+        setProducts((prev) => [...prev, ...result.results])
+        setNextUrl(nextPageUrl(result.next))
+      } else {
+        setNextUrl(null)
+      }
+    } catch (error) {
+      console.error("Failed to fetch more listings:", error)
+    } finally {
+      setLoadingMore(false)
+    }
+  }, [nextUrl, loadingMore])
+
+  useEffect(() => {
+    nextUrlRef.current = nextUrl
+  }, [nextUrl])
+
+  // infinite scroll: ro'yxat oxiri ko'ringanda keyingi sahifa
+  useEffect(() => {
+    const sentinel = sentinelRef.current
+    if (!sentinel || !nextUrl) return
+    const observer = new IntersectionObserver(
+      (entries) => {
+        if (entries[0].isIntersecting) loadMore()
+      },
+      { rootMargin: "400px" }
+    )
+    observer.observe(sentinel)
+    return () => observer.disconnect()
+  }, [nextUrl, loadMore])
+
   // regions fetch
   useEffect(() => {
     const fetchRegions = async () => {
@@ -189,7 +244,7 @@ const Home = () => {
         )}
       </ul>
 
-      <Skleton loading={loading} productsCount={productsCount} />
+      <Skleton loading={loading} productsCount={Math.min(productsCount || PAGE_SIZE, PAGE_SIZE)} />
 
       {!loading && products.length === 0 && (
         <div className="containers py-10 text-center">
@@ -251,6 +306,18 @@ const Home = () => {
 </div>
       )}
 
+      {!loading && nextUrl && (
+        <div ref={sentinelRef} className="containers pb-20 flex justify-center">
+          <button
+            onClick={loadMore}
+            disabled={loadingMore}
+            className="py-[13px] px-6 rounded-[30px] bg-[#0000000D] hover:bg-gray-300 transition disabled:text-gray-500"
+          >
+            {loadingMore ? "Loading..." : `Load more (${products.length} / ${productsCount})`}
+          </button>
+        </div>
+      )}
+
       <Footer />
     </div>
   )